@@ -0,0 +1,81 @@
+import os
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import FileResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from typing import List
+from app.models.request import ProfilingRequest, SnapshotRestoreRequest
+from app.models.response import ProfilingSessionResponse, SnapshotResult
+from app.services.profiling import request_profiler, ProfilingSessionActive
+from app.services.document_lifecycle import document_lifecycle
+from app.services.index_snapshot import SnapshotError
+from app.core.config import ADMIN_TOKEN
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+security = HTTPBearer()
+
+def verify_admin_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Verify the Bearer token for the admin endpoints."""
+    if credentials.scheme.lower() != "bearer":
+        raise HTTPException(status_code=401, detail="Invalid authentication scheme")
+    if credentials.credentials != ADMIN_TOKEN:
+        logger.warning(f"Unauthorized admin access attempt with token: {credentials.credentials[:10]}...")
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+@router.post("/api/v1/admin/profiling", response_model=ProfilingSessionResponse, status_code=202)
+async def start_profiling(request: ProfilingRequest, auth: HTTPAuthorizationCredentials = Depends(verify_admin_token)):
+    """
+    Profile the next `requests` /run requests and/or the next `seconds`.
+    
+    Writes per-stage collapsed-stack flame graph files (and tracemalloc allocations with
+    `memory`) to the session's output directory when the session ends.
+    
+    `sample_rate` picks which requests open a sampling window, but samples are taken from
+    every thread in the process, so concurrent unsampled requests appear in them too.
+    """
+    try:
+        session = request_profiler.start(request.requests, request.seconds, request.sample_rate,
+                                         request.memory, request.interval_ms)
+    except ProfilingSessionActive as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return session.to_dict()
+
+@router.delete("/api/v1/admin/profiling", response_model=ProfilingSessionResponse)
+async def stop_profiling(auth: HTTPAuthorizationCredentials = Depends(verify_admin_token)):
+    """End the running profiling session now and write its output."""
+    session = await request_profiler.stop()
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiling session is running")
+    return session.to_dict()
+
+@router.get("/api/v1/admin/profiling", response_model=List[ProfilingSessionResponse])
+async def list_profiling_sessions(auth: HTTPAuthorizationCredentials = Depends(verify_admin_token)):
+    """List recent profiling sessions, newest last."""
+    return [session.to_dict() for session in request_profiler.list_sessions()]
+
+@router.get("/api/v1/admin/profiling/{session_id}/{filename}")
+async def get_profiling_file(session_id: str, filename: str,
+                             auth: HTTPAuthorizationCredentials = Depends(verify_admin_token)):
+    """Download one output file of a finished session."""
+    session = request_profiler.get_session(session_id)
+    if session is None or filename not in session.files:
+        raise HTTPException(status_code=404, detail=f"No file {filename} in profiling session {session_id}")
+    return FileResponse(os.path.join(session.output_dir, filename), media_type="text/plain", filename=filename)
+
+@router.post("/api/v1/admin/index/snapshot", response_model=SnapshotResult)
+async def restore_index_snapshot(request: SnapshotRestoreRequest,
+                                 auth: HTTPAuthorizationCredentials = Depends(verify_admin_token)):
+    """
+    Hot-swap the FAISS index for a snapshot built by `python -m app.services.bulk_indexer`.
+    
+    The snapshot is verified before anything changes; queries keep using the current
+    index until the atomic swap. Documents ingested since the snapshot was built are dropped
+    and answer 404 afterwards.
+    """
+    try:
+        return await document_lifecycle.restore_snapshot(request.path)
+    except SnapshotError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,54 @@
+import os
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import FileResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from typing import List
+from app.models.request import BatchRequest
+from app.models.response import BatchRunResponse
+from app.services.batch_eval import batch_evaluator, BatchAlreadyRunning
+from app.api.hackrx import verify_token
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.post("/api/v1/batch", response_model=BatchRunResponse, status_code=202)
+async def submit_batch(request: BatchRequest, auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """
+    Start a batch evaluation of many documents and their questions.
+    
+    Results are written as JSON Lines while the batch runs. Resubmitting a batch_id resumes
+    that batch, skipping documents and questions it already finished.
+
+    Batch traffic is not admission-controlled: it is bounded by the BATCH_* concurrency
+    limits and shares OpenAI capacity with live requests only through the rate limiters.
+    """
+    try:
+        run = batch_evaluator.submit(request.items, request.batch_id)
+    except BatchAlreadyRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return run.to_dict()
+
+@router.get("/api/v1/batch", response_model=List[BatchRunResponse])
+async def list_batches(auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """List batches started since the server came up (the last BATCH_RUN_HISTORY finished ones)."""
+    return [run.to_dict() for run in batch_evaluator.list_runs()]
+
+@router.get("/api/v1/batch/{batch_id}", response_model=BatchRunResponse)
+async def get_batch(batch_id: str, auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """Get the progress and throughput of a batch."""
+    run = batch_evaluator.get_run(batch_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    return run.to_dict()
+
+@router.get("/api/v1/batch/{batch_id}/results")
+async def get_batch_results(batch_id: str, auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """Download the JSON Lines results written so far."""
+    run = batch_evaluator.get_run(batch_id)
+    if run is None or not os.path.exists(run.output_path):
+        raise HTTPException(status_code=404, detail=f"No results for batch {batch_id}")
+    return FileResponse(run.output_path, media_type="application/x-ndjson", filename=f"{batch_id}.jsonl")
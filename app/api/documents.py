@@ -0,0 +1,73 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.security import HTTPAuthorizationCredentials
+from typing import List, Optional
+from app.models.request import DocumentIngestRequest
+from app.models.response import (
+    IngestionJobResponse, IngestionQueueStats, DocumentDeleteResponse, CompactionResult, LifecycleStats
+)
+from app.services.ingestion_jobs import ingestion_queue, IngestionQueueFull
+from app.services.document_lifecycle import document_lifecycle
+from app.services.embedding_pipeline import get_faiss_index
+from app.api.hackrx import verify_token
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.post("/api/v1/documents", response_model=IngestionJobResponse, status_code=202)
+async def submit_document(request: DocumentIngestRequest, auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """
+    Queue a document for background ingestion.
+    
+    The returned document_id can be passed to /api/v1/hackrx/run once the job has completed.
+    """
+    try:
+        job = ingestion_queue.submit(request.documents)
+    except IngestionQueueFull as e:
+        logger.warning(f"Rejected ingestion request: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    return job.to_dict()
+
+@router.get("/api/v1/documents/jobs", response_model=List[IngestionJobResponse])
+async def list_ingestion_jobs(status: Optional[str] = None, auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """List known ingestion jobs, optionally filtered by status."""
+    return [job.to_dict() for job in ingestion_queue.list_jobs(status)]
+
+@router.get("/api/v1/documents/jobs/{job_id}", response_model=IngestionJobResponse)
+async def get_ingestion_job(job_id: str, auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """Get the status of a single ingestion job."""
+    job = ingestion_queue.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.to_dict()
+
+@router.get("/api/v1/documents/queue", response_model=IngestionQueueStats)
+async def get_ingestion_queue_stats(auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """Get ingestion queue depth and worker utilisation."""
+    return ingestion_queue.get_stats()
+
+@router.get("/api/v1/documents/lifecycle", response_model=LifecycleStats)
+async def get_lifecycle_stats(auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """Get retention settings, deletion counts and recent compactions (durations, reclaimed bytes)."""
+    index_stats = await asyncio.to_thread(get_faiss_index().get_stats)
+    return {**document_lifecycle.get_stats(), 'index': index_stats}
+
+@router.post("/api/v1/documents/compact", response_model=CompactionResult)
+async def compact_index(auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """Rebuild the index without deleted vectors now. Queries keep being served meanwhile."""
+    return await document_lifecycle.compact()
+
+@router.delete("/api/v1/documents/{document_id}", response_model=DocumentDeleteResponse)
+async def delete_document(document_id: str, auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """
+    Delete a document: its vectors are tombstoned immediately and its database rows removed.
+    
+    Index space is reclaimed by background compaction once enough of it is deleted.
+    """
+    result = await asyncio.to_thread(document_lifecycle.delete_document, document_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Document {document_id} not found")
+    document_lifecycle.schedule_compaction_check()
+    return result
@@ -1,10 +1,14 @@
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+from typing import Optional
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.models.request import HackrxRequest
-from app.models.response import HackrxResponse
-from app.services.pipeline import process_query_pipeline
-from app.core.config import HACKRX_TOKEN
+from app.models.response import HackrxResponse, AdmissionStats
+from app.services.pipeline import process_query_pipeline, DocumentNotIndexedError
+from app.services.deadline import Deadline
+from app.services.llm_client import LLMError
+from app.services.admission import admission_controller, AdmissionRejected
+from app.core.config import HACKRX_TOKEN, REQUEST_DEADLINE_SECONDS
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,22 +31,47 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
         raise HTTPException(status_code=403, detail="Unauthorized")
 
 @router.post("/api/v1/hackrx/run", response_model=HackrxResponse)
-async def run_hackrx(request: HackrxRequest, auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+async def run_hackrx(request: HackrxRequest, response: Response,
+                     auth: HTTPAuthorizationCredentials = Depends(verify_token),
+                     x_request_deadline: Optional[float] = Header(None)):
     """
     Main endpoint for document upload and question answering.
     
+    Requests pass admission control first: under load they queue briefly (pre-ingested
+    documents and small question sets first) or are rejected with 429/503 and Retry-After.
+    
     Args:
         request: HackrxRequest containing documents and questions
+        response: Response, carrying the X-Queue-Wait-Ms header
         auth: Authentication credentials
+        x_request_deadline: Optional end-to-end deadline in seconds (X-Request-Deadline header)
         
     Returns:
         HackrxResponse with answers for all questions
     """
     try:
         logger.info(f"Processing request with {len(request.questions)} questions")
-        result = await process_query_pipeline(request)
+        # Started before admission so time spent queued counts against the deadline
+        deadline = Deadline(x_request_deadline if x_request_deadline and x_request_deadline > 0 else REQUEST_DEADLINE_SECONDS)
+        inline_document = request.document_id is None
+        async with admission_controller.admit(len(request.questions), inline_document, deadline) as waited:
+            response.headers["X-Queue-Wait-Ms"] = f"{waited * 1000:.0f}"
+            result = await process_query_pipeline(request, deadline)
         logger.info(f"Successfully processed request, returning {len(result.answers)} answers")
         return result
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected request: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DocumentNotIndexedError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except LLMError as e:
+        logger.error(f"LLM failed while answering: {e}")
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/v1/hackrx/admission", response_model=AdmissionStats)
+async def get_admission_stats(auth: HTTPAuthorizationCredentials = Depends(verify_token)):
+    """Get load, admission queue depth, rejections and queue wait times for the run endpoint."""
+    return admission_controller.get_stats()
@@ -1,12 +1,12 @@
 import os
+import tempfile
+from typing import List
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # OpenAI Configuration
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise RuntimeError("OPENAI_API_KEY is required. Please set it in your .env file.")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")  # Checked by validate_config() at startup, not on import
 
 # Database Configuration
 POSTGRES_URL = os.getenv("POSTGRES_URL", "sqlite:///./hackrx.db")
@@ -18,8 +18,17 @@ if not POSTGRES_URL:
 FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_index")
 FAISS_DIMENSION = int(os.getenv("FAISS_DIMENSION", "1536"))  # text-embedding-3-small uses 1536 dimensions
 
+# FAISS Sharding Configuration (FAISS_SHARDS > 1 enables the sharded index)
+FAISS_SHARDS = int(os.getenv("FAISS_SHARDS", "0"))
+FAISS_SHARD_SOCKET_DIR = os.getenv("FAISS_SHARD_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "faiss_shards"))
+FAISS_SHARD_SPAWN = os.getenv("FAISS_SHARD_SPAWN", "true").lower() == "true"  # false: connect to shards started with `serve-all`
+FAISS_SHARD_CONNECTIONS = int(os.getenv("FAISS_SHARD_CONNECTIONS", "4"))  # Socket connections per shard
+
 # HackRX Token
 HACKRX_TOKEN = os.getenv("HACKRX_TOKEN", "d1b791fa0ef5092d9cd051b2b09df2473d1e2ea07e09fe6c61abb5722dfbc7d3")
+# Shared secret for shard IPC, which unpickles what it receives; required when FAISS_SHARDS > 1
+FAISS_SHARD_AUTHKEY = os.getenv("FAISS_SHARD_AUTHKEY")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Bearer token for /api/v1/admin endpoints; unset disables them
 
 # Logging Configuration
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -31,3 +40,130 @@ CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
 # LLM Configuration
 LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")  # Changed to gpt-3.5-turbo
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")  # Updated to newer model
+
+# Embedding Provider Configuration
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai, local or hashing
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "")  # Local model directory for the local provider
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))  # Time to coalesce concurrent requests
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "2"))
+
+# Background Ingestion Configuration
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", "100"))
+INGESTION_JOB_HISTORY = int(os.getenv("INGESTION_JOB_HISTORY", "1000"))  # Finished jobs kept for status lookups
+
+# OpenAI Rate Limit Configuration (per-minute budgets; adapted at runtime from x-ratelimit-* headers, 0 = unlimited)
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "500"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "200000"))
+EMBEDDING_RPM_LIMIT = int(os.getenv("EMBEDDING_RPM_LIMIT", "3000"))
+EMBEDDING_TPM_LIMIT = int(os.getenv("EMBEDDING_TPM_LIMIT", "1000000"))
+RATE_LIMIT_HEADROOM = float(os.getenv("RATE_LIMIT_HEADROOM", "0.9"))  # Fraction of the quota to use
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "6"))
+RATE_LIMIT_BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "0.5"))  # Seconds
+RATE_LIMIT_BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", "30"))  # Seconds
+RATE_LIMIT_THREADS = int(os.getenv("RATE_LIMIT_THREADS", "16"))  # Threads per API for queued and in-flight calls
+
+# Request Deadline Configuration (overridable per request with the X-Request-Deadline header, in seconds)
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+DEADLINE_INGESTION_FRACTION = float(os.getenv("DEADLINE_INGESTION_FRACTION", "0.5"))  # Share for download/parse/embed
+DEADLINE_RESPONSE_MARGIN = float(os.getenv("DEADLINE_RESPONSE_MARGIN", "0.5"))  # Seconds kept for building the response
+
+# Retrieval Confidence (logistic calibration of FAISS cosine scores; below the threshold the LLM is skipped)
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))  # Matches per question used to judge confidence
+RETRIEVAL_CONTEXT_CHUNKS = int(os.getenv("RETRIEVAL_CONTEXT_CHUNKS", "2"))  # Best matches passed to the LLM
+RETRIEVAL_CONFIDENCE_THRESHOLD = float(os.getenv("RETRIEVAL_CONFIDENCE_THRESHOLD", "0.2"))  # 0 disables gating
+RETRIEVAL_CONFIDENCE_CENTER = float(os.getenv("RETRIEVAL_CONFIDENCE_CENTER", "0.25"))  # Top cosine score at 50% confidence
+RETRIEVAL_CONFIDENCE_SCALE = float(os.getenv("RETRIEVAL_CONFIDENCE_SCALE", "0.05"))  # Score change per e-fold of odds
+RETRIEVAL_CONFIDENCE_MARGIN_WEIGHT = float(os.getenv("RETRIEVAL_CONFIDENCE_MARGIN_WEIGHT", "0.5"))  # Weight of top-vs-rest margin
+
+# Admission Control for /api/v1/hackrx/run
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_QUESTIONS = int(os.getenv("ADMISSION_MAX_QUESTIONS", "64"))  # Questions being answered at once
+ADMISSION_MAX_INGEST_BYTES = int(os.getenv("ADMISSION_MAX_INGEST_BYTES", str(256 * 1024 * 1024)))  # Inline documents in flight
+ADMISSION_DOCUMENT_BYTES = int(os.getenv("ADMISSION_DOCUMENT_BYTES", str(8 * 1024 * 1024)))  # Held per inline document until its download reports the real size
+ADMISSION_MAX_UPSTREAM_WAITING = int(os.getenv("ADMISSION_MAX_UPSTREAM_WAITING", "32"))  # OpenAI calls queued at the rate limiters
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))  # Requests waiting for admission; beyond this -> 429
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))  # Seconds a request may wait; then 503
+
+# Hedged LLM Requests
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))  # Send a duplicate once a call exceeds this latency percentile
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8"))  # Seconds, used until enough latencies are observed
+
+# Email Attachment Processing
+EMAIL_ATTACHMENT_WORKERS = int(os.getenv("EMAIL_ATTACHMENT_WORKERS", "2"))  # Processes parsing PDF/DOCX attachments
+EMAIL_ATTACHMENT_MAX_BYTES = int(os.getenv("EMAIL_ATTACHMENT_MAX_BYTES", str(20 * 1024 * 1024)))  # Larger attachments are skipped
+EMAIL_ATTACHMENT_TIMEOUT = float(os.getenv("EMAIL_ATTACHMENT_TIMEOUT", "20"))  # Seconds per attachment
+
+# Document Retention and Index Compaction (0 disables a policy)
+DOCUMENT_TTL_SECONDS = float(os.getenv("DOCUMENT_TTL_SECONDS", "0"))  # Delete documents not queried for this long
+DOCUMENT_MAX_COUNT = int(os.getenv("DOCUMENT_MAX_COUNT", "0"))  # Above this, delete least recently queried documents
+DOCUMENT_SWEEP_INTERVAL = float(os.getenv("DOCUMENT_SWEEP_INTERVAL", "300"))  # Seconds between retention sweeps
+COMPACTION_MIN_DEAD_FRACTION = float(os.getenv("COMPACTION_MIN_DEAD_FRACTION", "0.2"))  # Compact once this share of vectors is deleted
+COMPACTION_HISTORY = int(os.getenv("COMPACTION_HISTORY", "20"))  # Recent compactions kept for stats
+
+# Batch Evaluation (limits are shared by all running batches)
+BATCH_DOCUMENT_CONCURRENCY = int(os.getenv("BATCH_DOCUMENT_CONCURRENCY", "8"))  # Documents being ingested or answered at once
+BATCH_INGEST_CONCURRENCY = int(os.getenv("BATCH_INGEST_CONCURRENCY", "4"))  # Concurrent document ingestions
+BATCH_QUESTION_CONCURRENCY = int(os.getenv("BATCH_QUESTION_CONCURRENCY", "32"))  # Concurrent questions being answered
+BATCH_OUTPUT_DIR = os.getenv("BATCH_OUTPUT_DIR", "batch_results")  # JSONL results of batches submitted through the API
+BATCH_RUN_HISTORY = int(os.getenv("BATCH_RUN_HISTORY", "100"))  # Finished batches kept for status lookups
+
+# Bulk Indexing and Index Snapshots (python -m app.services.bulk_indexer)
+BULK_INDEX_WORKERS = int(os.getenv("BULK_INDEX_WORKERS", str(os.cpu_count() or 1)))  # Document parsing processes
+BULK_EMBED_BATCH_SIZE = int(os.getenv("BULK_EMBED_BATCH_SIZE", "512"))  # Chunks per embedding request
+BULK_EMBED_CONCURRENCY = int(os.getenv("BULK_EMBED_CONCURRENCY", "4"))  # Embedding requests in flight
+SNAPSHOT_OUTPUT_DIR = os.getenv("SNAPSHOT_OUTPUT_DIR", "snapshots")  # Where the bulk indexer writes snapshot versions
+FAISS_SNAPSHOT_PATH = os.getenv("FAISS_SNAPSHOT_PATH", "")  # Restore this snapshot at startup if the index is empty
+
+# On-demand Profiling (started through /api/v1/admin/profiling)
+PROFILING_OUTPUT_DIR = os.getenv("PROFILING_OUTPUT_DIR", "profiles")
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", "5"))  # Stack sampling interval
+PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "600"))  # Upper bound on any session's length
+PROFILING_TRACEMALLOC_FRAMES = int(os.getenv("PROFILING_TRACEMALLOC_FRAMES", "25"))  # Stack depth kept per allocation
+
+# Startup Configuration
+STARTUP_WARM_INDEX = os.getenv("STARTUP_WARM_INDEX", "true").lower() == "true"  # false: load the FAISS index on first use
+STARTUP_REPORT_PATH = os.getenv("STARTUP_REPORT_PATH", "")  # Write the startup profiling report here as JSON
+
+def require_openai_api_key() -> str:
+    """Return the OpenAI API key, raising if it is not configured."""
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is required. Please set it in your .env file.")
+    return OPENAI_API_KEY
+
+def require_shard_authkey() -> bytes:
+    """Return the shard IPC authkey, raising if it is not configured or reuses the API token."""
+    if not FAISS_SHARD_AUTHKEY:
+        raise RuntimeError("FAISS_SHARD_AUTHKEY is required when FAISS_SHARDS > 1.")
+    if FAISS_SHARD_AUTHKEY == HACKRX_TOKEN:
+        raise RuntimeError("FAISS_SHARD_AUTHKEY must differ from HACKRX_TOKEN.")
+    return FAISS_SHARD_AUTHKEY.encode()
+
+def validate_config() -> List[str]:
+    """
+    Check settings that cannot be validated by their defaults.
+
+    Called during application startup rather than at import, so tools and health
+    checks can import the config without a complete environment.
+
+    Returns:
+        List of problems; empty if the configuration is usable
+    """
+    problems = []
+    if not OPENAI_API_KEY:
+        problems.append("OPENAI_API_KEY is required. Please set it in your .env file.")
+    if EMBEDDING_PROVIDER == "local" and not EMBEDDING_MODEL_PATH:
+        problems.append("EMBEDDING_MODEL_PATH is required when EMBEDDING_PROVIDER=local.")
+    if not 0 < RATE_LIMIT_HEADROOM <= 1:
+        problems.append("RATE_LIMIT_HEADROOM must be in (0, 1].")
+    if not 0 < DEADLINE_INGESTION_FRACTION <= 1:
+        problems.append("DEADLINE_INGESTION_FRACTION must be in (0, 1].")
+    if ADMIN_TOKEN and ADMIN_TOKEN == HACKRX_TOKEN:
+        problems.append("ADMIN_TOKEN must differ from HACKRX_TOKEN.")
+    if FAISS_SHARDS > 1 and not FAISS_SHARD_AUTHKEY:
+        problems.append("FAISS_SHARD_AUTHKEY is required when FAISS_SHARDS > 1.")
+    if FAISS_SHARD_AUTHKEY and FAISS_SHARD_AUTHKEY == HACKRX_TOKEN:
+        problems.append("FAISS_SHARD_AUTHKEY must differ from HACKRX_TOKEN.")
+    return problems
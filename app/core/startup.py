@@ -0,0 +1,166 @@
+# Startup profiling: init stage timings and module import times for cold-start tracking
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Set when this module is first imported, which app.main does before anything else
+_IMPORT_STARTED = time.perf_counter()
+
+STAGE_RUNNING = "running"
+STAGE_OK = "ok"
+STAGE_FAILED = "failed"
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\S+)$")
+
+
+class StartupProfiler:
+    """Records how long each startup stage took and whether it succeeded."""
+
+    def __init__(self):
+        self._stages: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.import_seconds: Optional[float] = None
+        self.serving_after: Optional[float] = None
+
+    def mark_imported(self):
+        """Record the time spent importing the application, up to the start of the lifespan."""
+        if self.import_seconds is None:
+            self.import_seconds = time.perf_counter() - _IMPORT_STARTED
+
+    def mark_serving(self):
+        """Record the time from app import to accepting requests."""
+        self.serving_after = time.perf_counter() - _IMPORT_STARTED
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as startup stage `name`. Exceptions are recorded and re-raised."""
+        entry = {'status': STAGE_RUNNING, 'seconds': None, 'error': None}
+        with self._lock:
+            self._stages[name] = entry
+        start = time.perf_counter()
+        try:
+            yield entry
+        except BaseException as e:
+            entry['status'] = STAGE_FAILED
+            entry['error'] = str(e) or type(e).__name__
+            raise
+        else:
+            entry['status'] = STAGE_OK
+        finally:
+            entry['seconds'] = time.perf_counter() - start
+            logger.info(f"Startup stage {name}: {entry['status']} in {entry['seconds']:.3f}s")
+
+    def status(self, name: str) -> Optional[str]:
+        with self._lock:
+            entry = self._stages.get(name)
+            return entry['status'] if entry else None
+
+    def report(self) -> Dict:
+        with self._lock:
+            stages = {name: dict(entry) for name, entry in self._stages.items()}
+        return {
+            'import_seconds': self.import_seconds,
+            'serving_after_seconds': self.serving_after,
+            'stages': stages
+        }
+
+    def write_report(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        logger.info(f"Wrote startup report to {path}")
+
+
+startup_profiler = StartupProfiler()
+
+
+def measure_imports(module: str = "app.main", top: int = 15) -> Dict:
+    """
+    Import `module` in a fresh interpreter with -X importtime and summarise the result.
+
+    Runs out of process so the numbers are true cold-import times, unaffected by
+    modules already loaded here.
+
+    Returns:
+        Dict with the total import time and the slowest top-level packages and modules
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=dict(os.environ)
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, name = match.groups()
+            modules.append({
+                'module': name,
+                'self_ms': int(self_us) / 1000,
+                'cumulative_ms': int(cumulative_us) / 1000
+            })
+
+    total = next((m['cumulative_ms'] for m in modules if m['module'] == module), None)
+    packages: Dict[str, float] = {}
+    for m in modules:
+        # The first import of a top-level package is the one that pays for it
+        root = m['module'].split(".")[0]
+        if m['module'] == root:
+            packages[root] = max(packages.get(root, 0.0), m['cumulative_ms'])
+    slowest_packages = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    slowest_modules = sorted(modules, key=lambda m: m['self_ms'], reverse=True)[:top]
+    return {
+        'module': module,
+        'total_ms': total,
+        'modules_imported': len(modules),
+        'slowest_packages': [{'package': name, 'cumulative_ms': ms} for name, ms in slowest_packages],
+        'slowest_modules': [{'module': m['module'], 'self_ms': m['self_ms']} for m in slowest_modules]
+    }
+
+
+async def _profile_startup() -> Dict:
+    from app.main import app
+    # Under `python -m` this file is __main__; the app records into the importable module's profiler
+    from app.core.startup import startup_profiler as app_profiler
+
+    # Run the real lifespan so stage timings match what the server does on boot
+    async with app.router.lifespan_context(app):
+        pass
+    return app_profiler.report()
+
+
+def main(argv: List[str] = None):
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Report application cold-start import and init times")
+    parser.add_argument("--module", default="app.main", help="Module whose import is measured")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest packages/modules to list")
+    parser.add_argument("--no-init", action="store_true", help="Only measure imports; skip the startup stages")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = {'imports': measure_imports(args.module, args.top)}
+    if not args.no_init:
+        report['startup'] = asyncio.run(_profile_startup())
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
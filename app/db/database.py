@@ -1,28 +1,57 @@
 # Database connection setup
 
+import threading
+from typing import Optional
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.core.config import POSTGRES_URL
 
-if not POSTGRES_URL:
-    raise RuntimeError("POSTGRES_URL is not set. Please check your .env file and set the correct database URL.")
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
 
-engine = create_engine(POSTGRES_URL, echo=False, future=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def get_engine() -> Engine:
+    """Return the database engine, creating it (and loading the DB driver) on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if not POSTGRES_URL:
+                    raise RuntimeError("POSTGRES_URL is not set. Please check your .env file and set the correct database URL.")
+                _engine = create_engine(POSTGRES_URL, echo=False, future=True)
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+class _LazySessionMaker(sessionmaker):
+    """sessionmaker that binds to the engine the first time a session is opened."""
+
+    def __call__(self, **local_kw):
+        get_engine()
+        return super().__call__(**local_kw)
+
+SessionLocal = _LazySessionMaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
+def __getattr__(name):
+    # `engine` is still importable by name, but is only created when first accessed
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # ORM models for document/question/answer tracking
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, JSON
+from sqlalchemy import Column, Integer, Float, String, Text, ForeignKey, DateTime, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 class Document(Base):
     __tablename__ = "documents"
     id = Column(Integer, primary_key=True, index=True)
+    doc_uid = Column(String(64), unique=True, index=True, nullable=True)  # FAISS doc_id of the indexed chunks
     name = Column(String(256), nullable=False)
     source_url = Column(Text, nullable=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
+    last_queried_at = Column(DateTime, nullable=True, index=True)  # Drives LRU eviction
     # Relationship
     questions = relationship("Question", back_populates="document")
 
@@ -43,7 +72,7 @@ class Answer(Base):
     answer_text = Column(Text, nullable=False)
     rationale = Column(Text, nullable=True)
     clause_reference = Column(Text, nullable=True)
-    score = Column(Integer, nullable=True)
+    score = Column(Float, nullable=True)  # Retrieval confidence, 0-1
     created_at = Column(DateTime, default=datetime.utcnow)
     extra_data = Column(JSON, nullable=True)
     # Relationship
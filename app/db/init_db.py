@@ -1,17 +1,79 @@
-from app.db.database import engine, Base
+from sqlalchemy import inspect, text
+from app.db.database import get_engine, Base
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Columns added to tables after they were first created; create_all() never alters an existing table
+ADDED_COLUMNS = [
+    ("documents", "doc_uid"),
+    ("documents", "last_queried_at"),
+]
+
+# Columns whose type changed after they were first created
+CHANGED_COLUMN_TYPES = [
+    ("answers", "score"),  # Integer -> Float (retrieval confidence)
+]
+
+def _add_column(engine, table_name: str, column_name: str):
+    column = Base.metadata.tables[table_name].c[column_name]
+    ddl_type = column.type.compile(dialect=engine.dialect)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl_type}"))
+    except Exception:
+        # Another worker starting against the same database may have added it first
+        if column_name not in {c['name'] for c in inspect(engine).get_columns(table_name)}:
+            raise
+    # Constraints such as UNIQUE cannot be part of ADD COLUMN on SQLite; they come from the column's index
+    for index in column.table.indexes:
+        if column_name in index.columns:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception:
+                if index.name not in {i['name'] for i in inspect(engine).get_indexes(table_name)}:
+                    raise
+    logger.info(f"Added column {table_name}.{column_name}")
+
+def _change_column_type(engine, table_name: str, column_name: str):
+    column = Base.metadata.tables[table_name].c[column_name]
+    ddl_type = column.type.compile(dialect=engine.dialect)
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {column_name} TYPE {ddl_type} "
+                          f"USING {column_name}::{ddl_type}"))
+    logger.info(f"Changed type of {table_name}.{column_name} to {ddl_type}")
+
+def upgrade_schema(engine=None):
+    """Bring tables created by an earlier version up to date. Safe to run on every start."""
+    engine = engine or get_engine()
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    for table_name, column_name in ADDED_COLUMNS:
+        if table_name not in tables:
+            continue
+        if column_name not in {c['name'] for c in inspector.get_columns(table_name)}:
+            _add_column(engine, table_name, column_name)
+    # SQLite columns are dynamically typed (an INTEGER column keeps 0.62 as a REAL) and cannot be altered
+    if engine.dialect.name == "sqlite":
+        return
+    for table_name, column_name in CHANGED_COLUMN_TYPES:
+        if table_name not in tables:
+            continue
+        expected = type(Base.metadata.tables[table_name].c[column_name].type)
+        current = next(c['type'] for c in inspector.get_columns(table_name) if c['name'] == column_name)
+        if not isinstance(current, expected):
+            _change_column_type(engine, table_name, column_name)
+
 def init_database():
-    """Initialize the database by creating all tables."""
+    """Initialize the database by creating all tables and upgrading existing ones."""
     try:
         # Create all tables
-        Base.metadata.create_all(bind=engine)
+        Base.metadata.create_all(bind=get_engine())
+        upgrade_schema()
         logger.info("Database tables created successfully")
     except Exception as e:
         logger.error(f"Failed to create database tables: {e}")
         raise RuntimeError(f"Database initialization failed: {e}")
 
 if __name__ == "__main__":
-    init_database() 
\ No newline at end of file
+    init_database()
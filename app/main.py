@@ -1,8 +1,21 @@
+from app.core.startup import startup_profiler, STAGE_OK
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.api import hackrx
+from fastapi.responses import JSONResponse
+from app.api import hackrx, documents, batch, admin
 from app.db.init_db import init_database
+from app.services.ingestion_jobs import ingestion_queue
+from app.services.document_lifecycle import document_lifecycle
+from app.services.batch_eval import batch_evaluator
+from app.services.profiling import request_profiler
+from app.services.embedding_pipeline import get_faiss_index, close_faiss_index
+from app.services.embedding_providers import get_embedding_provider
 import logging
-from app.core.config import LOG_LEVEL
+from app.core.config import (
+    LOG_LEVEL, STARTUP_WARM_INDEX, STARTUP_REPORT_PATH, FAISS_SNAPSHOT_PATH, ADMIN_TOKEN, EMBEDDING_PROVIDER,
+    validate_config
+)
 
 # Configure logging
 logging.basicConfig(
@@ -12,26 +25,107 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# A local embedding model takes seconds to load, so it is loaded at startup rather than by the first request
+LOAD_EMBEDDING_MODEL = EMBEDDING_PROVIDER.lower() == "local"
+WARM_UP = STARTUP_WARM_INDEX or FAISS_SNAPSHOT_PATH or LOAD_EMBEDDING_MODEL
+
+# Stages that must have succeeded before /ready reports the instance as ready
+READINESS_STAGES = ["validate_config", "init_database", "start_ingestion_queue", "start_document_lifecycle"]
+if LOAD_EMBEDDING_MODEL:
+    READINESS_STAGES.append("load_embedding_model")
+if STARTUP_WARM_INDEX or FAISS_SNAPSHOT_PATH:
+    READINESS_STAGES.append("load_index")
+if FAISS_SNAPSHOT_PATH:
+    READINESS_STAGES.append("restore_snapshot")
+
+def _finish_startup():
+    report = startup_profiler.report()
+    stages = ", ".join(f"{name}={entry['seconds']:.3f}s" for name, entry in report['stages'].items())
+    logger.info(f"Startup report: imports={report['import_seconds']:.3f}s, "
+                f"serving after {report['serving_after_seconds']:.3f}s; {stages}")
+    if STARTUP_REPORT_PATH:
+        startup_profiler.write_report(STARTUP_REPORT_PATH)
+
+async def _warm_up():
+    """Load the embedding model and FAISS index in worker threads so the server accepts connections meanwhile."""
+    if LOAD_EMBEDDING_MODEL:
+        try:
+            with startup_profiler.stage("load_embedding_model"):
+                await asyncio.to_thread(get_embedding_provider)
+        except Exception as e:
+            logger.error(f"Failed to load local embedding model: {e}")
+    if STARTUP_WARM_INDEX or FAISS_SNAPSHOT_PATH:
+        try:
+            with startup_profiler.stage("load_index"):
+                await asyncio.to_thread(get_faiss_index)
+            if FAISS_SNAPSHOT_PATH:
+                # New replicas start from a prebuilt snapshot instead of re-ingesting
+                with startup_profiler.stage("restore_snapshot"):
+                    await document_lifecycle.restore_snapshot(FAISS_SNAPSHOT_PATH, if_empty=True)
+        except Exception as e:
+            logger.error(f"Failed to load FAISS index{' snapshot' if FAISS_SNAPSHOT_PATH else ''}: {e}")
+    _finish_startup()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize subsystems on startup and release them on shutdown."""
+    startup_profiler.mark_imported()
+    try:
+        with startup_profiler.stage("validate_config"):
+            problems = validate_config()
+            if problems:
+                raise RuntimeError("; ".join(problems))
+    except RuntimeError as e:
+        # Reported through /ready instead of preventing the process from starting
+        logger.error(f"Invalid configuration: {e}")
+
+    try:
+        # Initialize database
+        with startup_profiler.stage("init_database"):
+            init_database()
+        # Start background ingestion workers
+        with startup_profiler.stage("start_ingestion_queue"):
+            await ingestion_queue.start()
+        # Start retention sweeps and background compaction
+        with startup_profiler.stage("start_document_lifecycle"):
+            await document_lifecycle.start()
+    except Exception as e:
+        logger.error(f"Failed to start application: {e}")
+        raise
+
+    warmup = asyncio.create_task(_warm_up()) if WARM_UP else None
+    startup_profiler.mark_serving()
+    if warmup is None:
+        _finish_startup()
+    logger.info("Application started successfully")
+
+    yield
+
+    # Stop background workers
+    if warmup is not None:
+        await warmup
+    await request_profiler.stop()
+    await batch_evaluator.stop()
+    await ingestion_queue.stop()
+    await document_lifecycle.stop()
+    close_faiss_index()
+
 # Create FastAPI app
 app = FastAPI(
     title="LLM-Powered Intelligent Query-Retrieval System",
     description="An intelligent system for processing documents and answering questions using FAISS vector search and GPT-4",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Include routers
 app.include_router(hackrx.router)
-
-@app.on_event("startup")
-async def startup_event():
-    """Initialize the application on startup."""
-    try:
-        # Initialize database
-        init_database()
-        logger.info("Application started successfully")
-    except Exception as e:
-        logger.error(f"Failed to start application: {e}")
-        raise
+app.include_router(documents.router)
+app.include_router(batch.router)
+if ADMIN_TOKEN:
+    app.include_router(admin.router)
+else:
+    logger.info("ADMIN_TOKEN is not set; /api/v1/admin endpoints are disabled")
 
 @app.get("/")
 async def root():
@@ -41,3 +135,19 @@ async def root():
         "version": "1.0.0",
         "status": "running"
     }
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness endpoint: 200 once configuration, database, ingestion workers and
+    (unless STARTUP_WARM_INDEX is off) the FAISS index are ready, 503 until then.
+    /health only reports that the process is up.
+    """
+    report = startup_profiler.report()
+    checks = {name: startup_profiler.status(name) or "pending" for name in READINESS_STAGES}
+    ready = all(status == STAGE_OK for status in checks.values())
+    errors = {name: entry['error'] for name, entry in report['stages'].items() if entry['error']}
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "checks": checks, "errors": errors, "startup": report}
+    )
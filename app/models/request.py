@@ -1,6 +1,33 @@
-from pydantic import BaseModel, HttpUrl
-from typing import List
+from pydantic import BaseModel, Field, HttpUrl, model_validator
+from typing import List, Optional
 
 class HackrxRequest(BaseModel):
-    documents: str  # URL or file path
+    documents: Optional[str] = None  # URL or file path
+    document_id: Optional[str] = None  # ID of a document already indexed via /api/v1/documents
     questions: List[str]
+
+    @model_validator(mode="after")
+    def check_document_source(self):
+        if not self.documents and not self.document_id:
+            raise ValueError("Either 'documents' or 'document_id' must be provided")
+        return self
+
+class DocumentIngestRequest(BaseModel):
+    documents: str  # URL or file path
+
+class BatchItem(HackrxRequest):
+    id: Optional[str] = None  # Identifies the item's results; defaults to its position in the manifest
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    batch_id: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_.-]{1,64}$")  # Resubmit an id to resume that batch
+
+class SnapshotRestoreRequest(BaseModel):
+    path: str  # Snapshot version directory, or a snapshot directory with a LATEST file
+
+class ProfilingRequest(BaseModel):
+    requests: Optional[int] = Field(None, gt=0)  # Profile this many requests...
+    seconds: Optional[float] = Field(None, gt=0)  # ...and/or for this long (capped by PROFILING_MAX_SECONDS)
+    sample_rate: float = Field(1.0, gt=0, le=1)  # Fraction of requests that turn sampling on (samples cover all threads)
+    memory: bool = False  # Also trace allocations with tracemalloc
+    interval_ms: Optional[float] = Field(None, ge=1)  # Stack sampling interval
@@ -9,3 +9,126 @@ class AnswerItem(BaseModel):
 
 class HackrxResponse(BaseModel):
     answers: List[Dict[str, object]]  # List of answer dictionaries with structured format supporting different value types
+
+class IngestionJobResponse(BaseModel):
+    job_id: str
+    document_id: str
+    source: str
+    status: str
+    chunk_count: Optional[int] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+class IngestionQueueStats(BaseModel):
+    queue_depth: int
+    queue_capacity: int
+    workers: int
+    busy_workers: int
+    utilisation: float
+    jobs_completed: int
+    jobs_failed: int
+
+class DocumentDeleteResponse(BaseModel):
+    document_id: str
+    documents_deleted: int
+    questions_deleted: int
+    answers_deleted: int
+    vectors_tombstoned: int
+
+class CompactionResult(BaseModel):
+    removed_vectors: int
+    reclaimed_bytes: int
+    reclaimed_disk_bytes: int
+    duration_seconds: float
+
+class SnapshotResult(BaseModel):
+    version: str
+    path: str
+    created_at: float
+    vectors: int
+    documents: int
+    documents_registered: int  # Documents that were new to this instance's database
+    documents_unindexed: int  # Documents the restore dropped; requests for them now answer 404
+    restored_at: float
+    duration_seconds: float
+
+class LifecycleStats(BaseModel):
+    ttl_seconds: float
+    max_documents: int
+    sweep_interval: float
+    min_dead_fraction: float
+    sweeps: int
+    last_sweep_at: Optional[float] = None
+    documents_deleted: int
+    vectors_tombstoned: int
+    pinned_documents: int
+    compactions: int
+    reclaimed_bytes: int
+    reclaimed_disk_bytes: int
+    recent_compactions: List[Dict[str, object]]
+    snapshot: Optional[SnapshotResult] = None  # Last index snapshot restored
+    index: Dict[str, object]
+
+class BatchRunResponse(BaseModel):
+    batch_id: str
+    status: str
+    output_path: str
+    error: Optional[str] = None
+    items_total: int
+    items_completed: int
+    items_failed: int
+    items_resumed: int
+    documents_ingested: int
+    questions_total: int
+    questions_answered: int
+    questions_failed: int
+    questions_resumed: int
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    elapsed_seconds: float
+    documents_per_second: float
+    questions_per_second: float
+    question_latency_p50: Optional[float] = None
+    question_latency_p95: Optional[float] = None
+
+class ProfilingSessionResponse(BaseModel):
+    session_id: str
+    status: str
+    error: Optional[str] = None
+    requests: Optional[int] = None
+    seconds: float
+    sample_rate: float
+    memory: bool
+    interval_ms: float
+    started_at: float
+    finished_at: Optional[float] = None
+    requests_seen: int
+    requests_profiled: int
+    requests_completed: int
+    output_dir: str
+    files: List[str]
+    summary: Dict[str, object]
+
+class AdmissionStats(BaseModel):
+    enabled: bool
+    requests_in_flight: int
+    questions_in_flight: int
+    max_questions: int
+    ingest_bytes_in_flight: int
+    max_ingest_bytes: int
+    upstream_waiting: int
+    max_upstream_waiting: int
+    queue_depth: int
+    queue_capacity: int
+    admitted: int
+    queued: int
+    rejected_queue_full: int
+    rejected_timeout: int
+    rejected_upstream: int
+    queue_wait_avg_seconds: float
+    queue_wait_p50_seconds: float
+    queue_wait_p95_seconds: float
+    queue_wait_max_seconds: float
+    retry_after_seconds: float
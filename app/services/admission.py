@@ -0,0 +1,288 @@
+# Admission control and backpressure for the query endpoint
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import logging
+from app.core.config import (
+    ADMISSION_ENABLED, ADMISSION_MAX_QUESTIONS, ADMISSION_MAX_INGEST_BYTES, ADMISSION_DOCUMENT_BYTES,
+    ADMISSION_MAX_UPSTREAM_WAITING, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT
+)
+from app.services.deadline import Deadline
+from app.services.rate_limiter import chat_limiter, embedding_limiter
+
+logger = logging.getLogger(__name__)
+
+# How often a queue blocked only by upstream saturation is re-checked
+_UPSTREAM_RECHECK_SECONDS = 0.25
+
+
+class AdmissionRejected(RuntimeError):
+    """Raised when a request is not admitted. Maps to an HTTP status with a Retry-After header."""
+
+    def __init__(self, message: str, status_code: int, retry_after: float):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+@dataclass
+class _Hold:
+    """Ingestion bytes an admitted request holds; resized once its document's real size is known."""
+    controller: "AdmissionController"
+    loop: asyncio.AbstractEventLoop
+    ingest_bytes: int
+    released: bool = False
+
+
+# Hold of the request currently being served. Like the request deadline, it is visible in
+# asyncio.to_thread() workers, so the download can report the document's size without extra arguments.
+_current_hold: ContextVar[Optional[_Hold]] = ContextVar("admission_hold", default=None)
+
+
+def report_document_size(size: int):
+    """
+    Resize the current request's ingestion hold to the document's real size in bytes.
+
+    Safe to call from worker threads; does nothing outside an admitted request.
+    """
+    hold = _current_hold.get()
+    if hold is None or hold.ingest_bytes == 0:
+        return
+    hold.loop.call_soon_threadsafe(hold.controller._resize, hold, size)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: tuple
+    questions: int = field(compare=False)
+    ingest_bytes: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+class AdmissionController:
+    """
+    Decides whether a /run request may start now, must wait, or is turned away.
+
+    A request holds its questions against ADMISSION_MAX_QUESTIONS and, if it brings a document
+    to ingest inline, its size against ADMISSION_MAX_INGEST_BYTES: ADMISSION_DOCUMENT_BYTES until
+    the download reports the real size (Content-Length, or the bytes received).
+    While OpenAI calls are backing up at the shared rate limiters, nothing new is started.
+    Requests that cannot start wait in a bounded priority queue in which pre-ingested
+    documents go first, then smaller question sets. A full queue answers 429, and a wait
+    longer than ADMISSION_QUEUE_TIMEOUT (or a 429 pause from OpenAI) answers 503. Both come
+    with a Retry-After based on how long admitted requests have recently been taking.
+    """
+
+    def __init__(self, max_questions: int = None, max_ingest_bytes: int = None, document_bytes: int = None,
+                 max_upstream_waiting: int = None, queue_size: int = None, queue_timeout: float = None,
+                 enabled: bool = None, history: int = 1000):
+        self.enabled = ADMISSION_ENABLED if enabled is None else enabled
+        self.max_questions = max_questions or ADMISSION_MAX_QUESTIONS
+        self.max_ingest_bytes = max_ingest_bytes or ADMISSION_MAX_INGEST_BYTES
+        self.document_bytes = document_bytes or ADMISSION_DOCUMENT_BYTES
+        self.max_upstream_waiting = max_upstream_waiting or ADMISSION_MAX_UPSTREAM_WAITING
+        self.queue_size = queue_size or ADMISSION_QUEUE_SIZE
+        self.queue_timeout = queue_timeout or ADMISSION_QUEUE_TIMEOUT
+
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._recheck: Optional[asyncio.TimerHandle] = None
+        self._requests = 0
+        self._questions = 0
+        self._ingest_bytes = 0
+        self._hold_seconds: Optional[float] = None  # EWMA of how long admitted requests run
+
+        self._waits = deque(maxlen=history)
+        self._admitted = 0
+        self._queued = 0
+        self._rejected_queue_full = 0
+        self._rejected_timeout = 0
+        self._rejected_upstream = 0
+
+    def _upstream(self) -> Dict:
+        stats = [chat_limiter.get_stats(), embedding_limiter.get_stats()]
+        return {
+            'waiting': sum(s['waiting'] for s in stats),
+            'paused_seconds': max(s['paused_seconds'] for s in stats)
+        }
+
+    def _fits(self, questions: int, ingest_bytes: int) -> bool:
+        # A request larger than a limit on its own is admitted once nothing else is running
+        if self._requests == 0:
+            return True
+        return (self._questions + questions <= self.max_questions
+                and self._ingest_bytes + ingest_bytes <= self.max_ingest_bytes)
+
+    def _upstream_ok(self) -> bool:
+        return self._requests == 0 or self._upstream()['waiting'] < self.max_upstream_waiting
+
+    def _depth(self) -> int:
+        # Waiters that timed out or went away stay in the heap until they reach its head
+        return sum(1 for w in self._queue if not w.future.done())
+
+    def retry_after(self) -> float:
+        """Rough time until capacity frees up: recent request duration, scaled by the backlog."""
+        hold = self._hold_seconds or 1.0
+        return min(60.0, hold * (1 + self._depth() / max(1, self._requests)))
+
+    def _take(self, questions: int, ingest_bytes: int):
+        self._requests += 1
+        self._questions += questions
+        self._ingest_bytes += ingest_bytes
+        self._admitted += 1
+
+    def _release(self, questions: int, ingest_bytes: int, held: float):
+        self._requests -= 1
+        self._questions -= questions
+        self._ingest_bytes -= ingest_bytes
+        self._hold_seconds = held if self._hold_seconds is None else 0.9 * self._hold_seconds + 0.1 * held
+        self._dispatch()
+
+    def _resize(self, hold: _Hold, size: int):
+        if hold.released:
+            return
+        # Never below one byte, so the hold still counts as a document being ingested
+        size = max(1, size)
+        self._ingest_bytes += size - hold.ingest_bytes
+        shrunk = size < hold.ingest_bytes
+        hold.ingest_bytes = size
+        if shrunk:
+            self._dispatch()
+
+    def _dispatch(self):
+        """Admit waiters in priority order for as long as the head of the queue fits."""
+        while self._queue:
+            head = self._queue[0]
+            if head.future.done():
+                heapq.heappop(self._queue)
+                continue
+            if not self._fits(head.questions, head.ingest_bytes):
+                return
+            if not self._upstream_ok():
+                # Nothing may finish to trigger another dispatch; poll until upstream drains
+                if self._recheck is None:
+                    loop = asyncio.get_running_loop()
+                    self._recheck = loop.call_later(_UPSTREAM_RECHECK_SECONDS, self._recheck_upstream)
+                return
+            heapq.heappop(self._queue)
+            self._take(head.questions, head.ingest_bytes)
+            head.future.set_result(None)
+
+    def _recheck_upstream(self):
+        self._recheck = None
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, questions: int, inline_document: bool, deadline: Optional[Deadline] = None):
+        """
+        Hold capacity for one request for the duration of the block.
+
+        Args:
+            questions: Number of questions in the request
+            inline_document: Whether the request downloads and ingests a document
+            deadline: Request deadline; a request is not kept waiting past it
+
+        Yields:
+            Seconds the request spent waiting for admission
+
+        Raises:
+            AdmissionRejected: 429 if the queue is full, 503 on upstream pause or wait timeout
+        """
+        if not self.enabled:
+            yield 0.0
+            return
+
+        questions = min(questions, self.max_questions)
+        ingest_bytes = self.document_bytes if inline_document else 0
+        if not self._queue and self._fits(questions, ingest_bytes) and self._upstream_ok():
+            self._take(questions, ingest_bytes)
+            waited = 0.0
+        else:
+            waited = await self._wait(questions, ingest_bytes, inline_document, deadline)
+        self._waits.append(waited)
+
+        hold = _Hold(self, asyncio.get_running_loop(), ingest_bytes)
+        token = _current_hold.set(hold)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            _current_hold.reset(token)
+            hold.released = True
+            self._release(questions, hold.ingest_bytes, time.monotonic() - started)
+
+    async def _wait(self, questions: int, ingest_bytes: int, inline_document: bool,
+                    deadline: Optional[Deadline]) -> float:
+        paused = self._upstream()['paused_seconds']
+        if paused > 0:
+            self._rejected_upstream += 1
+            raise AdmissionRejected(f"Upstream rate limit reached, paused for {paused:.1f}s", 503, paused)
+        if self._depth() >= self.queue_size:
+            self._rejected_queue_full += 1
+            raise AdmissionRejected(f"Admission queue is full ({self.queue_size} requests waiting)", 429,
+                                    self.retry_after())
+
+        waiter = _Waiter(
+            priority=(inline_document, questions, next(self._seq)),
+            questions=questions,
+            ingest_bytes=ingest_bytes,
+            future=asyncio.get_running_loop().create_future(),
+            enqueued_at=time.monotonic()
+        )
+        heapq.heappush(self._queue, waiter)
+        self._queued += 1
+        self._dispatch()
+        timeout = self.queue_timeout if deadline is None else min(self.queue_timeout, deadline.remaining())
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            # cancel() fails if the waiter was admitted just as the timeout fired
+            if waiter.future.cancel():
+                self._rejected_timeout += 1
+                self._waits.append(time.monotonic() - waiter.enqueued_at)
+                raise AdmissionRejected(f"Not admitted within {timeout:.1f}s", 503, self.retry_after())
+        except asyncio.CancelledError:
+            # Client went away; give the slot back if it was granted in the meantime
+            if not waiter.future.cancel():
+                self._release(questions, ingest_bytes, 0.0)
+            raise
+        return time.monotonic() - waiter.enqueued_at
+
+    def get_stats(self) -> Dict:
+        """Current load, queue depth and admission queue wait times."""
+        waits = sorted(self._waits)
+        percentile = lambda p: waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+        return {
+            'enabled': self.enabled,
+            'requests_in_flight': self._requests,
+            'questions_in_flight': self._questions,
+            'max_questions': self.max_questions,
+            'ingest_bytes_in_flight': self._ingest_bytes,
+            'max_ingest_bytes': self.max_ingest_bytes,
+            'upstream_waiting': self._upstream()['waiting'],
+            'max_upstream_waiting': self.max_upstream_waiting,
+            'queue_depth': self._depth(),
+            'queue_capacity': self.queue_size,
+            'admitted': self._admitted,
+            'queued': self._queued,
+            'rejected_queue_full': self._rejected_queue_full,
+            'rejected_timeout': self._rejected_timeout,
+            'rejected_upstream': self._rejected_upstream,
+            'queue_wait_avg_seconds': sum(waits) / len(waits) if waits else 0.0,
+            'queue_wait_p50_seconds': percentile(0.5),
+            'queue_wait_p95_seconds': percentile(0.95),
+            'queue_wait_max_seconds': waits[-1] if waits else 0.0,
+            'retry_after_seconds': self.retry_after()
+        }
+
+
+# Global admission controller for /api/v1/hackrx/run
+admission_controller = AdmissionController()
@@ -0,0 +1,413 @@
+# Batch evaluation: many documents x many questions with shared concurrency limits
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+import logging
+from app.core.config import (
+    BATCH_DOCUMENT_CONCURRENCY, BATCH_INGEST_CONCURRENCY, BATCH_QUESTION_CONCURRENCY, BATCH_OUTPUT_DIR,
+    BATCH_RUN_HISTORY
+)
+from app.db.database import SessionLocal
+from app.models.request import BatchItem
+from app.services.document_lifecycle import document_lifecycle
+from app.services.pipeline import index_document, get_indexed_document, answer_question, retrieve_for_questions
+
+logger = logging.getLogger(__name__)
+
+BATCH_RUNNING = "running"
+BATCH_COMPLETED = "completed"
+BATCH_FAILED = "failed"
+BATCH_CANCELLED = "cancelled"
+
+# Record types in the results file
+RECORD_DOCUMENT = "document"
+RECORD_ANSWER = "answer"
+RECORD_ERROR = "error"
+RECORD_SUMMARY = "summary"
+
+
+class BatchAlreadyRunning(RuntimeError):
+    """Raised when a batch id is submitted while a run with that id is still in progress."""
+
+
+def load_manifest(path: str) -> List[BatchItem]:
+    """
+    Read a batch manifest.
+
+    Accepts a JSON list of items, a JSON object with an "items" list, or JSON Lines with
+    one item per line. Each item has "documents" (URL or path) or "document_id", a
+    "questions" list and an optional "id".
+    """
+    with open(path) as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        data = data.get("items", [])
+    return [BatchItem(**item) for item in data]
+
+
+def _item_ids(items: List[BatchItem]) -> List[str]:
+    ids = [item.id or str(n) for n, item in enumerate(items)]
+    duplicates = [item_id for item_id, count in Counter(ids).items() if count > 1]
+    if duplicates:
+        raise ValueError(f"Duplicate batch item ids: {duplicates[:10]}")
+    return ids
+
+
+def read_results(path: str) -> Tuple[Set[Tuple[str, int]], Dict[str, str]]:
+    """
+    Read what an earlier run already finished from its results file.
+
+    Returns:
+        Tuple of (set of answered (item_id, question_index), mapping of item_id to ingested document_id)
+    """
+    answered: Set[Tuple[str, int]] = set()
+    documents: Dict[str, str] = {}
+    if not os.path.exists(path):
+        return answered, documents
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by the interruption; its question is simply redone
+                continue
+            if record.get("type") == RECORD_ANSWER:
+                answered.add((record["item_id"], record["question_index"]))
+            elif record.get("type") == RECORD_DOCUMENT:
+                documents[record["item_id"]] = record["document_id"]
+    return answered, documents
+
+
+class _ResultWriter:
+    """Appends JSON records to the results file, one per line, flushed as they are written."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a+")
+        # Terminate a line left partial by an interrupted run so the next record starts cleanly
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell():
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                self._file.write("\n")
+
+    def write(self, record: Dict):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+@dataclass
+class BatchRun:
+    batch_id: str
+    output_path: str
+    status: str = BATCH_RUNNING
+    error: Optional[str] = None
+    items_total: int = 0
+    items_completed: int = 0
+    items_failed: int = 0
+    items_resumed: int = 0
+    documents_ingested: int = 0
+    questions_total: int = 0
+    questions_answered: int = 0
+    questions_failed: int = 0
+    questions_resumed: int = 0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    latencies: List[float] = field(default_factory=list, repr=False)
+
+    def to_dict(self) -> Dict:
+        """Progress and throughput of this run (resumed work excluded from the rates)."""
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        latencies = sorted(self.latencies)
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+        return {
+            'batch_id': self.batch_id,
+            'status': self.status,
+            'output_path': self.output_path,
+            'error': self.error,
+            'items_total': self.items_total,
+            'items_completed': self.items_completed,
+            'items_failed': self.items_failed,
+            'items_resumed': self.items_resumed,
+            'documents_ingested': self.documents_ingested,
+            'questions_total': self.questions_total,
+            'questions_answered': self.questions_answered,
+            'questions_failed': self.questions_failed,
+            'questions_resumed': self.questions_resumed,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed_seconds': elapsed,
+            'documents_per_second': self.documents_ingested / elapsed if elapsed else 0.0,
+            'questions_per_second': self.questions_answered / elapsed if elapsed else 0.0,
+            'question_latency_p50': percentile(0.5),
+            'question_latency_p95': percentile(0.95)
+        }
+
+
+class BatchEvaluator:
+    """
+    Runs batches of documents x questions through the ingestion and answering pipeline.
+
+    All batches share three limits: documents in flight, concurrent ingestions and
+    concurrent questions, so several batches together never exceed what one is allowed.
+    Upstream OpenAI capacity is shared with live traffic through the client-side rate limiters;
+    batch work does not pass through the /hackrx/run admission controller.
+    Every ingested document and answered question is appended to the batch's JSONL results
+    file as soon as it completes; running the batch again with the same file skips them.
+    """
+
+    def __init__(self, document_concurrency: int = None, ingest_concurrency: int = None,
+                 question_concurrency: int = None, output_dir: str = None, history: int = None):
+        self.document_concurrency = document_concurrency or BATCH_DOCUMENT_CONCURRENCY
+        self.ingest_concurrency = ingest_concurrency or BATCH_INGEST_CONCURRENCY
+        self.question_concurrency = question_concurrency or BATCH_QUESTION_CONCURRENCY
+        self.output_dir = output_dir or BATCH_OUTPUT_DIR
+        self.history = history or BATCH_RUN_HISTORY
+
+        self._document_slots = asyncio.Semaphore(self.document_concurrency)
+        self._ingest_slots = asyncio.Semaphore(self.ingest_concurrency)
+        self._question_slots = asyncio.Semaphore(self.question_concurrency)
+        self._runs: "OrderedDict[str, BatchRun]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, items: List[BatchItem], batch_id: Optional[str] = None) -> BatchRun:
+        """
+        Start a batch in the background. Must be called from a running event loop.
+
+        Results go to <BATCH_OUTPUT_DIR>/<batch_id>.jsonl; submitting an existing batch_id
+        resumes that batch from its results file.
+        """
+        batch_id = batch_id or str(uuid.uuid4())
+        task = self._tasks.get(batch_id)
+        if task is not None and not task.done():
+            raise BatchAlreadyRunning(f"Batch {batch_id} is already running")
+        _item_ids(items)
+
+        run = BatchRun(batch_id=batch_id, output_path=os.path.join(self.output_dir, f"{batch_id}.jsonl"))
+        self._runs[batch_id] = run
+        self._runs.move_to_end(batch_id)
+        self._trim_history()
+        task = asyncio.create_task(self.run(items, run.output_path, run=run))
+        self._tasks[batch_id] = task
+        task.add_done_callback(self._run_done(batch_id))
+        logger.info(f"Started batch {batch_id} with {len(items)} items")
+        return run
+
+    def _run_done(self, batch_id: str):
+        def done(task: asyncio.Task):
+            if self._tasks.get(batch_id) is task:
+                del self._tasks[batch_id]
+            # Failures are already logged and recorded on the run
+            if not task.cancelled():
+                task.exception()
+        return done
+
+    def _trim_history(self):
+        """Drop the oldest finished runs once the history limit is exceeded."""
+        excess = len(self._runs) - self.history
+        if excess <= 0:
+            return
+        for batch_id in [b for b, run in self._runs.items() if run.status != BATCH_RUNNING][:excess]:
+            del self._runs[batch_id]
+
+    def get_run(self, batch_id: str) -> Optional[BatchRun]:
+        return self._runs.get(batch_id)
+
+    def list_runs(self) -> List[BatchRun]:
+        return list(self._runs.values())
+
+    async def stop(self):
+        """Cancel running batches. Their results files keep everything finished so far."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run(self, items: List[BatchItem], output_path: str, resume: bool = True,
+                  run: Optional[BatchRun] = None) -> BatchRun:
+        """
+        Answer every question of every item, appending results to output_path as they complete.
+
+        Args:
+            items: Batch items (document source or document_id, and questions)
+            output_path: JSONL results file
+            resume: Skip work already recorded in output_path (otherwise it is overwritten)
+            run: Run record to update, e.g. one returned by submit()
+
+        Returns:
+            The finished BatchRun with throughput statistics
+        """
+        run = run or BatchRun(batch_id=os.path.splitext(os.path.basename(output_path))[0], output_path=output_path)
+        run.started_at = time.time()
+        item_ids = _item_ids(items)
+        if not resume and os.path.exists(output_path):
+            os.remove(output_path)
+        answered, documents = read_results(output_path)
+        run.items_total = len(items)
+        run.questions_total = sum(len(item.questions) for item in items)
+
+        writer = _ResultWriter(output_path)
+        tasks: Set[asyncio.Task] = set()
+        try:
+            for item_id, item in zip(item_ids, items):
+                pending = [(i, q) for i, q in enumerate(item.questions) if (item_id, i) not in answered]
+                run.questions_resumed += len(item.questions) - len(pending)
+                if not pending:
+                    run.items_resumed += 1
+                    continue
+                # Start items only as document slots free up, so a large manifest doesn't
+                # hold a database session and an ingestion for every item at once
+                await self._document_slots.acquire()
+                task = asyncio.create_task(
+                    self._run_item(run, writer, item_id, item, pending, documents.get(item_id))
+                )
+                tasks.add(task)
+                task.add_done_callback(self._item_done(tasks))
+            if tasks:
+                await asyncio.gather(*tasks)
+            run.status = BATCH_COMPLETED
+        except asyncio.CancelledError:
+            run.status = BATCH_CANCELLED
+            raise
+        except Exception as e:
+            logger.error(f"Batch {run.batch_id} failed: {e}")
+            run.status = BATCH_FAILED
+            run.error = str(e)
+            raise
+        finally:
+            for task in list(tasks):
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            run.finished_at = time.time()
+            summary = run.to_dict()
+            writer.write({'type': RECORD_SUMMARY, **summary})
+            writer.close()
+            logger.info(f"Batch {run.batch_id} {run.status}: {run.questions_answered} questions and "
+                        f"{run.documents_ingested} documents in {summary['elapsed_seconds']:.1f}s "
+                        f"({summary['questions_per_second']:.2f} questions/s)")
+        return run
+
+    def _item_done(self, tasks: Set[asyncio.Task]):
+        def done(task: asyncio.Task):
+            tasks.discard(task)
+            self._document_slots.release()
+        return done
+
+    async def _run_item(self, run: BatchRun, writer: _ResultWriter, item_id: str, item: BatchItem,
+                        pending: List[Tuple[int, str]], known_doc_id: Optional[str]):
+        db = SessionLocal()
+        try:
+            # Reuse the document from an earlier attempt if it is still indexed
+            doc_id = item.document_id or known_doc_id
+            doc_obj = get_indexed_document(db, doc_id) if doc_id else None
+            if doc_obj is None and item.document_id:
+                raise LookupError(f"Document {item.document_id} is not indexed")
+            if doc_obj is None:
+                if not item.documents:
+                    raise LookupError(f"Document {doc_id} from an earlier run is no longer indexed")
+                doc_id = str(uuid.uuid4())
+
+            with document_lifecycle.pin(doc_id):
+                if doc_obj is None:
+                    async with self._ingest_slots:
+                        started = time.perf_counter()
+                        doc_obj, chunk_count = await index_document(item.documents, doc_id, db)
+                    run.documents_ingested += 1
+                    writer.write({
+                        'type': RECORD_DOCUMENT, 'item_id': item_id, 'document_id': doc_id,
+                        'source': item.documents, 'chunks': chunk_count,
+                        'seconds': time.perf_counter() - started
+                    })
+
+                matches, confidences = await retrieve_for_questions([question for _, question in pending], doc_id)
+                await asyncio.gather(*(
+                    self._answer(run, writer, item_id, i, question, doc_obj, doc_id, db, found, confidence)
+                    for (i, question), found, confidence in zip(pending, matches, confidences)
+                ))
+            run.items_completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Recorded and counted, but not marked answered, so a resumed run retries the item
+            logger.error(f"Batch {run.batch_id} item {item_id} failed: {e}")
+            run.items_failed += 1
+            writer.write({'type': RECORD_ERROR, 'item_id': item_id, 'error': str(e)})
+        finally:
+            db.close()
+
+    async def _answer(self, run: BatchRun, writer: _ResultWriter, item_id: str, index: int, question: str,
+                      doc_obj, doc_id: str, db, matches: Optional[List[Dict]], confidence: Optional[float]):
+        async with self._question_slots:
+            started = time.perf_counter()
+            try:
+                result = await answer_question(question, doc_obj, doc_id, db, f"{item_id}#{index}",
+                                               matches, confidence)
+                error = result.get('error')
+            except Exception as e:
+                error = str(e)
+            if error is not None:
+                # Not marked answered, so a resumed run asks it again
+                logger.error(f"Batch {run.batch_id} question {item_id}#{index} failed: {error}")
+                run.questions_failed += 1
+                writer.write({'type': RECORD_ERROR, 'item_id': item_id, 'question_index': index, 'error': error})
+                return
+            seconds = time.perf_counter() - started
+        run.questions_answered += 1
+        run.latencies.append(seconds)
+        writer.write({
+            'type': RECORD_ANSWER, 'item_id': item_id, 'question_index': index, 'document_id': doc_id,
+            'question': question, 'answer': result['answer'], 'score': result['score'], 'seconds': seconds
+        })
+
+
+# Global batch evaluator, shared by every batch submitted through the API
+batch_evaluator = BatchEvaluator()
+
+
+async def _run_cli(args) -> Dict:
+    from app.db.init_db import init_database
+    from app.services.embedding_pipeline import close_faiss_index
+
+    items = load_manifest(args.manifest)
+    init_database()
+    evaluator = BatchEvaluator(args.document_concurrency, args.ingest_concurrency, args.question_concurrency)
+    try:
+        run = await evaluator.run(items, args.output, resume=not args.no_resume)
+    finally:
+        close_faiss_index()
+    return run.to_dict()
+
+
+def main(argv: List[str] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Answer a manifest of documents x questions, writing JSONL results")
+    parser.add_argument("manifest", help="JSON or JSONL manifest of {documents|document_id, questions, id} items")
+    parser.add_argument("--output", required=True, help="JSONL results file; an existing file is resumed")
+    parser.add_argument("--no-resume", action="store_true", help="Overwrite the results file instead of resuming")
+    parser.add_argument("--document-concurrency", type=int, help="Documents in flight (BATCH_DOCUMENT_CONCURRENCY)")
+    parser.add_argument("--ingest-concurrency", type=int, help="Concurrent ingestions (BATCH_INGEST_CONCURRENCY)")
+    parser.add_argument("--question-concurrency", type=int, help="Concurrent questions (BATCH_QUESTION_CONCURRENCY)")
+    args = parser.parse_args(argv)
+
+    print(json.dumps(asyncio.run(_run_cli(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# Offline bulk indexer: parse a document library in parallel and write an index snapshot
+import asyncio
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from typing import Dict, List, Tuple
+import logging
+import faiss
+import numpy as np
+from app.core.config import (
+    BULK_INDEX_WORKERS, BULK_EMBED_BATCH_SIZE, BULK_EMBED_CONCURRENCY, SNAPSHOT_OUTPUT_DIR, FAISS_DIMENSION
+)
+from app.services.chunk_store import ChunkStore
+from app.services.document_ingestion import detect_file_type, ingest_document_parts
+from app.services.embedding_pipeline import get_embeddings
+from app.services.index_snapshot import write_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def document_id_for(source: str) -> str:
+    """Stable document id for a source, so rebuilding a library keeps its document ids."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, source))
+
+
+def _is_supported(path: str) -> bool:
+    try:
+        detect_file_type(path)
+        return True
+    except ValueError:
+        return False
+
+
+def discover_documents(source: str) -> List[Dict]:
+    """
+    List the documents to index.
+
+    `source` is either a directory, whose supported files are all indexed (recursively,
+    in sorted order), or a manifest: a JSON list, a JSON object with a "documents" list,
+    or JSON Lines. Manifest entries are a path/URL string or an object with "documents"
+    (path or URL) and an optional "id". Relative paths are resolved against the manifest.
+
+    Returns:
+        List of {'document_id', 'source'} dicts
+    """
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(source)
+            for name in names
+            if _is_supported(name)
+        )
+        return [{'document_id': document_id_for(os.path.abspath(p)), 'source': os.path.abspath(p)} for p in paths]
+
+    with open(source) as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        data = data.get("documents", [])
+
+    base = os.path.dirname(os.path.abspath(source))
+    documents, seen = [], set()
+    for entry in data:
+        if isinstance(entry, str):
+            entry = {'documents': entry}
+        location = entry['documents']
+        if not location.startswith("http"):
+            location = os.path.join(base, location)
+        document_id = entry.get('id') or document_id_for(location)
+        if document_id in seen:
+            raise ValueError(f"Duplicate document in manifest: {document_id}")
+        seen.add(document_id)
+        documents.append({'document_id': document_id, 'source': location})
+    return documents
+
+
+def _parse(source: str) -> Tuple[List[str], List[str], str]:
+    """Download and parse one document. Runs in a worker process."""
+    chunks, chunk_types, file_path = ingest_document_parts(source, source.startswith("http"))
+    return chunks, chunk_types, file_path.split(os.sep)[-1]
+
+
+@dataclass
+class _ParsedDocument:
+    document_id: str
+    source: str
+    name: str
+    chunks: List[str]
+    chunk_types: List[str]
+    vectors: np.ndarray
+
+
+class BulkIndexer:
+    """
+    Builds an index snapshot for a whole document library outside the server.
+
+    Documents are downloaded and parsed in a process pool with the same parsing and
+    chunking as the ingestion endpoint. Chunks from all documents are pooled into large
+    embedding requests, several in flight at once, and the finished index is written as
+    a versioned, checksummed snapshot that servers can restore or hot-swap in.
+    """
+
+    def __init__(self, workers: int = None, embed_batch_size: int = None, embed_concurrency: int = None):
+        self.workers = workers or BULK_INDEX_WORKERS
+        self.embed_batch_size = embed_batch_size or BULK_EMBED_BATCH_SIZE
+        self.embed_concurrency = embed_concurrency or BULK_EMBED_CONCURRENCY
+
+    async def build(self, documents: List[Dict], output_dir: str = None) -> Dict:
+        """
+        Parse, embed and index the given documents and write them as a new snapshot.
+
+        Documents that fail to download or parse are left out and listed under 'failed'
+        in the manifest. An embedding failure aborts the build without writing a snapshot.
+
+        Args:
+            documents: {'document_id', 'source'} dicts, e.g. from discover_documents()
+            output_dir: Snapshot directory (SNAPSHOT_OUTPUT_DIR)
+
+        Returns:
+            The snapshot manifest
+        """
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        parsed: Dict[str, _ParsedDocument] = {}
+        failed: List[Dict] = []
+
+        embed_slots = asyncio.Semaphore(self.embed_concurrency)
+        embeds: List[asyncio.Task] = []
+        batch: List[Tuple[_ParsedDocument, int, int]] = []  # (document, first chunk, chunk count)
+        batch_size = 0
+        embed_seconds = 0.0
+
+        async def embed(slices: List[Tuple[_ParsedDocument, int, int]]):
+            nonlocal embed_seconds
+            try:
+                batch_started = time.perf_counter()
+                vectors = np.asarray(await get_embeddings(
+                    [text for doc, start, count in slices for text in doc.chunks[start:start + count]]
+                ), dtype='float32')
+                embed_seconds += time.perf_counter() - batch_started
+            finally:
+                embed_slots.release()
+            offset = 0
+            for doc, start, count in slices:
+                doc.vectors[start:start + count] = vectors[offset:offset + count]
+                offset += count
+
+        async def flush():
+            nonlocal batch, batch_size
+            # Waiting for a free slot here also stops parsed documents piling up ahead of embedding
+            await embed_slots.acquire()
+            embeds.append(asyncio.create_task(embed(batch)))
+            batch, batch_size = [], 0
+
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn")) as pool:
+            async def parse(document: Dict):
+                try:
+                    return document, await loop.run_in_executor(pool, _parse, document['source']), None
+                except Exception as e:
+                    return document, None, e
+
+            parses = [asyncio.ensure_future(parse(d)) for d in documents]
+            try:
+                for next_parsed in asyncio.as_completed(parses):
+                    document, result, error = await next_parsed
+                    if error is not None:
+                        logger.error(f"Failed to parse {document['source']}: {error}")
+                        failed.append({**document, 'error': str(error)})
+                        continue
+                    chunks, chunk_types, name = result
+                    doc = _ParsedDocument(document['document_id'], document['source'], name, chunks, chunk_types,
+                                          np.empty((len(chunks), FAISS_DIMENSION), dtype='float32'))
+                    parsed[doc.document_id] = doc
+                    # Chunks from consecutive documents share embedding requests
+                    start = 0
+                    while start < len(chunks):
+                        count = min(self.embed_batch_size - batch_size, len(chunks) - start)
+                        batch.append((doc, start, count))
+                        batch_size += count
+                        start += count
+                        if batch_size >= self.embed_batch_size:
+                            await flush()
+                    if len(parsed) % 100 == 0:
+                        logger.info(f"Parsed {len(parsed)}/{len(documents)} documents")
+                if batch:
+                    await flush()
+                await asyncio.gather(*embeds)
+            except BaseException:
+                for task in [*parses, *embeds]:
+                    task.cancel()
+                raise
+
+        # Assemble in input order so the same library always yields the same index
+        blocks = []
+        store = ChunkStore()
+        entries = []
+        for document in documents:
+            doc = parsed.get(document['document_id'])
+            if doc is None:
+                continue
+            faiss.normalize_L2(doc.vectors)
+            blocks.append(doc.vectors)
+            store.append(doc.chunks, doc.document_id, chunk_type=doc.chunk_types)
+            entries.append({'document_id': doc.document_id, 'name': doc.name, 'source': doc.source,
+                            'chunks': len(doc.chunks)})
+
+        vectors = np.concatenate(blocks) if blocks else np.empty((0, FAISS_DIMENSION), dtype='float32')
+        manifest = write_snapshot(vectors, store, output_dir or SNAPSHOT_OUTPUT_DIR, entries, extra={
+            'build': {
+                'documents_requested': len(documents),
+                'documents_indexed': len(entries),
+                'documents_failed': len(failed),
+                'workers': self.workers,
+                'embed_batch_size': self.embed_batch_size,
+                'embed_concurrency': self.embed_concurrency,
+                'embed_requests': len(embeds),
+                'embed_seconds': embed_seconds,
+                'total_seconds': time.perf_counter() - started
+            },
+            'failed': failed
+        })
+        return manifest
+
+
+async def _run_cli(args) -> Dict:
+    documents = discover_documents(args.source)
+    if not documents:
+        raise SystemExit(f"No supported documents found in {args.source}")
+    logger.info(f"Bulk indexing {len(documents)} documents")
+    indexer = BulkIndexer(args.workers, args.batch_size, args.embed_concurrency)
+    return await indexer.build(documents, args.output)
+
+
+def main(argv: List[str] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Parse and embed a document library offline and write an index snapshot")
+    parser.add_argument("source", help="Directory of documents, or a JSON/JSONL manifest of {documents, id} entries")
+    parser.add_argument("--output", help="Snapshot directory (SNAPSHOT_OUTPUT_DIR); a new version is added to it")
+    parser.add_argument("--workers", type=int, help="Parsing processes (BULK_INDEX_WORKERS)")
+    parser.add_argument("--batch-size", type=int, help="Chunks per embedding request (BULK_EMBED_BATCH_SIZE)")
+    parser.add_argument("--embed-concurrency", type=int, help="Embedding requests in flight (BULK_EMBED_CONCURRENCY)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    manifest = asyncio.run(_run_cli(args))
+    print(json.dumps({k: v for k, v in manifest.items() if k != 'documents'}, indent=2))
+    # The snapshot is written either way; a non-zero exit flags the documents left out
+    if manifest['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
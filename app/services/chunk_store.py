@@ -0,0 +1,347 @@
+# Columnar chunk metadata storage for the FAISS index
+import json
+import os
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Union
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_TYPE = "document_segment"
+
+# Chunk types are stored as uint8 ordinals
+MAX_CHUNK_TYPES = 256
+
+
+class ChunkMetadata(Mapping):
+    """
+    Read-only view of a single chunk's metadata.
+
+    Behaves like the metadata dict previously stored per vector
+    ('text', 'doc_id', 'chunk_index', 'chunk_type') but is only built for query results.
+    """
+
+    __slots__ = ("text", "doc_id", "chunk_index", "chunk_type")
+    _keys = __slots__
+
+    def __init__(self, text: str, doc_id: str, chunk_index: int, chunk_type: str):
+        self.text = text
+        self.doc_id = doc_id
+        self.chunk_index = chunk_index
+        self.chunk_type = chunk_type
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self._keys}
+
+    def __repr__(self):
+        return f"ChunkMetadata({self.to_dict()!r})"
+
+
+class ChunkStore:
+    """
+    Array-backed metadata for every vector in the index, addressed by FAISS row number.
+
+    Doc ids and chunk types are interned into small string tables and referenced by
+    integer ordinals; chunk texts live in a single UTF-8 buffer addressed by offsets.
+    Vector ids are derived as '{doc_id}_chunk_{chunk_index}' unless an explicit id was given.
+    Deleted documents are tombstoned: their rows stay in place (so row numbers keep matching
+    the FAISS index) but are masked out until the index is compacted. A tombstoned document
+    that is appended to again gets a fresh ordinal; its old ordinal is retired, so the old
+    rows stay dead while the new ones are live.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._size = 0
+        self.doc_ordinals = np.empty(0, dtype=np.int32)
+        self.chunk_indices = np.empty(0, dtype=np.int32)
+        self.type_ordinals = np.empty(0, dtype=np.uint8)
+        self.text_offsets = np.zeros(1, dtype=np.int64)
+        self._text_buffer = bytearray()
+        self.doc_table: List[str] = []
+        self.type_table: List[str] = []
+        self._doc_lookup: Dict[str, int] = {}
+        self._type_lookup: Dict[str, int] = {}
+        self._custom_ids: Dict[int, str] = {}
+        self.tombstoned: Set[str] = set()
+        self._retired: Set[int] = set()
+        self._dead_mask: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, extra: int):
+        """Grow the column arrays geometrically so appends stay amortised O(1)."""
+        needed = self._size + extra
+        capacity = len(self.doc_ordinals)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 1024)
+        self.doc_ordinals = np.resize(self.doc_ordinals, new_capacity)
+        self.chunk_indices = np.resize(self.chunk_indices, new_capacity)
+        self.type_ordinals = np.resize(self.type_ordinals, new_capacity)
+        self.text_offsets = np.resize(self.text_offsets, new_capacity + 1)
+
+    @staticmethod
+    def _intern(value: str, table: List[str], lookup: Dict[str, int]) -> int:
+        ordinal = lookup.get(value)
+        if ordinal is None:
+            ordinal = len(table)
+            table.append(value)
+            lookup[value] = ordinal
+        return ordinal
+
+    def _type_ordinal(self, chunk_type: str) -> int:
+        if chunk_type not in self._type_lookup and len(self.type_table) >= MAX_CHUNK_TYPES:
+            raise ValueError(f"Cannot add chunk type {chunk_type!r}: at most {MAX_CHUNK_TYPES} distinct chunk types are supported")
+        return self._intern(chunk_type, self.type_table, self._type_lookup)
+
+    def _retire(self, doc_id: str):
+        """Detach a tombstoned document's rows from its id so it can be appended to again."""
+        self._retired.add(self._doc_lookup.pop(doc_id))
+        self.tombstoned.discard(doc_id)
+        self._dead_mask = None
+
+    def doc_ordinal(self, doc_id: str) -> Optional[int]:
+        """Return the integer ordinal for a doc_id, or None if it has no live chunks."""
+        if doc_id in self.tombstoned:
+            return None
+        return self._doc_lookup.get(doc_id)
+
+    def tombstone(self, doc_ids: Iterable[str]) -> int:
+        """
+        Mark every row of the given documents as deleted.
+
+        Returns:
+            Number of rows newly tombstoned
+        """
+        new = {d for d in doc_ids if d in self._doc_lookup and d not in self.tombstoned}
+        if not new:
+            return 0
+        count = len(self.rows_for_docs(list(new)))
+        self.tombstoned |= new
+        self._dead_mask = None
+        return count
+
+    def dead_mask(self) -> Optional[np.ndarray]:
+        """Boolean mask of tombstoned rows, or None when nothing is tombstoned."""
+        if not self.tombstoned and not self._retired:
+            return None
+        if self._dead_mask is None or len(self._dead_mask) != self._size:
+            ordinals = [self._doc_lookup[d] for d in self.tombstoned] + list(self._retired)
+            self._dead_mask = np.isin(self.doc_ordinals[:self._size], ordinals)
+        return self._dead_mask
+
+    def dead_count(self) -> int:
+        mask = self.dead_mask()
+        return int(mask.sum()) if mask is not None else 0
+
+    def append(self, texts: List[str], doc_id: str, chunk_indices: Optional[List[int]] = None,
+               chunk_type: Union[str, Sequence[str]] = DEFAULT_CHUNK_TYPE,
+               vector_ids: Optional[List[str]] = None) -> List[str]:
+        """
+        Append metadata for consecutive vectors belonging to one document.
+
+        Args:
+            texts: Chunk texts
+            doc_id: Document identifier shared by all chunks
+            chunk_indices: Chunk positions within the document (defaults to 0..n-1)
+            chunk_type: Chunk type label, or one label per chunk
+            vector_ids: Optional explicit vector IDs
+
+        Returns:
+            List of vector IDs for the appended rows
+        """
+        count = len(texts)
+        if chunk_indices is None:
+            chunk_indices = range(count)
+        if isinstance(chunk_type, str):
+            type_ordinals = self._type_ordinal(chunk_type)
+        else:
+            if len(chunk_type) != count:
+                raise ValueError("Number of chunk types must match number of texts")
+            type_ordinals = [self._type_ordinal(t) for t in chunk_type]
+        if doc_id in self.tombstoned:
+            self._retire(doc_id)
+        self._reserve(count)
+
+        start, end = self._size, self._size + count
+        self.doc_ordinals[start:end] = self._intern(doc_id, self.doc_table, self._doc_lookup)
+        self.type_ordinals[start:end] = type_ordinals
+        self.chunk_indices[start:end] = np.fromiter(chunk_indices, dtype=np.int32, count=count)
+
+        encoded = [text.encode("utf-8") for text in texts]
+        lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=count)
+        self.text_offsets[start + 1:end + 1] = self.text_offsets[start] + np.cumsum(lengths)
+        self._text_buffer += b"".join(encoded)
+        self._size = end
+
+        ids = []
+        for row in range(start, end):
+            derived = self.vector_id(row)
+            if vector_ids is not None and vector_ids[row - start] != derived:
+                self._custom_ids[row] = vector_ids[row - start]
+                derived = vector_ids[row - start]
+            ids.append(derived)
+        return ids
+
+    def append_metadata(self, metadata: List[Dict], vector_ids: Optional[List[str]] = None) -> List[str]:
+        """Append rows from legacy per-chunk metadata dicts."""
+        ids = []
+        for i, item in enumerate(metadata):
+            ids.extend(self.append(
+                [item.get('text', '')],
+                str(item.get('doc_id', '')),
+                [int(item.get('chunk_index', i))],
+                item.get('chunk_type', DEFAULT_CHUNK_TYPE),
+                [vector_ids[i]] if vector_ids is not None else None
+            ))
+        return ids
+
+    def extend(self, other: "ChunkStore") -> List[str]:
+        """Append every row of another store, preserving order and explicit vector IDs."""
+        n = len(other)
+        if n == 0:
+            return []
+        # Split into runs of consecutive rows sharing a document and chunk type
+        keys = other.doc_ordinals[:n].astype(np.int64) * MAX_CHUNK_TYPES + other.type_ordinals[:n]
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1, [n]))
+        ids = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            rows = range(start, end)
+            doc_id = other.doc_table[other.doc_ordinals[start]]
+            ids.extend(self.append(
+                [other.text(r) for r in rows],
+                doc_id,
+                other.chunk_indices[start:end].tolist(),
+                other.type_table[other.type_ordinals[start]],
+                [other.vector_id(r) for r in rows]
+            ))
+            if int(other.doc_ordinals[start]) in other._retired:
+                # Rows of an earlier, deleted copy of the document stay dead
+                self.tombstone([doc_id])
+        return ids
+
+    def doc_ids(self) -> List[str]:
+        """Return the doc ids that currently own at least one live row."""
+        return [self.doc_table[o] for o in np.unique(self.doc_ordinals[:self._size]).tolist()
+                if o not in self._retired and self.doc_table[o] not in self.tombstoned]
+
+    def rows_for_docs(self, doc_ids: List[str]) -> np.ndarray:
+        """Return the row numbers belonging to any of the given documents."""
+        ordinals = [self._doc_lookup[d] for d in doc_ids if d in self._doc_lookup]
+        return np.flatnonzero(np.isin(self.doc_ordinals[:self._size], ordinals))
+
+    def take(self, rows) -> "ChunkStore":
+        """Build a new, compact store containing only the given rows, in the given order."""
+        rows = np.asarray(rows, dtype=np.int64)
+        store = ChunkStore()
+        if len(rows) == 0:
+            return store
+
+        used = np.unique(self.doc_ordinals[rows])
+        remap = np.full(len(self.doc_table), -1, dtype=np.int32)
+        remap[used] = np.arange(len(used), dtype=np.int32)
+        store.doc_table = [self.doc_table[o] for o in used]
+        store._retired = {int(remap[o]) for o in self._retired if remap[o] >= 0}
+        store._doc_lookup = {doc_id: i for i, doc_id in enumerate(store.doc_table) if i not in store._retired}
+        store.tombstoned = {d for d in self.tombstoned if d in store._doc_lookup}
+        store.type_table = list(self.type_table)
+        store._type_lookup = dict(self._type_lookup)
+
+        store.doc_ordinals = remap[self.doc_ordinals[rows]]
+        store.chunk_indices = self.chunk_indices[rows]
+        store.type_ordinals = self.type_ordinals[rows]
+
+        starts, ends = self.text_offsets[rows], self.text_offsets[rows + 1]
+        store.text_offsets = np.concatenate(([0], np.cumsum(ends - starts))).astype(np.int64)
+        with memoryview(self._text_buffer) as buf:
+            store._text_buffer = bytearray(b"".join(buf[a:b] for a, b in zip(starts, ends)))
+
+        if self._custom_ids:
+            store._custom_ids = {new: self._custom_ids[old] for new, old in enumerate(rows.tolist())
+                                 if old in self._custom_ids}
+        store._size = len(rows)
+        return store
+
+    def text(self, row: int) -> str:
+        return bytes(self._text_buffer[self.text_offsets[row]:self.text_offsets[row + 1]]).decode("utf-8")
+
+    def vector_id(self, row: int) -> str:
+        custom = self._custom_ids.get(row)
+        if custom is not None:
+            return custom
+        return f"{self.doc_table[self.doc_ordinals[row]]}_chunk_{self.chunk_indices[row]}"
+
+    def record(self, row: int) -> ChunkMetadata:
+        """Materialise the metadata for one row."""
+        return ChunkMetadata(
+            self.text(row),
+            self.doc_table[self.doc_ordinals[row]],
+            int(self.chunk_indices[row]),
+            self.type_table[self.type_ordinals[row]]
+        )
+
+    def save(self, path: str):
+        """Write the store to a single uncompressed .npz file (no pickling)."""
+        n = self._size
+        tables = json.dumps({
+            'doc_table': self.doc_table,
+            'type_table': self.type_table,
+            'custom_ids': {str(k): v for k, v in self._custom_ids.items()},
+            'tombstoned': sorted(self.tombstoned),
+            'retired': sorted(self._retired)
+        })
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                doc_ordinals=self.doc_ordinals[:n],
+                chunk_indices=self.chunk_indices[:n],
+                type_ordinals=self.type_ordinals[:n],
+                text_offsets=self.text_offsets[:n + 1],
+                text_buffer=np.frombuffer(bytes(self._text_buffer), dtype=np.uint8),
+                tables=np.frombuffer(tables.encode("utf-8"), dtype=np.uint8)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ChunkStore":
+        store = cls()
+        with np.load(path, allow_pickle=False) as data:
+            store.doc_ordinals = data['doc_ordinals']
+            store.chunk_indices = data['chunk_indices']
+            store.type_ordinals = data['type_ordinals']
+            store.text_offsets = data['text_offsets']
+            store._text_buffer = bytearray(data['text_buffer'].tobytes())
+            tables = json.loads(data['tables'].tobytes().decode("utf-8"))
+        store._size = len(store.doc_ordinals)
+        store.doc_table = tables['doc_table']
+        store.type_table = tables['type_table']
+        store._retired = set(tables.get('retired', []))
+        store._doc_lookup = {doc_id: i for i, doc_id in enumerate(store.doc_table) if i not in store._retired}
+        store._type_lookup = {chunk_type: i for i, chunk_type in enumerate(store.type_table)}
+        store._custom_ids = {int(k): v for k, v in tables['custom_ids'].items()}
+        store.tombstoned = set(tables.get('tombstoned', []))
+        return store
+
+    def memory_bytes(self) -> int:
+        """Approximate resident size of the store's columns and text buffer."""
+        return int(
+            self.doc_ordinals.nbytes + self.chunk_indices.nbytes + self.type_ordinals.nbytes
+            + self.text_offsets.nbytes + len(self._text_buffer)
+        )
@@ -0,0 +1,63 @@
+# Per-request deadline budgets propagated to downstream calls
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the current request's deadline has run out."""
+
+
+class Deadline:
+    """A point in time by which work must finish, with helpers to split it across stages."""
+
+    def __init__(self, seconds: float):
+        self.total = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def sub(self, fraction: float) -> "Deadline":
+        """Child deadline for a stage: `fraction` of the total budget, never past this deadline."""
+        return Deadline(min(self.remaining(), self.total * fraction))
+
+
+# Deadline of the request currently being served. Context variables are copied into asyncio
+# tasks and asyncio.to_thread() workers, so downstream calls see it without extra arguments.
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]):
+    """Make `deadline` the current deadline for the enclosed block."""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def timeout_for(default: float) -> float:
+    """
+    Timeout for a downstream call: the default, capped by the current deadline.
+
+    Raises:
+        DeadlineExceeded: If the current deadline has already passed
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(default, remaining)
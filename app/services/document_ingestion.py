@@ -1,11 +1,14 @@
 import os
 import tempfile
-import requests
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Tuple
 import logging
 from app.services.pdf_parser import extract_text_from_pdf
-from app.services.docx_parser import extract_text_from_docx
-from app.services.email_parser import extract_text_from_email
+from app.services.docx_parser import iter_docx_text
+from app.services.email_parser import extract_email_parts
+from app.services.chunk_store import DEFAULT_CHUNK_TYPE
+from app.services.deadline import current_deadline, timeout_for, DeadlineExceeded
+from app.services.admission import report_document_size
+from app.services.profiling import profile_stage
 from app.core.config import MAX_CHUNK_SIZE, CHUNK_OVERLAP
 
 logger = logging.getLogger(__name__)
@@ -13,9 +16,16 @@ logger = logging.getLogger(__name__)
 def download_file(url: str) -> str:
     """Download file from URL to a temp file and return the path."""
     import urllib.parse
+    import requests
     try:
-        response = requests.get(url, stream=True, timeout=30)
+        response = requests.get(url, stream=True, timeout=timeout_for(30))
+        deadline = current_deadline()
         response.raise_for_status()
+        # Admission holds an estimate for the document until its real size is known
+        declared = response.headers.get("Content-Length")
+        declared = int(declared) if declared and declared.isdigit() else None
+        if declared is not None:
+            report_document_size(declared)
         
         # Remove query params and fragments for filename
         parsed = urllib.parse.urlparse(url)
@@ -23,8 +33,18 @@ def download_file(url: str) -> str:
         suffix = os.path.splitext(base)[-1] if '.' in base else ''
         
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            for chunk in response.iter_content(chunk_size=8192):
-                tmp.write(chunk)
+            try:
+                for chunk in response.iter_content(chunk_size=8192):
+                    if deadline is not None and deadline.expired:
+                        raise DeadlineExceeded("Request deadline exceeded during download")
+                    tmp.write(chunk)
+            except BaseException:
+                # The caller only removes the file once it has a path, so a partial download is ours to clean up
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+            if tmp.tell() != declared:
+                report_document_size(tmp.tell())
             logger.info(f"Downloaded file from {url} to {tmp.name}")
             return tmp.name
     except Exception as e:
@@ -45,57 +65,137 @@ def detect_file_type(file_path: str) -> str:
     else:
         raise ValueError(f"Unsupported file type: {ext}")
 
-def chunk_text(text: str, max_chunk_size: int = None, overlap: int = None) -> List[str]:
+def chunk_stream(pieces: Iterable[str], max_chunk_size: int = None, separator: str = "\n\n") -> Iterator[str]:
     """
-    Split text into overlapping chunks for better semantic search.
-    Optimized for faster processing with reduced overlap.
+    Chunk a stream of text pieces as they arrive.
+    
+    Produces exactly the chunks chunk_text() would for separator.join(pieces), but only
+    holds the current partial sentence and chunk in memory, so parsers can feed text
+    block by block without building the whole document string first.
     
     Args:
-        text: Text to chunk
+        pieces: Iterable of text blocks (e.g. paragraphs)
         max_chunk_size: Maximum size of each chunk
-        overlap: Overlap between chunks
+        separator: Text inserted between consecutive pieces
         
-    Returns:
-        List of text chunks
+    Yields:
+        Text chunks
     """
     max_chunk_size = max_chunk_size or MAX_CHUNK_SIZE
-    overlap = overlap or CHUNK_OVERLAP
     
-    if len(text) <= max_chunk_size:
-        return [text]
+    # Short texts are returned whole, so buffer until the text is known to be too long
+    head = []
+    head_len = 0
+    pieces = iter(pieces)
+    for piece in pieces:
+        if head:
+            head.append(separator)
+            head_len += len(separator)
+        head.append(piece)
+        head_len += len(piece)
+        if head_len > max_chunk_size:
+            break
+    else:
+        if head:
+            yield "".join(head)
+        return
+    
+    def segments():
+        yield "".join(head)
+        for piece in pieces:
+            yield separator
+            yield piece
     
     # Faster chunking with simpler sentence boundary detection
-    chunks = []
-    sentences = [s.strip() for s in text.replace('\n', ' ').split('.') if s.strip()]
     current_chunk = ""
+    partial = ""
+    for segment in segments():
+        parts = (partial + segment.replace('\n', ' ')).split('.')
+        partial = parts.pop()
+        for sentence in parts:
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            if len(current_chunk) + len(sentence) + 1 <= max_chunk_size:
+                current_chunk += sentence + ". "
+            else:
+                if current_chunk:
+                    yield current_chunk.strip()
+                current_chunk = sentence + ". "
     
-    for sentence in sentences:
+    sentence = partial.strip()
+    if sentence:
         if len(current_chunk) + len(sentence) + 1 <= max_chunk_size:
             current_chunk += sentence + ". "
         else:
             if current_chunk:
-                chunks.append(current_chunk.strip())
+                yield current_chunk.strip()
             current_chunk = sentence + ". "
-    
     if current_chunk:
-        chunks.append(current_chunk.strip())
+        yield current_chunk.strip()
+
+def chunk_text(text: str, max_chunk_size: int = None, overlap: int = None) -> List[str]:
+    """
+    Split text into overlapping chunks for better semantic search.
+    Optimized for faster processing with reduced overlap.
+    
+    Args:
+        text: Text to chunk
+        max_chunk_size: Maximum size of each chunk
+        overlap: Overlap between chunks
+        
+    Returns:
+        List of text chunks
+    """
+    max_chunk_size = max_chunk_size or MAX_CHUNK_SIZE
+    overlap = overlap or CHUNK_OVERLAP
     
+    if len(text) <= max_chunk_size:
+        return [text]
+    
+    chunks = list(chunk_stream([text], max_chunk_size))
     logger.info(f"Split text into {len(chunks)} chunks using optimized chunking")
     return chunks
 
-def parse_document(file_path: str) -> List[str]:
-    """Parse document and return text chunks."""
+def parse_document_parts(file_path: str) -> List[Tuple[str, List[str]]]:
+    """
+    Parse document and return text chunks grouped by the part they came from.
+    
+    Most documents are a single part tagged DEFAULT_CHUNK_TYPE. Emails yield their
+    body and each parsed PDF/DOCX attachment as separate parts, chunked separately so
+    no chunk mixes text from two sources.
+    
+    Returns:
+        List of (chunk_type, chunks) tuples
+    """
     file_type = detect_file_type(file_path)
     
     try:
+        if file_type == 'docx':
+            # Stream paragraphs and table rows straight into the chunker
+            chunks = list(chunk_stream(iter_docx_text(file_path)))
+            if not chunks:
+                logger.warning(f"Extracted text is empty from {file_path}")
+                return []
+            logger.info(f"Parsed {file_type} document into {len(chunks)} chunks")
+            return [(DEFAULT_CHUNK_TYPE, chunks)]
+        
+        if file_type == 'email':
+            with open(file_path, 'rb') as f:
+                raw_email = f.read()
+            parts = [
+                (chunk_type, chunk_text(text.strip()))
+                for chunk_type, text in extract_email_parts(raw_email)
+                if text.strip()
+            ]
+            if not parts:
+                logger.warning(f"Extracted text is empty from {file_path}")
+            logger.info(f"Parsed {file_type} document into {sum(len(c) for _, c in parts)} chunks "
+                        f"from {len(parts)} parts")
+            return parts
+        
         if file_type == 'pdf':
             text = extract_text_from_pdf(file_path)
-        elif file_type == 'docx':
-            text = extract_text_from_docx(file_path)
-        elif file_type == 'email':
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                raw_email = f.read()
-            text = extract_text_from_email(raw_email)
         elif file_type == 'markdown':
             with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
                 text = f.read()
@@ -111,23 +211,30 @@ def parse_document(file_path: str) -> List[str]:
         
         chunks = chunk_text(text)
         logger.info(f"Parsed {file_type} document into {len(chunks)} chunks")
-        return chunks
+        return [(DEFAULT_CHUNK_TYPE, chunks)]
         
     except Exception as e:
         logger.error(f"Failed to parse document {file_path}: {e}")
         raise RuntimeError(f"Document parsing failed: {e}")
 
-def ingest_document(source: str, is_url: bool = True) -> Tuple[List[str], str]:
+def parse_document(file_path: str) -> List[str]:
+    """Parse document and return text chunks."""
+    return [chunk for _, chunks in parse_document_parts(file_path) for chunk in chunks]
+
+@profile_stage("ingest")
+def ingest_document_parts(source: str, is_url: bool = True) -> Tuple[List[str], List[str], str]:
     """
-    Download and parse a document from a URL or local path.
+    Download and parse a document, keeping track of which part each chunk came from.
+    Downloaded files are deleted once parsed; the returned path is kept for naming only.
     
     Args:
         source: URL or file path
         is_url: Whether source is a URL
         
     Returns:
-        Tuple of (chunks, file_path)
+        Tuple of (chunks, chunk_types, file_path), with one chunk type per chunk
     """
+    file_path = None
     try:
         if is_url:
             file_path = download_file(source)
@@ -135,15 +242,37 @@ def ingest_document(source: str, is_url: bool = True) -> Tuple[List[str], str]:
             file_path = source
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"File not found: {file_path}")
+            report_document_size(os.path.getsize(file_path))
         
-        chunks = parse_document(file_path)
+        chunks, chunk_types = [], []
+        for chunk_type, part_chunks in parse_document_parts(file_path):
+            chunks.extend(part_chunks)
+            chunk_types.extend([chunk_type] * len(part_chunks))
         
         if not chunks:
             raise RuntimeError("No text content extracted from document")
         
         logger.info(f"Successfully ingested document: {len(chunks)} chunks")
-        return chunks, file_path
+        return chunks, chunk_types, file_path
         
     except Exception as e:
         logger.error(f"Document ingestion failed: {e}")
         raise RuntimeError(f"Document ingestion failed: {e}")
+    finally:
+        # Downloads are only needed for parsing; the chunks are all that is kept
+        if is_url and file_path and os.path.exists(file_path):
+            os.remove(file_path)
+
+def ingest_document(source: str, is_url: bool = True) -> Tuple[List[str], str]:
+    """
+    Download and parse a document from a URL or local path.
+    
+    Args:
+        source: URL or file path
+        is_url: Whether source is a URL
+        
+    Returns:
+        Tuple of (chunks, file_path)
+    """
+    chunks, _, file_path = ingest_document_parts(source, is_url)
+    return chunks, file_path
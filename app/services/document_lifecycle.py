@@ -0,0 +1,365 @@
+# Document retention policies, deletion and background index compaction
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import logging
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app.core.config import (
+    DOCUMENT_TTL_SECONDS, DOCUMENT_MAX_COUNT, DOCUMENT_SWEEP_INTERVAL,
+    COMPACTION_MIN_DEAD_FRACTION, COMPACTION_HISTORY
+)
+from app.db.database import SessionLocal, Document, Question, Answer
+from app.services.embedding_pipeline import get_faiss_index
+
+logger = logging.getLogger(__name__)
+
+# How often a document waiting to be indexed checks whether a snapshot restore has finished
+_RESTORE_POLL_SECONDS = 0.1
+# Rows updated per statement, within the bound-parameter limits of every supported database
+_UPDATE_BATCH = 500
+
+
+class DocumentLifecycle:
+    """
+    Removes documents from the index and database, by request or by retention policy.
+
+    Deleting a document tombstones its vectors (they vanish from queries at once) and
+    deletes its document/question/answer rows. Space in the index is reclaimed by a
+    background compaction once enough of it is tombstoned. Documents in use by a
+    running request are pinned and never evicted by a policy sweep.
+    """
+
+    def __init__(self, ttl_seconds: float = None, max_documents: int = None, sweep_interval: float = None,
+                 min_dead_fraction: float = None, history: int = None):
+        self.ttl_seconds = DOCUMENT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_documents = DOCUMENT_MAX_COUNT if max_documents is None else max_documents
+        self.sweep_interval = sweep_interval or DOCUMENT_SWEEP_INTERVAL
+        self.min_dead_fraction = COMPACTION_MIN_DEAD_FRACTION if min_dead_fraction is None else min_dead_fraction
+
+        self._task: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Task] = set()
+        self._pins: Counter = Counter()
+        self._pin_lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._compactions = deque(maxlen=history or COMPACTION_HISTORY)
+        # Documents being written to the index; a snapshot restore waits for them and holds new ones back
+        self._indexing_cond = threading.Condition()
+        self._indexing = 0
+        self._restoring = False
+
+        self._documents_deleted = 0
+        self._vectors_tombstoned = 0
+        self._sweeps = 0
+        self._last_sweep_at: Optional[float] = None
+        self._compaction_count = 0
+        self._reclaimed_bytes = 0
+        self._reclaimed_disk_bytes = 0
+        self._snapshot: Optional[Dict] = None
+
+    @contextmanager
+    def pin(self, doc_id: str):
+        """Protect a document from policy eviction for the duration of the block."""
+        with self._pin_lock:
+            self._pins[doc_id] += 1
+        try:
+            yield
+        finally:
+            with self._pin_lock:
+                self._pins[doc_id] -= 1
+                if self._pins[doc_id] <= 0:
+                    del self._pins[doc_id]
+
+    def is_pinned(self, doc_id: Optional[str]) -> bool:
+        with self._pin_lock:
+            return doc_id in self._pins
+
+    @asynccontextmanager
+    async def indexing(self):
+        """
+        Hold while a new document's vectors and database row are written.
+
+        A snapshot restore waits for these blocks to finish and keeps new ones waiting until
+        its swap and database update are done, so no document is left with a row but no vectors.
+        """
+        while True:
+            with self._indexing_cond:
+                if not self._restoring:
+                    self._indexing += 1
+                    break
+            await asyncio.sleep(_RESTORE_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            with self._indexing_cond:
+                self._indexing -= 1
+                self._indexing_cond.notify_all()
+
+    @contextmanager
+    def _exclusive_restore(self):
+        with self._indexing_cond:
+            self._restoring = True
+            self._indexing_cond.wait_for(lambda: self._indexing == 0)
+        try:
+            yield
+        finally:
+            with self._indexing_cond:
+                self._restoring = False
+
+    async def start(self):
+        """Start the periodic retention sweep. Must be called from a running event loop."""
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Started document lifecycle sweeps every {self.sweep_interval}s "
+                    f"(ttl={self.ttl_seconds}s, max_documents={self.max_documents})")
+
+    async def stop(self):
+        """Cancel the sweep loop and wait for any running compaction to finish."""
+        tasks = [t for t in [self._task, *self._background] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        # A compaction thread cannot be cancelled; don't close the index underneath it
+        await asyncio.to_thread(self._compaction_lock.acquire)
+        self._compaction_lock.release()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Document retention sweep failed: {e}")
+
+    def _delete(self, db, docs: List[Document], doc_ids: List[str]) -> Dict:
+        """Tombstone vectors for doc_ids, then delete the rows of docs and their questions and answers."""
+        # Vectors first: if the DB delete fails the rows remain and the next attempt retries,
+        # whereas deleting rows first could leave unreachable vectors behind
+        vectors = get_faiss_index().delete_documents(doc_ids) if doc_ids else 0
+        if docs:
+            doc_pks = [d.id for d in docs]
+            question_ids = db.query(Question.id).filter(Question.document_id.in_(doc_pks))
+            try:
+                answers = db.query(Answer).filter(Answer.question_id.in_(question_ids)).delete(synchronize_session=False)
+                questions = db.query(Question).filter(Question.document_id.in_(doc_pks)).delete(synchronize_session=False)
+                db.query(Document).filter(Document.id.in_(doc_pks)).delete(synchronize_session=False)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        else:
+            answers = questions = 0
+        self._documents_deleted += len(docs)
+        self._vectors_tombstoned += vectors
+        return {
+            'documents_deleted': len(docs),
+            'questions_deleted': questions,
+            'answers_deleted': answers,
+            'vectors_tombstoned': vectors
+        }
+
+    def delete_document(self, doc_id: str) -> Optional[Dict]:
+        """
+        Delete one document by its document_id.
+
+        Returns:
+            Deletion counts, or None if the document is neither in the database nor the index
+        """
+        db = SessionLocal()
+        try:
+            docs = db.query(Document).filter(Document.doc_uid == doc_id).all()
+            result = self._delete(db, docs, [doc_id])
+        finally:
+            db.close()
+        if not result['documents_deleted'] and not result['vectors_tombstoned']:
+            return None
+        logger.info(f"Deleted document {doc_id}: {result}")
+        return {'document_id': doc_id, **result}
+
+    def _select_expired(self, db) -> List[Document]:
+        """Documents due for eviction under the TTL and max-documents policies, least recently queried first."""
+        last_used = func.coalesce(Document.last_queried_at, Document.uploaded_at)
+        expired: List[Document] = []
+        if self.ttl_seconds > 0:
+            cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+            expired = db.query(Document).filter(last_used < cutoff).order_by(last_used).all()
+        if self.max_documents > 0:
+            excess = db.query(func.count(Document.id)).scalar() - len(expired) - self.max_documents
+            if excess > 0:
+                query = db.query(Document).order_by(last_used)
+                if expired:
+                    query = query.filter(Document.id.notin_([d.id for d in expired]))
+                expired += query.limit(excess).all()
+        return [d for d in expired if not self.is_pinned(d.doc_uid)]
+
+    def _sweep_sync(self) -> Dict:
+        db = SessionLocal()
+        try:
+            docs = self._select_expired(db)
+            result = self._delete(db, docs, [d.doc_uid for d in docs if d.doc_uid]) if docs else None
+        finally:
+            db.close()
+        self._sweeps += 1
+        self._last_sweep_at = time.time()
+        if result:
+            logger.info(f"Retention sweep evicted {result['documents_deleted']} documents "
+                        f"({result['vectors_tombstoned']} vectors)")
+        return result or {'documents_deleted': 0, 'questions_deleted': 0, 'answers_deleted': 0, 'vectors_tombstoned': 0}
+
+    async def sweep(self) -> Dict:
+        """Apply the retention policies once, then compact if enough of the index is tombstoned."""
+        result = {}
+        if self.ttl_seconds > 0 or self.max_documents > 0:
+            result = await asyncio.to_thread(self._sweep_sync)
+        await self.maybe_compact()
+        return result
+
+    def _compact_sync(self, trigger: str) -> Dict:
+        with self._compaction_lock:
+            started_at = time.time()
+            result = get_faiss_index().compact()
+            if result['removed_vectors']:
+                self._compactions.append({'started_at': started_at, 'trigger': trigger, **result})
+                self._compaction_count += 1
+                self._reclaimed_bytes += result['reclaimed_bytes']
+                self._reclaimed_disk_bytes += result['reclaimed_disk_bytes']
+            return result
+
+    async def compact(self, trigger: str = "manual") -> Dict:
+        """Rebuild the index without tombstoned vectors. Queries are served throughout."""
+        return await asyncio.to_thread(self._compact_sync, trigger)
+
+    async def maybe_compact(self) -> Optional[Dict]:
+        """Compact if the tombstoned share of the index has reached COMPACTION_MIN_DEAD_FRACTION."""
+        stats = await asyncio.to_thread(get_faiss_index().get_stats)
+        dead, total = stats.get('tombstoned_vectors', 0), stats.get('total_vectors', 0)
+        if not dead or dead < total * self.min_dead_fraction:
+            return None
+        return await self.compact(trigger="threshold")
+
+    def schedule_compaction_check(self):
+        """Run maybe_compact() in the background, e.g. after an API deletion."""
+        task = asyncio.create_task(self.maybe_compact())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _sync_documents(self, documents: List[Dict], dropped: Iterable[str]) -> Tuple[int, int]:
+        """
+        Bring the database in line with a restored snapshot, in one transaction.
+
+        Rows of documents whose vectors the restore dropped lose their doc_uid, so requests
+        for them fail with DocumentNotIndexedError instead of finding nothing; their questions
+        and answers are kept. Snapshot documents the database does not know yet are added.
+        Workers and replicas starting from the same snapshot against a shared database
+        register concurrently; rows another one inserted first are skipped.
+
+        Returns:
+            Tuple of (rows added, rows unindexed)
+        """
+        db = SessionLocal()
+        new_row = lambda d: Document(doc_uid=d['document_id'], name=d['name'], source_url=d.get('source'))
+        dropped = list(dropped)
+        try:
+            unindexed = 0
+            for start in range(0, len(dropped), _UPDATE_BATCH):
+                unindexed += db.query(Document).filter(Document.doc_uid.in_(dropped[start:start + _UPDATE_BATCH])) \
+                    .update({Document.doc_uid: None}, synchronize_session=False)
+            known = {doc_uid for (doc_uid,) in db.query(Document.doc_uid).filter(Document.doc_uid.isnot(None))}
+            missing = [d for d in documents if d['document_id'] not in known]
+            try:
+                with db.begin_nested():
+                    db.add_all([new_row(d) for d in missing])
+                registered = len(missing)
+            except IntegrityError:
+                # Lost a race for some of them; insert row by row, skipping the duplicates
+                registered = 0
+                for d in missing:
+                    try:
+                        with db.begin_nested():
+                            db.add(new_row(d))
+                        registered += 1
+                    except IntegrityError:
+                        continue
+            db.commit()
+            return registered, unindexed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _restore_sync(self, path: str, if_empty: bool) -> Optional[Dict]:
+        # Holding the compaction lock keeps a compaction from swapping the old index back in
+        with self._compaction_lock, self._exclusive_restore():
+            index = get_faiss_index()
+            if if_empty and index.get_stats()['total_vectors'] > 0:
+                return None
+            started = time.perf_counter()
+            dropped = set(index.doc_ids())
+            manifest = index.restore_snapshot(path)
+            dropped.difference_update(d['document_id'] for d in manifest['documents'])
+            registered, unindexed = self._sync_documents(manifest['documents'], dropped)
+            self._snapshot = {
+                'version': manifest['version'],
+                'path': manifest['path'],
+                'created_at': manifest['created_at'],
+                'vectors': manifest['vectors'],
+                'documents': len(manifest['documents']),
+                'documents_registered': registered,
+                'documents_unindexed': unindexed,
+                'restored_at': time.time(),
+                'duration_seconds': time.perf_counter() - started
+            }
+        logger.info(f"Restored index snapshot {manifest['version']}: {manifest['vectors']} vectors, "
+                    f"{registered} new documents, {unindexed} dropped documents unindexed "
+                    f"in {self._snapshot['duration_seconds']:.3f}s")
+        return self._snapshot
+
+    async def restore_snapshot(self, path: str, if_empty: bool = False) -> Optional[Dict]:
+        """
+        Swap the index for a prebuilt snapshot and register its documents in the database.
+
+        Queries are served from the old index until the swap. Documents ingested since the
+        snapshot was built are dropped and answer 404 afterwards; their database rows and
+        questions remain. Documents being indexed while the restore runs wait for it.
+
+        Args:
+            path: Snapshot version directory, or a snapshot directory with a LATEST file
+            if_empty: Only restore into an empty index (new replicas starting up)
+
+        Returns:
+            Details of the restored snapshot, or None if skipped because the index was not empty
+
+        Raises:
+            SnapshotError: If the snapshot is missing, corrupt or built with other embeddings
+        """
+        return await asyncio.to_thread(self._restore_sync, path, if_empty)
+
+    def get_stats(self) -> Dict:
+        """Retention settings, deletion counters and recent compactions."""
+        return {
+            'ttl_seconds': self.ttl_seconds,
+            'max_documents': self.max_documents,
+            'sweep_interval': self.sweep_interval,
+            'min_dead_fraction': self.min_dead_fraction,
+            'sweeps': self._sweeps,
+            'last_sweep_at': self._last_sweep_at,
+            'documents_deleted': self._documents_deleted,
+            'vectors_tombstoned': self._vectors_tombstoned,
+            'pinned_documents': len(self._pins),
+            'compactions': self._compaction_count,
+            'reclaimed_bytes': self._reclaimed_bytes,
+            'reclaimed_disk_bytes': self._reclaimed_disk_bytes,
+            'recent_compactions': list(self._compactions),
+            'snapshot': self._snapshot
+        }
+
+
+# Global document lifecycle manager
+document_lifecycle = DocumentLifecycle()
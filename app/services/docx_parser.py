@@ -1,31 +1,140 @@
 # DOCX parsing utility
-from docx import Document
+import re
+import zipfile
+from typing import IO, Iterator, List
+from xml.etree.ElementTree import iterparse
 import logging
 
 logger = logging.getLogger(__name__)
 
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_PARAGRAPH = f"{_W}p"
+_TEXT = f"{_W}t"
+_TAB = f"{_W}tab"
+_BREAKS = (f"{_W}br", f"{_W}cr")
+_TABLE = f"{_W}tbl"
+_ROW = f"{_W}tr"
+_CELL = f"{_W}tc"
+_CONTAINERS = (f"{_W}body", f"{_W}hdr", f"{_W}ftr")
+
+_PART_RE = re.compile(r"^word/(header|footer)(\d*)\.xml$")
+
+def _iter_part_text(stream: IO[bytes]) -> Iterator[str]:
+    """
+    Stream text blocks from one WordprocessingML part in document order.
+
+    Paragraphs outside tables are yielded one by one; each table row is yielded as a
+    single ' | '-separated line of its cell texts. Elements are cleared as soon as they
+    have been read, so memory stays flat regardless of document size.
+    """
+    runs: List[str] = []  # Text of the paragraph being read
+    cells: List[List[str]] = []  # Stack of cell-text lists, one per open table row
+    paragraphs: List[List[str]] = []  # Stack of paragraph lists, one per open table cell
+    table_depth = 0
+    container = None  # Parent of top-level blocks, emptied after each one is read
+
+    for event, elem in iterparse(stream, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag in _CONTAINERS:
+                container = elem
+            elif tag == _TABLE:
+                table_depth += 1
+            elif tag == _ROW:
+                cells.append([])
+            elif tag == _CELL:
+                paragraphs.append([])
+            continue
+
+        if tag == _TEXT:
+            if elem.text:
+                runs.append(elem.text)
+        elif tag == _TAB:
+            runs.append("\t")
+        elif tag in _BREAKS:
+            runs.append("\n")
+        elif tag == _PARAGRAPH:
+            text = "".join(runs).strip()
+            runs = []
+            if text:
+                if table_depth:
+                    paragraphs[-1].append(text)
+                else:
+                    yield text
+            elem.clear()
+            if not table_depth and container is not None:
+                container.clear()
+        elif tag == _CELL:
+            cell_text = " ".join(paragraphs.pop())
+            if cell_text:
+                cells[-1].append(cell_text)
+            elem.clear()
+        elif tag == _ROW:
+            row_text = " | ".join(cells.pop())
+            if row_text:
+                if paragraphs:
+                    # Nested table: the row becomes text of the enclosing cell
+                    paragraphs[-1].append(row_text)
+                else:
+                    yield row_text
+            elem.clear()
+        elif tag == _TABLE:
+            table_depth -= 1
+            elem.clear()
+            if not table_depth and container is not None:
+                container.clear()
+
+def iter_docx_text(file_path: str) -> Iterator[str]:
+    """
+    Stream text from a DOCX file without building a document object tree.
+
+    Yields header text first, then body paragraphs and table rows in document order,
+    then footer text. Identical header/footer blocks (e.g. first-page and default
+    headers) are only yielded once.
+
+    Args:
+        file_path: Path to the DOCX file
+
+    Yields:
+        Non-empty text blocks
+    """
+    with zipfile.ZipFile(file_path) as zf:
+        parts = {"header": [], "footer": []}
+        for name in zf.namelist():
+            match = _PART_RE.match(name)
+            if match:
+                parts[match.group(1)].append((int(match.group(2) or 0), name))
+
+        def iter_parts(kind: str) -> Iterator[str]:
+            seen = set()
+            for _, name in sorted(parts[kind]):
+                with zf.open(name) as stream:
+                    for text in _iter_part_text(stream):
+                        if text not in seen:
+                            seen.add(text)
+                            yield text
+
+        yield from iter_parts("header")
+        with zf.open("word/document.xml") as stream:
+            yield from _iter_part_text(stream)
+        yield from iter_parts("footer")
+
 def extract_text_from_docx(file_path: str) -> str:
     """
     Extract text from DOCX file.
-    
+
     Args:
         file_path: Path to the DOCX file
-        
+
     Returns:
         Extracted text as a single string
     """
     try:
-        doc = Document(file_path)
-        text_parts = []
-        
-        for para in doc.paragraphs:
-            if para.text.strip():
-                text_parts.append(para.text.strip())
-        
+        text_parts = list(iter_docx_text(file_path))
         full_text = "\n\n".join(text_parts)
-        logger.info(f"Successfully extracted text from DOCX with {len(text_parts)} paragraphs")
+        logger.info(f"Successfully extracted text from DOCX with {len(text_parts)} blocks")
         return full_text
-        
+
     except Exception as e:
         logger.error(f"Failed to extract text from DOCX {file_path}: {e}")
         raise RuntimeError(f"DOCX text extraction failed: {e}")
@@ -1,45 +1,258 @@
 # Email parsing utility
-from email import message_from_string
+import os
+import tempfile
+import time
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from email import message_from_bytes, message_from_string, policy
+from email.message import EmailMessage
+from html.parser import HTMLParser
+from multiprocessing import get_context
+from threading import Lock
+from typing import List, Optional, Tuple, Union
 import logging
+from app.core.config import EMAIL_ATTACHMENT_WORKERS, EMAIL_ATTACHMENT_MAX_BYTES, EMAIL_ATTACHMENT_TIMEOUT
+from app.services.deadline import DeadlineExceeded, timeout_for
 
 logger = logging.getLogger(__name__)
 
-def extract_text_from_email(raw_email: str) -> str:
+# Chunk types used to tag where email text came from
+EMAIL_BODY = "email_body"
+EMAIL_ATTACHMENT_PDF = "email_attachment_pdf"
+EMAIL_ATTACHMENT_DOCX = "email_attachment_docx"
+
+_ATTACHMENT_TYPES = {
+    ".pdf": EMAIL_ATTACHMENT_PDF,
+    "application/pdf": EMAIL_ATTACHMENT_PDF,
+    ".docx": EMAIL_ATTACHMENT_DOCX,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": EMAIL_ATTACHMENT_DOCX,
+}
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collects visible text from HTML, breaking lines at block-level elements."""
+
+    _SKIP = {"script", "style", "head", "title"}
+    _BLOCKS = {"p", "div", "br", "tr", "li", "h1", "h2", "h3", "h4", "h5", "h6", "table", "ul", "ol", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts: List[str] = []
+        self._skip_depth = 0
+        self._row_cells = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP:
+            self._skip_depth += 1
+        elif tag in self._BLOCKS:
+            self._parts.append("\n")
+            if tag == "tr":
+                self._row_cells = 0
+        elif tag in ("td", "th"):
+            # Table rows become ' | '-separated lines, as in the DOCX parser
+            if self._row_cells:
+                self._parts.append(" | ")
+            self._row_cells += 1
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in self._BLOCKS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def text(self) -> str:
+        lines = (" ".join(line.split()) for line in "".join(self._parts).splitlines())
+        return "\n".join(line for line in lines if line)
+
+def html_to_text(html: str) -> str:
+    """Convert an HTML body to plain text."""
+    parser = _HTMLTextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+def _parse_attachment(filename: str, chunk_type: str, payload: bytes) -> str:
+    """Extract text from one attachment. Runs in an attachment worker process."""
+    from app.services.pdf_parser import extract_text_from_pdf
+    from app.services.docx_parser import extract_text_from_docx
+
+    suffix = ".pdf" if chunk_type == EMAIL_ATTACHMENT_PDF else ".docx"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp.write(payload)
+    try:
+        if chunk_type == EMAIL_ATTACHMENT_PDF:
+            return extract_text_from_pdf(tmp.name)
+        return extract_text_from_docx(tmp.name)
+    finally:
+        os.remove(tmp.name)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = Lock()
+
+# Times an attachment is resubmitted after the shared pool was discarded under it
+_POOL_RETRIES = 2
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Shared process pool for attachment parsing, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked: the server process runs threads and an event loop
+            _pool = ProcessPoolExecutor(max_workers=EMAIL_ATTACHMENT_WORKERS, mp_context=get_context("spawn"))
+        return _pool
+
+def _discard_pool(pool: ProcessPoolExecutor):
     """
-    Extract text from email content.
-    
+    Replace a broken pool, or one whose worker is stuck on a timed-out attachment, and kill its processes.
+
+    Shutting the pool down alone would leave the stuck worker running. Terminating it also
+    fails attachments other emails still have in flight on this pool; those see
+    BrokenProcessPool or CancelledError and are resubmitted to the new pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+def _payload_size(part: EmailMessage) -> int:
+    """Upper bound on an attachment's decoded size, read from its encoded payload without decoding it."""
+    encoded = part.get_payload()
+    if not isinstance(encoded, str):
+        return 0
+    size = len(encoded)
+    if part.get("content-transfer-encoding", "").strip().lower() == "base64":
+        size = (size - encoded.count("\n")) * 3 // 4
+    try:
+        declared = int(part.get_param("size", header="content-disposition") or 0)
+    except (TypeError, ValueError):
+        declared = 0
+    return max(size, declared)
+
+def _submit(filename: str, chunk_type: str, payload: bytes) -> Tuple[ProcessPoolExecutor, Future]:
+    pool = _get_pool()
+    return pool, pool.submit(_parse_attachment, filename, chunk_type, payload)
+
+def _attachment_type(part: EmailMessage) -> Optional[str]:
+    filename = part.get_filename() or ""
+    ext = os.path.splitext(filename)[-1].lower()
+    return _ATTACHMENT_TYPES.get(ext) or _ATTACHMENT_TYPES.get(part.get_content_type())
+
+def _collect_parts(msg: EmailMessage, bodies: List[str], attachments: List[Tuple[str, str, bytes]]):
+    """Walk a message, gathering body texts and parseable attachments (recursing into forwarded emails)."""
+    body = msg.get_body(preferencelist=("plain", "html"))
+    if body is not None:
+        content = body.get_content()
+        text = html_to_text(content) if body.get_content_type() == "text/html" else content
+        if text.strip():
+            bodies.append(text.strip())
+
+    for part in msg.iter_attachments():
+        if part.get_content_type() == "message/rfc822":
+            _collect_parts(part.get_content(), bodies, attachments)
+            continue
+        chunk_type = _attachment_type(part)
+        filename = part.get_filename() or "attachment"
+        if chunk_type is None:
+            logger.debug(f"Skipping unsupported email attachment {filename} ({part.get_content_type()})")
+            continue
+        # Checked before decoding so an oversized attachment is never decoded into memory
+        size = _payload_size(part)
+        if size > EMAIL_ATTACHMENT_MAX_BYTES:
+            logger.warning(f"Skipping email attachment {filename}: {size} bytes exceeds "
+                           f"EMAIL_ATTACHMENT_MAX_BYTES ({EMAIL_ATTACHMENT_MAX_BYTES})")
+            continue
+        attachments.append((filename, chunk_type, part.get_payload(decode=True) or b""))
+
+def extract_email_parts(raw_email: Union[str, bytes]) -> List[Tuple[str, str]]:
+    """
+    Extract body text and attachment text from an email.
+
+    The body is taken from the text/plain part, or the text/html part converted to text
+    when no plain part exists. PDF and DOCX attachments are parsed in parallel in a
+    process pool; each is limited to EMAIL_ATTACHMENT_MAX_BYTES and EMAIL_ATTACHMENT_TIMEOUT
+    seconds and skipped (with a warning) if it exceeds either. Attachments caught in a pool
+    restart are retried; if that keeps failing the whole email fails rather than losing them.
+
     Args:
-        raw_email: Raw email content as string
-        
+        raw_email: Raw email content as string or bytes
+
     Returns:
-        Extracted text as a single string
+        List of (chunk_type, text) tuples: the body first, then attachments in message order
     """
     try:
-        msg = message_from_string(raw_email)
-        body_parts = []
-        
-        def decode_payload(payload):
-            if isinstance(payload, bytes):
-                return payload.decode(errors="ignore")
-            return payload or ""
-        
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == "text/plain":
-                    payload = part.get_payload(decode=True)
-                    text = decode_payload(payload)
-                    if text.strip():
-                        body_parts.append(text.strip())
+        if isinstance(raw_email, bytes):
+            msg = message_from_bytes(raw_email, policy=policy.default)
         else:
-            payload = msg.get_payload(decode=True)
-            text = decode_payload(payload)
+            msg = message_from_string(raw_email, policy=policy.default)
+
+        bodies: List[str] = []
+        attachments: List[Tuple[str, str, bytes]] = []
+        _collect_parts(msg, bodies, attachments)
+
+        parts: List[Tuple[str, str]] = []
+        if bodies:
+            parts.append((EMAIL_BODY, "\n\n".join(bodies)))
+        if not attachments:
+            logger.info(f"Successfully extracted text from email with {len(bodies)} body parts")
+            return parts
+
+        start = time.monotonic()
+        submitted = [_submit(*attachment) for attachment in attachments]
+        stuck = []
+        for i, ((pool, future), attachment) in enumerate(zip(submitted, attachments)):
+            filename, chunk_type, _ = attachment
+            # Attachments queued behind a full pool get their time limit from when a worker frees up
+            limit = start + EMAIL_ATTACHMENT_TIMEOUT * (1 + i // EMAIL_ATTACHMENT_WORKERS)
+            retries = 0
+            while True:
+                try:
+                    text = future.result(timeout=timeout_for(max(0.0, limit - time.monotonic())))
+                except (BrokenProcessPool, CancelledError) as e:
+                    # Another email's timeout (or a crashed worker) took the pool down under us
+                    _discard_pool(pool)
+                    if retries == _POOL_RETRIES:
+                        raise RuntimeError(f"Attachment {filename} failed after {retries} attachment pool restarts: {e!r}")
+                    retries += 1
+                    pool, future = _submit(*attachment)
+                    limit = time.monotonic() + EMAIL_ATTACHMENT_TIMEOUT
+                    continue
+                except (FutureTimeoutError, DeadlineExceeded):
+                    if not future.cancel():
+                        stuck.append(pool)
+                    logger.warning(f"Skipping email attachment {filename}: parsing exceeded its time limit")
+                    text = ""
+                except Exception as e:
+                    logger.warning(f"Skipping email attachment {filename}: {e}")
+                    text = ""
+                break
             if text.strip():
-                body_parts.append(text.strip())
-        
-        full_text = "\n\n".join(body_parts)
-        logger.info(f"Successfully extracted text from email with {len(body_parts)} parts")
-        return full_text
-        
+                parts.append((chunk_type, f"[Attachment: {filename}]\n\n{text.strip()}"))
+        for pool in set(stuck):
+            _discard_pool(pool)
+
+        logger.info(f"Successfully extracted text from email with {len(bodies)} body parts "
+                    f"and {len(parts) - bool(bodies)}/{len(attachments)} attachments")
+        return parts
+
     except Exception as e:
         logger.error(f"Failed to extract text from email: {e}")
         raise RuntimeError(f"Email text extraction failed: {e}")
+
+def extract_text_from_email(raw_email: Union[str, bytes]) -> str:
+    """
+    Extract text from email content.
+
+    Args:
+        raw_email: Raw email content as string or bytes
+
+    Returns:
+        Extracted body and attachment text as a single string
+    """
+    return "\n\n".join(text for _, text in extract_email_parts(raw_email))
@@ -1,67 +1,64 @@
 
-import openai
-import requests
-from app.services.faiss_client import faiss_index
-from typing import List, Dict
+import asyncio
+import threading
+from app.services.embedding_providers import embedding_provider_loaded, get_embedding_provider
+from app.services.profiling import profile_stage
+from typing import List, Dict, Optional
 import logging
-from app.core.config import EMBEDDING_MODEL, OPENAI_API_KEY
 
 logger = logging.getLogger(__name__)
 
+_faiss_index = None
+_faiss_index_lock = threading.Lock()
+
+def get_faiss_index():
+    """Return the process-wide FAISS index, loading it from disk on first use."""
+    global _faiss_index
+    if _faiss_index is None:
+        with _faiss_index_lock:
+            if _faiss_index is None:
+                # Deferred: importing faiss and reading the index dominate cold start
+                from app.services.faiss_client import create_index
+                _faiss_index = create_index()
+    return _faiss_index
+
+def faiss_index_loaded() -> bool:
+    """Whether the FAISS index has been loaded in this process."""
+    return _faiss_index is not None
+
+def close_faiss_index():
+    """Close the FAISS index if it was loaded (stops shard processes for a sharded index)."""
+    global _faiss_index
+    with _faiss_index_lock:
+        if _faiss_index is not None:
+            _faiss_index.close()
+            _faiss_index = None
+
 # Get embedding for a list of texts
+@profile_stage("embed")
 async def get_embeddings(texts: List[str]) -> List[List[float]]:
-    """Get embeddings for a list of texts using OpenAI's embedding model."""
+    """Get embeddings for a list of texts from the configured embedding provider."""
     try:
-        # Try OpenAI client first
-        try:
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            
-            response = client.embeddings.create(
-                input=texts,
-                model=EMBEDDING_MODEL
-            )
-            return [d.embedding for d in response.data]
-            
-        except Exception as client_error:
-            logger.warning(f"OpenAI client failed, trying direct HTTP: {client_error}")
-            
-            # Fallback to direct HTTP request
-            headers = {
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "input": texts,
-                "model": EMBEDDING_MODEL
-            }
-            
-            response = requests.post(
-                "https://api.openai.com/v1/embeddings",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return [item['embedding'] for item in result.get('data', [])]
-            else:
-                logger.error(f"HTTP request failed: {response.status_code} - {response.text}")
-                raise RuntimeError(f"HTTP {response.status_code} - {response.text}")
-                
+        if embedding_provider_loaded():
+            provider = get_embedding_provider()
+        else:
+            # A local model is loaded at startup; should a call get here first, load it off the event loop
+            provider = await asyncio.to_thread(get_embedding_provider)
+        return await provider.embed(texts)
     except Exception as e:
         logger.error(f"Failed to get embeddings: {e}")
         raise RuntimeError(f"Embedding generation failed: {e}")
 
 # Upsert chunks to FAISS
-async def upsert_chunks_to_faiss(chunks: List[str], doc_id: str) -> List[str]:
+@profile_stage("index")
+async def upsert_chunks_to_faiss(chunks: List[str], doc_id: str, chunk_types: Optional[List[str]] = None) -> List[str]:
     """
     Upsert document chunks to FAISS index with metadata.
     
     Args:
         chunks: List of text chunks
         doc_id: Document identifier
+        chunk_types: Optional chunk type per chunk (e.g. which email part it came from)
         
     Returns:
         List of vector IDs
@@ -70,21 +67,11 @@ async def upsert_chunks_to_faiss(chunks: List[str], doc_id: str) -> List[str]:
         # Get embeddings for chunks
         embeddings = await get_embeddings(chunks)
         
-        # Prepare metadata for each chunk
-        metadata = []
-        vector_ids = []
-        
-        for i, chunk in enumerate(chunks):
-            metadata.append({
-                'text': chunk,
-                'doc_id': doc_id,
-                'chunk_index': i,
-                'chunk_type': 'document_segment'
-            })
-            vector_ids.append(f"{doc_id}_chunk_{i}")
-        
-        # Upsert to FAISS
-        result_ids = faiss_index.upsert(embeddings, metadata, vector_ids)
+        # Upsert to FAISS; chunk metadata is stored column-wise by the index
+        if chunk_types is None:
+            result_ids = get_faiss_index().upsert_document(embeddings, chunks, doc_id)
+        else:
+            result_ids = get_faiss_index().upsert_document(embeddings, chunks, doc_id, chunk_type=chunk_types)
         
         logger.info(f"Successfully upserted {len(chunks)} chunks to FAISS for document {doc_id}")
         return result_ids
@@ -94,13 +81,39 @@ async def upsert_chunks_to_faiss(chunks: List[str], doc_id: str) -> List[str]:
         raise RuntimeError(f"FAISS upsert failed: {e}")
 
 # Query FAISS for top_k most similar chunks
-async def query_faiss(query: str, top_k: int = 5) -> List[Dict]:
+@profile_stage("retrieve")
+async def query_faiss_batch(queries: List[str], top_k: int = 5, doc_id: Optional[str] = None) -> List[List[Dict]]:
+    """
+    Query FAISS for several queries, embedding them in a single request.
+    
+    Args:
+        queries: Query texts
+        top_k: Number of top results to return per query
+        doc_id: Optional document identifier to restrict the search to
+        
+    Returns:
+        Per query, a list of dictionaries with 'id', 'score', and 'metadata' keys
+    """
+    try:
+        embeddings = await get_embeddings(queries)
+        index = get_faiss_index()
+        results = [index.query(embedding, top_k=top_k, doc_id=doc_id) for embedding in embeddings]
+        logger.info(f"FAISS batch query for {len(queries)} queries returned {sum(map(len, results))} results")
+        return results
+        
+    except Exception as e:
+        logger.error(f"FAISS batch query failed: {e}")
+        raise RuntimeError(f"FAISS query failed: {e}")
+
+@profile_stage("retrieve")
+async def query_faiss(query: str, top_k: int = 5, doc_id: Optional[str] = None) -> List[Dict]:
     """
     Query FAISS index for similar document chunks.
     
     Args:
         query: Query text
         top_k: Number of top results to return
+        doc_id: Optional document identifier to restrict the search to
         
     Returns:
         List of dictionaries with 'id', 'score', and 'metadata' keys
@@ -110,7 +123,7 @@ async def query_faiss(query: str, top_k: int = 5) -> List[Dict]:
         query_embedding = (await get_embeddings([query]))[0]
         
         # Query FAISS index
-        results = faiss_index.query(query_embedding, top_k=top_k)
+        results = get_faiss_index().query(query_embedding, top_k=top_k, doc_id=doc_id)
         
         logger.info(f"FAISS query returned {len(results)} results")
         return results
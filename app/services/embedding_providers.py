@@ -0,0 +1,351 @@
+# Embedding provider backends (OpenAI, local CPU model, deterministic hashing)
+import asyncio
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+import logging
+import numpy as np
+from app.core.config import (
+    EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_MODEL_PATH, EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_WAIT_MS, EMBEDDING_THREADS, FAISS_DIMENSION, require_openai_api_key
+)
+from app.services.deadline import timeout_for
+from app.services.profiling import profile_stage
+from app.services.rate_limiter import (
+    embedding_limiter, estimate_tokens, retry_after_from_headers, RateLimitExceeded
+)
+
+logger = logging.getLogger(__name__)
+
+
+def fit_dimension(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """
+    Fit embeddings to the FAISS index dimension.
+
+    Wider vectors are truncated and narrower ones zero-padded; both keep cosine
+    similarity meaningful once FAISS L2-normalises them.
+    """
+    native = vectors.shape[1]
+    if native == dim:
+        return vectors
+    if native > dim:
+        return np.ascontiguousarray(vectors[:, :dim])
+    padded = np.zeros((vectors.shape[0], dim), dtype=vectors.dtype)
+    padded[:, :native] = vectors
+    return padded
+
+
+class EmbeddingProvider:
+    """Base class for embedding backends. Subclasses implement embed()."""
+
+    name = "base"
+
+    def __init__(self, dimension: int = None):
+        self.dimension = dimension or FAISS_DIMENSION
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the provider."""
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings from the OpenAI API, via the SDK with a raw HTTP fallback."""
+
+    name = "openai"
+
+    def __init__(self, dimension: int = None, model: str = None):
+        super().__init__(dimension)
+        self.model = model or EMBEDDING_MODEL
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        estimated = sum(estimate_tokens(text) for text in texts)
+        return await embedding_limiter.call_async(estimated, lambda: self._embed_sync(texts))
+
+    @profile_stage("embed")
+    def _embed_sync(self, texts: List[str]):
+        import openai
+        import requests
+
+        api_key = require_openai_api_key()
+
+        # Try OpenAI client first
+        try:
+            # Retries are handled by the shared rate limiter, not the SDK
+            client = openai.OpenAI(api_key=api_key, max_retries=0)
+
+            raw = client.embeddings.with_raw_response.create(
+                input=texts,
+                model=self.model,
+                timeout=timeout_for(30)
+            )
+            response = raw.parse()
+            used = response.usage.total_tokens if response.usage else None
+            return [d.embedding for d in response.data], raw.headers, used
+
+        except openai.RateLimitError as e:
+            headers = e.response.headers if e.response is not None else None
+            raise RateLimitExceeded(str(e), retry_after_from_headers(headers), headers)
+        except Exception as client_error:
+            logger.warning(f"OpenAI client failed, trying direct HTTP: {client_error}")
+
+        # Fallback to direct HTTP request
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+        data = {
+            "input": texts,
+            "model": self.model
+        }
+
+        response = requests.post(
+            "https://api.openai.com/v1/embeddings",
+            headers=headers,
+            json=data,
+            timeout=timeout_for(30)
+        )
+
+        if response.status_code == 200:
+            result = response.json()
+            used = result.get('usage', {}).get('total_tokens')
+            return [item['embedding'] for item in result.get('data', [])], response.headers, used
+        if response.status_code == 429:
+            raise RateLimitExceeded(f"HTTP 429 - {response.text}", retry_after_from_headers(response.headers), response.headers)
+        logger.error(f"HTTP request failed: {response.status_code} - {response.text}")
+        raise RuntimeError(f"HTTP {response.status_code} - {response.text}")
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic feature-hashing embedder.
+
+    Needs no model or network access; identical text always maps to the same vector,
+    which makes it suitable for tests and offline smoke runs.
+    """
+
+    name = "hashing"
+    _token_re = re.compile(r"\w+")
+
+    @profile_stage("embed")
+    def embed_sync(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = self._token_re.findall(text.lower())
+            # Unigrams and bigrams so word order carries some signal
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dimension] += 1.0 if (value >> 63) else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_sync(texts).tolist()
+
+
+class _MicroBatcher:
+    """
+    Coalesces embedding requests from concurrent callers into model-sized batches.
+
+    A collector thread drains the request queue for up to `wait_ms` (or until
+    `batch_size` texts are pending) and hands each batch to a thread pool, so several
+    batches can run in parallel while the model releases the GIL. A single request larger
+    than `batch_size` is encoded `batch_size` texts at a time.
+    """
+
+    def __init__(self, encode, batch_size: int, wait_ms: float, threads: int):
+        self._encode = encode
+        self._batch_size = batch_size
+        self._wait = wait_ms / 1000.0
+        self._requests: "queue.Queue" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="embed")
+        self._closed = False
+        self._collector = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+        self._collector.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        self._requests.put((texts, future))
+        return future
+
+    def close(self):
+        self._closed = True
+        self._requests.put(None)
+        self._collector.join(timeout=1)
+        self._pool.shutdown(wait=False)
+
+    def _collect(self):
+        while not self._closed:
+            item = self._requests.get()
+            if item is None:
+                return
+            batch = [item]
+            pending = len(item[0])
+            deadline = time.monotonic() + self._wait
+            while pending < self._batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._closed = True
+                    break
+                batch.append(item)
+                pending += len(item[0])
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch):
+        # Claim each future before encoding: callers cancelled while queued (deadline hit,
+        # wrap_future cancelled) are dropped, and the rest can no longer be cancelled under us
+        batch = [(request_texts, future) for request_texts, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        try:
+            vectors = np.concatenate([
+                self._encode(texts[start:start + self._batch_size])
+                for start in range(0, len(texts), self._batch_size)
+            ])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        offset = 0
+        for request_texts, future in batch:
+            future.set_result(vectors[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    CPU embeddings from a model on local disk.
+
+    A directory containing `model.onnx` and `tokenizer.json` is served with ONNX Runtime
+    (mean-pooled last hidden state); anything else is loaded with sentence-transformers.
+    """
+
+    name = "local"
+
+    def __init__(self, dimension: int = None, model_path: str = None, batch_size: int = None,
+                 wait_ms: float = None, threads: int = None):
+        super().__init__(dimension)
+        self.model_path = model_path or EMBEDDING_MODEL_PATH
+        if not self.model_path:
+            raise RuntimeError("EMBEDDING_MODEL_PATH is required for the local embedding provider")
+        self.batch_size = batch_size or EMBEDDING_BATCH_SIZE
+
+        if os.path.exists(os.path.join(self.model_path, "model.onnx")):
+            self._encode_raw = self._load_onnx()
+        else:
+            self._encode_raw = self._load_sentence_transformers()
+
+        native_dim = self._encode_raw(["dimension probe"]).shape[1]
+        if native_dim != self.dimension:
+            logger.warning(f"Local embedding model produces {native_dim}-d vectors; "
+                           f"fitting to FAISS_DIMENSION={self.dimension}")
+
+        self._batcher = _MicroBatcher(
+            self._encode,
+            self.batch_size,
+            EMBEDDING_BATCH_WAIT_MS if wait_ms is None else wait_ms,
+            threads or EMBEDDING_THREADS
+        )
+        logger.info(f"Loaded local embedding model from {self.model_path} ({native_dim} dimensions)")
+
+    def _load_sentence_transformers(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("sentence-transformers is required for the local embedding provider "
+                               "(pip install sentence-transformers)")
+        model = SentenceTransformer(self.model_path, device="cpu")
+
+        def encode(texts: List[str]) -> np.ndarray:
+            return model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True).astype(np.float32)
+        return encode
+
+    def _load_onnx(self):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise RuntimeError("onnxruntime and tokenizers are required for ONNX embedding models "
+                               "(pip install onnxruntime tokenizers)")
+        session = onnxruntime.InferenceSession(
+            os.path.join(self.model_path, "model.onnx"),
+            providers=["CPUExecutionProvider"]
+        )
+        input_names = {i.name for i in session.get_inputs()}
+        tokenizer = Tokenizer.from_file(os.path.join(self.model_path, "tokenizer.json"))
+        tokenizer.enable_padding()
+        tokenizer.enable_truncation(max_length=512)
+
+        def encode(texts: List[str]) -> np.ndarray:
+            encodings = tokenizer.encode_batch(texts)
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = session.run(None, feeds)[0]
+            mask = attention_mask[:, :, None].astype(np.float32)
+            return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return encode
+
+    @profile_stage("embed")
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return fit_dimension(self._encode_raw(texts), self.dimension)
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = await asyncio.wrap_future(self._batcher.submit(texts))
+        return vectors.tolist()
+
+    def close(self):
+        self._batcher.close()
+
+
+_PROVIDERS = {
+    OpenAIEmbeddingProvider.name: OpenAIEmbeddingProvider,
+    LocalEmbeddingProvider.name: LocalEmbeddingProvider,
+    HashingEmbeddingProvider.name: HashingEmbeddingProvider,
+}
+
+_provider: Optional[EmbeddingProvider] = None
+_provider_lock = threading.Lock()
+
+
+def create_embedding_provider(name: str = None) -> EmbeddingProvider:
+    """Instantiate the embedding provider selected by name (defaults to EMBEDDING_PROVIDER)."""
+    name = (name or EMBEDDING_PROVIDER).lower()
+    if name not in _PROVIDERS:
+        raise ValueError(f"Unknown embedding provider: {name}. Choose from {', '.join(_PROVIDERS)}")
+    return _PROVIDERS[name]()
+
+
+def embedding_provider_loaded() -> bool:
+    """Whether the embedding provider has been created in this process."""
+    return _provider is not None
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Return the process-wide embedding provider, creating it on first use."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_embedding_provider()
+                logger.info(f"Using {_provider.name} embedding provider")
+    return _provider
@@ -2,26 +2,78 @@ import faiss
 import numpy as np
 import pickle
 import os
-from typing import List, Dict, Optional
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple, Union
 import logging
-from app.core.config import FAISS_INDEX_PATH, FAISS_DIMENSION
+from app.core.config import FAISS_INDEX_PATH, FAISS_DIMENSION, FAISS_SHARDS
+from app.services.chunk_store import ChunkStore, DEFAULT_CHUNK_TYPE
+from app.services.index_snapshot import load_snapshot
+from app.services.profiling import profile_stage
 
 logger = logging.getLogger(__name__)
 
+class _ReadWriteLock:
+    """Many readers or one writer; waiting writers block new readers so they are not starved."""
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+    
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
 class FaissIndex:
     """FAISS vector index for local semantic search with metadata storage."""
     
     def __init__(self, dim=None, index_path=None):
         self.dim = dim or FAISS_DIMENSION
         self.index_path = index_path or FAISS_INDEX_PATH
-        self.metadata_path = f"{self.index_path}_metadata.pkl"
+        self.chunks_path = f"{self.index_path}_chunks.npz"
+        self.metadata_path = f"{self.index_path}_metadata.pkl"  # Legacy per-chunk dict storage
         
         # Initialize FAISS index
         self.index = faiss.IndexFlatIP(self.dim)  # Inner product for cosine similarity
         
-        # Metadata storage
-        self.metadata = []
-        self.vector_ids = []
+        # Columnar metadata storage, one row per FAISS vector
+        self.chunks = ChunkStore()
+        
+        # Writers (and compaction's snapshot/swap) serialise on _write_lock; queries only take
+        # _swap_lock long enough to read a consistent (index, chunks) pair. In-place changes to
+        # the current pair (adding vectors, tombstoning) hold _rows for writing, and searches
+        # hold it for reading: FAISS may reallocate its storage while adding.
+        self._write_lock = threading.RLock()
+        self._swap_lock = threading.Lock()
+        self._rows = _ReadWriteLock()
         
         # Load existing index if available
         self._load_index()
@@ -33,28 +85,40 @@ class FaissIndex:
                 self.index = faiss.read_index(f"{self.index_path}.index")
                 logger.info(f"Loaded existing FAISS index with {self.index.ntotal} vectors")
                 
-                if os.path.exists(self.metadata_path):
+                if os.path.exists(self.chunks_path):
+                    self.chunks = ChunkStore.load(self.chunks_path)
+                elif os.path.exists(self.metadata_path):
+                    # Migrate legacy pickled metadata dicts to the columnar store
                     with open(self.metadata_path, 'rb') as f:
                         data = pickle.load(f)
-                        self.metadata = data.get('metadata', [])
-                        self.vector_ids = data.get('vector_ids', [])
-                    logger.info(f"Loaded metadata for {len(self.metadata)} vectors")
+                    self.chunks.append_metadata(data.get('metadata', []), data.get('vector_ids') or None)
+                    self.chunks.save(self.chunks_path)
+                    os.remove(self.metadata_path)
+                    logger.info(f"Migrated legacy metadata pickle to {self.chunks_path}")
+                logger.info(f"Loaded metadata for {len(self.chunks)} vectors")
         except Exception as e:
             logger.warning(f"Could not load existing index: {e}")
     
+    @profile_stage("index_save")
     def _save_index(self):
         """Save FAISS index and metadata to disk."""
         try:
             faiss.write_index(self.index, f"{self.index_path}.index")
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump({
-                    'metadata': self.metadata,
-                    'vector_ids': self.vector_ids
-                }, f)
+            self.chunks.save(self.chunks_path)
             logger.info(f"Saved FAISS index with {self.index.ntotal} vectors")
         except Exception as e:
             logger.error(f"Failed to save index: {e}")
     
+    def _add_vectors(self, vectors: List[List[float]]):
+        # Convert to numpy array
+        vectors_array = np.array(vectors, dtype='float32')
+        
+        # Normalize vectors for cosine similarity
+        faiss.normalize_L2(vectors_array)
+        
+        # Add to FAISS index
+        self.index.add(vectors_array)
+    
     def upsert(self, vectors: List[List[float]], metadata: List[Dict], vector_ids: Optional[List[str]] = None):
         """
         Upsert vectors with metadata to FAISS index.
@@ -67,83 +131,309 @@ class FaissIndex:
         if len(vectors) != len(metadata):
             raise ValueError("Number of vectors must match number of metadata items")
         
-        # Convert to numpy array
-        vectors_array = np.array(vectors, dtype='float32')
-        
-        # Normalize vectors for cosine similarity
-        faiss.normalize_L2(vectors_array)
-        
-        # Add to FAISS index
-        self.index.add(vectors_array)
-        
-        # Store metadata
-        self.metadata.extend(metadata)
+        with self._write_lock:
+            with self._rows.write():
+                self._add_vectors(vectors)
+                vector_ids = self.chunks.append_metadata(metadata, vector_ids)
+            
+            # Save to disk
+            self._save_index()
         
-        # Generate or use provided vector IDs
-        if vector_ids is None:
-            start_id = len(self.vector_ids)
-            vector_ids = [f"vec_{start_id + i}" for i in range(len(vectors))]
+        logger.info(f"Upserted {len(vectors)} vectors to FAISS index")
+        return vector_ids
+    
+    @profile_stage("index")
+    def upsert_document(self, vectors: List[List[float]], chunks: List[str], doc_id: str,
+                        chunk_type: Union[str, List[str]] = DEFAULT_CHUNK_TYPE) -> List[str]:
+        """
+        Upsert all chunks of one document without building per-chunk metadata dicts.
         
-        self.vector_ids.extend(vector_ids)
+        Args:
+            vectors: List of embedding vectors
+            chunks: Chunk texts, in document order
+            doc_id: Document identifier
+            chunk_type: Chunk type label, or one label per chunk
+            
+        Returns:
+            List of vector IDs
+        """
+        if len(vectors) != len(chunks):
+            raise ValueError("Number of vectors must match number of chunks")
         
-        # Save to disk
-        self._save_index()
+        with self._write_lock:
+            with self._rows.write():
+                self._add_vectors(vectors)
+                vector_ids = self.chunks.append(chunks, doc_id, chunk_type=chunk_type)
+            
+            # Save to disk
+            self._save_index()
         
         logger.info(f"Upserted {len(vectors)} vectors to FAISS index")
         return vector_ids
     
-    def query(self, query_vector: List[float], top_k: int = 5) -> List[Dict]:
+    @profile_stage("retrieve")
+    def query(self, query_vector: List[float], top_k: int = 5, doc_id: Optional[str] = None) -> List[Dict]:
         """
         Query FAISS index for similar vectors.
         
         Args:
             query_vector: Query embedding vector
             top_k: Number of top results to return
+            doc_id: Optional document identifier to restrict results to
             
         Returns:
             List of dictionaries with 'id', 'score', and 'metadata' keys
         """
-        if self.index.ntotal == 0:
+        with self._rows.read():
+            return self._query(query_vector, top_k, doc_id)
+    
+    def _query(self, query_vector: List[float], top_k: int, doc_id: Optional[str]) -> List[Dict]:
+        with self._swap_lock:
+            index, chunks = self.index, self.chunks
+        if index.ntotal == 0:
             return []
         
+        doc_ordinal = None
+        if doc_id is not None:
+            doc_ordinal = chunks.doc_ordinal(doc_id)
+            if doc_ordinal is None:
+                return []
+        dead = chunks.dead_mask()
+        rows_known = len(dead) if dead is not None else len(chunks)
+        
         # Convert to numpy array and normalize
         query_array = np.array([query_vector], dtype='float32')
         faiss.normalize_L2(query_array)
         
-        # Search
-        scores, indices = self.index.search(query_array, min(top_k, self.index.ntotal))
+        if doc_ordinal is not None:
+            # Search only the document's rows (live, since the document is not tombstoned)
+            doc_rows = np.flatnonzero(chunks.doc_ordinals[:min(rows_known, index.ntotal)] == doc_ordinal)
+            if len(doc_rows) == 0:
+                return []
+            if doc_rows[-1] - doc_rows[0] + 1 == len(doc_rows):
+                selector = faiss.IDSelectorRange(int(doc_rows[0]), int(doc_rows[-1]) + 1)
+            else:
+                selector = faiss.IDSelectorBatch(doc_rows.astype('int64'))
+            scores, indices = index.search(query_array, min(top_k, len(doc_rows)),
+                                           params=faiss.SearchParameters(sel=selector))
+            scores, indices = scores[0], indices[0]
+            rows = np.flatnonzero(indices != -1)
+        else:
+            # Unscoped queries only need to skip past tombstoned rows, widening if rows
+            # the index has but the metadata does not yet know about got in the way
+            search_k = top_k + (int(dead.sum()) if dead is not None else 0)
+            while True:
+                search_k = min(search_k, index.ntotal)
+                scores, indices = index.search(query_array, search_k)
+                scores, indices = scores[0], indices[0]
+
+                keep = (indices != -1) & (indices < rows_known)
+                if dead is not None:
+                    keep[keep] &= ~dead[indices[keep]]
+                rows = np.flatnonzero(keep)[:top_k]
+                if len(rows) == top_k or search_k >= index.ntotal:
+                    break
+                search_k *= 4
+
+        return [{
+            'id': chunks.vector_id(indices[r]),
+            'score': float(scores[r]),
+            'metadata': chunks.record(indices[r])
+        } for r in rows]
+    
+    def doc_ids(self) -> List[str]:
+        """Return the ids of all documents with vectors in the index."""
+        return self.chunks.doc_ids()
+    
+    def export_documents(self, doc_ids: List[str]) -> Tuple[np.ndarray, ChunkStore]:
+        """
+        Copy the vectors and metadata of the given documents out of the index.
+        
+        Returns:
+            Tuple of (normalized vectors, ChunkStore with the matching rows)
+        """
+        with self._swap_lock:
+            index, chunks = self.index, self.chunks
+        with self._rows.read():
+            rows = chunks.rows_for_docs(doc_ids)
+            vectors = np.empty((len(rows), self.dim), dtype='float32')
+            for i, row in enumerate(rows):
+                vectors[i] = index.reconstruct(int(row))
+            return vectors, chunks.take(rows)
+    
+    def import_documents(self, vectors: np.ndarray, chunks: ChunkStore) -> List[str]:
+        """Add vectors and metadata previously produced by export_documents()."""
+        if len(vectors) != len(chunks):
+            raise ValueError("Number of vectors must match number of chunks")
+        if len(vectors) == 0:
+            return []
+        with self._write_lock:
+            with self._rows.write():
+                self.index.add(np.ascontiguousarray(vectors, dtype='float32'))
+                vector_ids = self.chunks.extend(chunks)
+            self._save_index()
+        logger.info(f"Imported {len(vectors)} vectors to FAISS index")
+        return vector_ids
+    
+    def remove_documents(self, doc_ids: List[str]) -> int:
+        """
+        Remove all vectors of the given documents by rebuilding the index without them.
+        
+        Returns:
+            Number of vectors removed
+        """
+        with self._write_lock:
+            removed = self.chunks.rows_for_docs(doc_ids)
+            if len(removed) == 0:
+                return 0
+            keep = np.setdiff1d(np.arange(self.index.ntotal), removed)
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)[keep]
+            index = faiss.IndexFlatIP(self.dim)
+            index.add(vectors)
+            chunks = self.chunks.take(keep)
+            with self._swap_lock:
+                self.index, self.chunks = index, chunks
+            self._save_index()
+        logger.info(f"Removed {len(removed)} vectors for {len(doc_ids)} documents from FAISS index")
+        return len(removed)
+    
+    def delete_documents(self, doc_ids: List[str]) -> int:
+        """
+        Tombstone all vectors of the given documents.
         
-        results = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx != -1 and idx < len(self.metadata):
-                results.append({
-                    'id': self.vector_ids[idx],
-                    'score': float(score),
-                    'metadata': self.metadata[idx]
-                })
+        The vectors stop appearing in query results immediately; the space is only
+        reclaimed by compact().
         
-        return results
+        Returns:
+            Number of vectors tombstoned
+        """
+        with self._write_lock:
+            with self._rows.write():
+                count = self.chunks.tombstone(doc_ids)
+            if count:
+                self.chunks.save(self.chunks_path)
+        if count:
+            logger.info(f"Tombstoned {count} vectors for {len(doc_ids)} documents")
+        return count
+    
+    def _disk_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in (f"{self.index_path}.index", self.chunks_path) if os.path.exists(p))
+    
+    def compact(self) -> Dict:
+        """
+        Rebuild the index and metadata without tombstoned rows.
+        
+        The live rows are copied under the write lock, the new index is built outside it,
+        then rows written in the meantime are carried over and the new index swapped in.
+        Queries keep using the old index until the swap.
+        
+        Returns:
+            Dict with removed_vectors, reclaimed_bytes (memory), reclaimed_disk_bytes and duration_seconds
+        """
+        start = time.perf_counter()
+        with self._write_lock:
+            dead = self.chunks.dead_mask()
+            if dead is None or not dead.any():
+                return {'removed_vectors': 0, 'reclaimed_bytes': 0, 'reclaimed_disk_bytes': 0,
+                        'duration_seconds': time.perf_counter() - start}
+            old_index, old_chunks = self.index, self.chunks
+            snapshot = len(dead)
+            keep = np.flatnonzero(~dead)
+            vectors = old_index.reconstruct_n(0, snapshot)[keep]
+            chunks = old_chunks.take(keep)
+            bytes_before = old_index.ntotal * self.dim * 4 + old_chunks.memory_bytes()
+            disk_before = self._disk_bytes()
+        
+        # The expensive part runs without blocking writers or queries
+        index = faiss.IndexFlatIP(self.dim)
+        index.add(vectors)
+        del vectors
+        
+        with self._write_lock:
+            # Carry over rows added and documents deleted since the snapshot. Kept rows that
+            # died meanwhile are tombstoned first, so a document re-ingested since then gets
+            # its new rows under a fresh ordinal instead of reviving the old ones
+            dead_now = self.chunks.dead_mask()
+            if dead_now is not None:
+                died = np.unique(old_chunks.doc_ordinals[keep[dead_now[keep]]]).tolist()
+                chunks.tombstone([old_chunks.doc_table[o] for o in died])
+            total = self.index.ntotal
+            if total > snapshot:
+                index.add(self.index.reconstruct_n(snapshot, total - snapshot))
+                chunks.extend(self.chunks.take(np.arange(snapshot, total)))
+            chunks.tombstone(self.chunks.tombstoned)
+            with self._swap_lock:
+                self.index, self.chunks = index, chunks
+            self._save_index()
+            bytes_after = index.ntotal * self.dim * 4 + chunks.memory_bytes()
+            disk_after = self._disk_bytes()
+        
+        result = {
+            'removed_vectors': int(len(dead) - len(keep)),
+            'reclaimed_bytes': int(bytes_before - bytes_after),
+            'reclaimed_disk_bytes': int(disk_before - disk_after),
+            'duration_seconds': time.perf_counter() - start
+        }
+        logger.info(f"Compacted FAISS index: removed {result['removed_vectors']} vectors, reclaimed "
+                    f"{result['reclaimed_bytes']} bytes in {result['duration_seconds']:.3f}s")
+        return result
+    
+    def restore_snapshot(self, path: str, doc_ids: Optional[List[str]] = None, verify: bool = True) -> Dict:
+        """
+        Replace the index contents with a snapshot written by the bulk indexer.
+        
+        The snapshot is verified and loaded without holding any lock; the swap itself waits
+        for in-flight writes and is atomic for queries, which see either the old or the new
+        index. Documents written since the snapshot was built are not carried over.
+        
+        Args:
+            path: Snapshot version directory, or a snapshot directory with a LATEST file
+            doc_ids: Only restore these documents (used by index shards)
+            verify: Check checksums and compatibility first (skipped by shards; the parent did it)
+            
+        Returns:
+            The snapshot manifest
+        """
+        index, chunks, manifest = load_snapshot(path, self.dim, doc_ids, verify)
+        
+        with self._write_lock:
+            with self._swap_lock:
+                self.index, self.chunks = index, chunks
+            self._save_index()
+        logger.info(f"Restored FAISS index snapshot {manifest['version']} with {index.ntotal} vectors")
+        return manifest
     
     def get_stats(self) -> Dict:
         """Get statistics about the FAISS index."""
+        with self._swap_lock:
+            index, chunks = self.index, self.chunks
         return {
-            'total_vectors': self.index.ntotal,
+            'total_vectors': index.ntotal,
             'dimension': self.dim,
-            'metadata_count': len(self.metadata)
+            'metadata_count': len(chunks),
+            'metadata_bytes': chunks.memory_bytes(),
+            'tombstoned_vectors': chunks.dead_count()
         }
     
     def clear(self):
         """Clear the FAISS index and metadata."""
-        self.index = faiss.IndexFlatIP(self.dim)
-        self.metadata = []
-        self.vector_ids = []
+        with self._write_lock, self._swap_lock:
+            self.index = faiss.IndexFlatIP(self.dim)
+            self.chunks = ChunkStore()
         
         # Remove saved files
-        for path in [f"{self.index_path}.index", self.metadata_path]:
+        for path in [f"{self.index_path}.index", self.chunks_path, self.metadata_path]:
             if os.path.exists(path):
                 os.remove(path)
         
         logger.info("Cleared FAISS index and metadata")
+    
+    def close(self):
+        """Release resources. Nothing to do for an in-process index."""
 
-# Global FAISS index instance
-faiss_index = FaissIndex() 
\ No newline at end of file
+def create_index():
+    """Create the configured index: sharded across processes when FAISS_SHARDS > 1."""
+    if FAISS_SHARDS > 1:
+        from app.services.faiss_shards import ShardedFaissIndex
+        return ShardedFaissIndex()
+    return FaissIndex()
@@ -0,0 +1,546 @@
+# Sharded FAISS index served by per-shard worker processes over Unix sockets
+import argparse
+import bisect
+import fcntl
+import hashlib
+import heapq
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Optional, Union
+import logging
+import numpy as np
+from app.core.config import (
+    FAISS_INDEX_PATH, FAISS_DIMENSION, FAISS_SHARDS, FAISS_SHARD_SOCKET_DIR,
+    FAISS_SHARD_SPAWN, FAISS_SHARD_CONNECTIONS, require_shard_authkey
+)
+from app.services.chunk_store import DEFAULT_CHUNK_TYPE
+from app.services.faiss_client import FaissIndex
+from app.services.index_snapshot import verify_snapshot
+
+logger = logging.getLogger(__name__)
+
+SHARD_START_TIMEOUT = 60.0
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping doc ids to shards.
+
+    Each shard owns many virtual points on the ring, so changing the shard count
+    only moves roughly 1/N of the documents.
+    """
+
+    def __init__(self, num_shards: int, vnodes: int = 128):
+        self.num_shards = num_shards
+        points = sorted(
+            (self._hash(f"shard-{shard}-{v}"), shard)
+            for shard in range(num_shards) for v in range(vnodes)
+        )
+        self._keys = [p[0] for p in points]
+        self._shards = [p[1] for p in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def shard_for(self, doc_id: str) -> int:
+        pos = bisect.bisect(self._keys, self._hash(doc_id)) % len(self._keys)
+        return self._shards[pos]
+
+
+def shard_socket_path(shard: int, socket_dir: str = None) -> str:
+    return os.path.join(socket_dir or FAISS_SHARD_SOCKET_DIR, f"shard{shard}.sock")
+
+
+def shard_index_path(shard: int, index_path: str = None) -> str:
+    return f"{index_path or FAISS_INDEX_PATH}_shard{shard}"
+
+
+# ---------------------------------------------------------------------------
+# Shard server (runs inside each shard process)
+# ---------------------------------------------------------------------------
+
+def serve_shard(shard: int, socket_path: str, dim: int = None, index_path: str = None):
+    """
+    Serve one shard's FaissIndex over a Unix socket until a 'shutdown' request arrives.
+
+    Each client connection is handled on its own thread; FAISS releases the GIL while
+    searching, so concurrent queries to one shard run in parallel.
+    """
+    index = FaissIndex(dim=dim, index_path=shard_index_path(shard, index_path))
+    write_lock = threading.Lock()
+    stop = threading.Event()
+
+    def handle(op: str, args: Dict):
+        if op == "query":
+            return index.query(args["vector"], top_k=args["top_k"], doc_id=args.get("doc_id"))
+        if op == "ping":
+            return "pong"
+        if op == "stats":
+            return index.get_stats()
+        if op == "doc_ids":
+            return index.doc_ids()
+        if op == "compact":
+            # FaissIndex.compact() locks only around its snapshot and swap
+            return index.compact()
+        with write_lock:
+            if op == "upsert_document":
+                return index.upsert_document(args["vectors"], args["chunks"], args["doc_id"], args["chunk_type"])
+            if op == "upsert":
+                return index.upsert(args["vectors"], args["metadata"], args.get("vector_ids"))
+            if op == "export_documents":
+                return index.export_documents(args["doc_ids"])
+            if op == "import_documents":
+                return index.import_documents(args["vectors"], args["chunks"])
+            if op == "remove_documents":
+                return index.remove_documents(args["doc_ids"])
+            if op == "delete_documents":
+                return index.delete_documents(args["doc_ids"])
+            if op == "restore_snapshot":
+                # Only the manifest goes back; the document list can be large
+                manifest = index.restore_snapshot(args["path"], args["doc_ids"], verify=False)
+                return {k: v for k, v in manifest.items() if k != 'documents'}
+            if op == "clear":
+                return index.clear()
+        raise ValueError(f"Unknown shard operation: {op}")
+
+    def serve_connection(conn):
+        with conn:
+            while not stop.is_set():
+                try:
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if op == "shutdown":
+                    stop.set()
+                    conn.send((True, None))
+                    # Unblock accept() so the main loop can exit
+                    try:
+                        Client(socket_path, family="AF_UNIX", authkey=require_shard_authkey()).close()
+                    except OSError:
+                        pass
+                    return
+                try:
+                    conn.send((True, handle(op, args)))
+                except Exception as e:
+                    logger.error(f"Shard {shard} {op} failed: {e}")
+                    conn.send((False, str(e)))
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    with Listener(socket_path, family="AF_UNIX", authkey=require_shard_authkey()) as listener:
+        logger.info(f"Shard {shard} serving {index.index.ntotal} vectors on {socket_path}")
+        while not stop.is_set():
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                logger.warning(f"Shard {shard} rejected connection: {e}")
+                continue
+            threading.Thread(target=serve_connection, args=(conn,), daemon=True).start()
+    logger.info(f"Shard {shard} stopped")
+
+
+# ---------------------------------------------------------------------------
+# Client side
+# ---------------------------------------------------------------------------
+
+class ShardClient:
+    """Pool of connections to a single shard server."""
+
+    def __init__(self, shard: int, socket_path: str, connections: int):
+        self.shard = shard
+        self.socket_path = socket_path
+        self._pool: "queue.Queue" = queue.Queue()
+        for _ in range(connections):
+            self._pool.put(None)  # Connections are opened lazily
+
+    def _connect(self):
+        return Client(self.socket_path, family="AF_UNIX", authkey=require_shard_authkey())
+
+    def call(self, op: str, **args):
+        conn = self._pool.get()
+        try:
+            if conn is None:
+                conn = self._connect()
+            conn.send((op, args))
+            ok, result = conn.recv()
+        except (EOFError, OSError) as e:
+            if conn is not None:
+                conn.close()
+            conn = None
+            raise RuntimeError(f"Shard {self.shard} connection failed: {e}")
+        finally:
+            self._pool.put(conn)
+        if not ok:
+            raise RuntimeError(f"Shard {self.shard} {op} failed: {result}")
+        return result
+
+    def wait_ready(self, timeout: float = SHARD_START_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.call("ping")
+                return
+            except RuntimeError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Shard {self.shard} did not become ready at {self.socket_path}")
+                time.sleep(0.1)
+
+    def close(self):
+        while not self._pool.empty():
+            conn = self._pool.get_nowait()
+            if conn is not None:
+                conn.close()
+
+
+class ShardedFaissIndex:
+    """
+    Drop-in replacement for FaissIndex that hash-partitions documents across shard processes.
+
+    Writes and document-scoped queries go to the owning shard only; unscoped queries fan
+    out to every shard in parallel and the per-shard top-k lists are merged by score.
+
+    With spawn enabled, only the first process to take the `<index_path>_shards.lock` file
+    lock starts shard servers; any other process (e.g. further uvicorn workers) connects to
+    those instead of starting a second set on the same sockets and index files.
+
+    The shard count lives in `<index_path>_shards.json`. Every process re-reads it when the
+    file changes, so a rebalance done by the owner, another worker or the `rebalance` CLI is
+    followed everywhere. Writes hold a shared `<index_path>_shards.layout.lock` and a
+    rebalance holds it exclusively, so no process writes to a shard mid-move.
+    """
+
+    def __init__(self, num_shards: int = None, dim: int = None, index_path: str = None,
+                 socket_dir: str = None, spawn: bool = None):
+        self.dim = dim or FAISS_DIMENSION
+        self.index_path = index_path or FAISS_INDEX_PATH
+        self.socket_dir = socket_dir or FAISS_SHARD_SOCKET_DIR
+        self.spawn = FAISS_SHARD_SPAWN if spawn is None else spawn
+        self.layout_path = f"{self.index_path}_shards.json"
+        self.layout_lock_path = f"{self.index_path}_shards.layout.lock"
+        self._layout_key = None
+        target = num_shards or FAISS_SHARDS
+        self._spawn_lock = None
+        if self.spawn:
+            self.spawn = self._acquire_spawn_lock()
+
+        self._clients: Dict[int, ShardClient] = {}
+        self._processes: Dict[int, subprocess.Popen] = {}
+        self._write_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(target, 4), thread_name_prefix="shard-query")
+
+        # Start with the layout the data was written under. Only the process that owns the
+        # shard servers moves data to a new shard count; connecting clients follow the layout.
+        current = self._load_layout() or target
+        for shard in range(max(current, target) if self.spawn else current):
+            self._start_shard(shard)
+        self.ring = HashRing(current)
+        if self.spawn:
+            if current != target:
+                self.rebalance(target)
+            else:
+                self._save_layout()
+
+    def _acquire_spawn_lock(self) -> bool:
+        """Take the shard owner lock, held until close(). False if another process owns the shards."""
+        lock_file = open(f"{self.index_path}_shards.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            logger.info("FAISS shards are owned by another process; connecting to them")
+            return False
+        self._spawn_lock = lock_file
+        return True
+
+    def _load_layout(self) -> Optional[int]:
+        if os.path.exists(self.layout_path):
+            with open(self.layout_path) as f:
+                return json.load(f).get("num_shards")
+        return None
+
+    def _save_layout(self):
+        tmp_path = f"{self.layout_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"num_shards": self.ring.num_shards}, f)
+        os.replace(tmp_path, self.layout_path)
+        stat = os.stat(self.layout_path)
+        self._layout_key = (stat.st_ino, stat.st_mtime_ns)
+
+    def _refresh_layout(self):
+        """Switch to the layout on disk if another process has rebalanced since it was last read."""
+        try:
+            stat = os.stat(self.layout_path)
+        except FileNotFoundError:
+            return
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if key == self._layout_key:
+            return
+        with self._refresh_lock:
+            if key == self._layout_key:
+                return
+            num_shards = self._load_layout()
+            if num_shards and num_shards != self.ring.num_shards:
+                # Whoever rebalanced started the new shard servers
+                for shard in range(num_shards):
+                    if shard not in self._clients:
+                        self._start_shard(shard, spawn=False)
+                self.ring = HashRing(num_shards)
+                for shard in [s for s in self._clients if s >= num_shards]:
+                    self._stop_shard(shard)
+                logger.info(f"Following FAISS shard layout change to {num_shards} shards")
+            self._layout_key = key
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False):
+        """Hold the write lock of this process and the cross-process layout lock, on the current layout."""
+        with self._write_lock, open(self.layout_lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._refresh_layout()
+            yield
+
+    def _start_shard(self, shard: int, spawn: bool = None):
+        socket_path = shard_socket_path(shard, self.socket_dir)
+        if self.spawn if spawn is None else spawn:
+            env = dict(os.environ, FAISS_SHARDS="0")  # Shard processes hold a plain FaissIndex
+            self._processes[shard] = subprocess.Popen([
+                sys.executable, "-m", "app.services.faiss_shards", "serve",
+                "--shard", str(shard), "--socket", socket_path,
+                "--dim", str(self.dim), "--index-path", self.index_path
+            ], env=env)
+        client = ShardClient(shard, socket_path, FAISS_SHARD_CONNECTIONS)
+        client.wait_ready()
+        self._clients[shard] = client
+        logger.info(f"Connected to FAISS shard {shard} at {socket_path}")
+
+    def _stop_shard(self, shard: int):
+        client = self._clients.pop(shard)
+        process = self._processes.pop(shard, None)
+        if process is not None:
+            try:
+                client.call("shutdown")
+            except RuntimeError:
+                pass
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        client.close()
+
+    def _owner(self, doc_id: str) -> ShardClient:
+        self._refresh_layout()
+        return self._clients[self.ring.shard_for(doc_id)]
+
+    def upsert(self, vectors: List[List[float]], metadata: List[Dict], vector_ids: Optional[List[str]] = None):
+        """Upsert vectors with metadata dicts, routing each vector to its document's shard."""
+        if len(vectors) != len(metadata):
+            raise ValueError("Number of vectors must match number of metadata items")
+        result = [None] * len(vectors)
+        with self._locked():
+            groups: Dict[int, List[int]] = {}
+            for i, item in enumerate(metadata):
+                groups.setdefault(self.ring.shard_for(str(item.get('doc_id', ''))), []).append(i)
+            for shard, positions in groups.items():
+                ids = self._clients[shard].call(
+                    "upsert",
+                    vectors=[vectors[i] for i in positions],
+                    metadata=[metadata[i] for i in positions],
+                    vector_ids=[vector_ids[i] for i in positions] if vector_ids is not None else None
+                )
+                for i, vector_id in zip(positions, ids):
+                    result[i] = vector_id
+        return result
+
+    def upsert_document(self, vectors: List[List[float]], chunks: List[str], doc_id: str,
+                        chunk_type: Union[str, List[str]] = DEFAULT_CHUNK_TYPE) -> List[str]:
+        """Upsert all chunks of one document to its owning shard."""
+        with self._locked():
+            return self._owner(doc_id).call(
+                "upsert_document", vectors=vectors, chunks=chunks, doc_id=doc_id, chunk_type=chunk_type
+            )
+
+    def query(self, query_vector: List[float], top_k: int = 5, doc_id: Optional[str] = None) -> List[Dict]:
+        """
+        Query the sharded index for similar vectors.
+
+        Args:
+            query_vector: Query embedding vector
+            top_k: Number of top results to return
+            doc_id: Optional document identifier to restrict results to
+
+        Returns:
+            List of dictionaries with 'id', 'score', and 'metadata' keys
+        """
+        vector = np.asarray(query_vector, dtype='float32')
+        if doc_id is not None:
+            return self._owner(doc_id).call("query", vector=vector, top_k=top_k, doc_id=doc_id)
+
+        self._refresh_layout()
+        futures = [
+            self._executor.submit(client.call, "query", vector=vector, top_k=top_k)
+            for client in list(self._clients.values())
+        ]
+        merged, seen = [], set()
+        for result in heapq.merge(*(f.result() for f in futures), key=lambda r: -r['score']):
+            # A document mid-rebalance can briefly exist on two shards
+            if result['id'] in seen:
+                continue
+            seen.add(result['id'])
+            merged.append(result)
+            if len(merged) == top_k:
+                break
+        return merged
+
+    def rebalance(self, num_shards: int):
+        """
+        Move documents so placement matches a ring of `num_shards` shards.
+
+        Documents are copied to their new owner before the ring is switched and only then
+        removed from the old shard, so queries keep finding them throughout. Other processes
+        pick up the new layout on their next call.
+        """
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        with self._locked(exclusive=True):
+            old_ring, new_ring = self.ring, HashRing(num_shards)
+            for shard in range(num_shards):
+                if shard not in self._clients:
+                    self._start_shard(shard)
+
+            moves: Dict[int, List[str]] = {}
+            for shard, client in list(self._clients.items()):
+                moving = [d for d in client.call("doc_ids") if new_ring.shard_for(d) != shard]
+                if not moving:
+                    continue
+                moves[shard] = moving
+                vectors, chunks = client.call("export_documents", doc_ids=moving)
+                for target in range(num_shards):
+                    selected = [d for d in moving if new_ring.shard_for(d) == target]
+                    if selected:
+                        rows = chunks.rows_for_docs(selected)
+                        self._clients[target].call("import_documents", vectors=vectors[rows], chunks=chunks.take(rows))
+
+            self.ring = new_ring
+            self._save_layout()
+            for shard, moving in moves.items():
+                self._clients[shard].call("remove_documents", doc_ids=moving)
+            for shard in [s for s in self._clients if s >= num_shards]:
+                self._stop_shard(shard)
+
+        moved = sum(len(m) for m in moves.values())
+        logger.info(f"Rebalanced FAISS index from {old_ring.num_shards} to {num_shards} shards, moved {moved} documents")
+        return moved
+
+    def doc_ids(self) -> List[str]:
+        self._refresh_layout()
+        return [d for client in self._clients.values() for d in client.call("doc_ids")]
+
+    def delete_documents(self, doc_ids: List[str]) -> int:
+        """Tombstone the given documents on their owning shards."""
+        with self._locked():
+            by_shard: Dict[int, List[str]] = {}
+            for doc_id in doc_ids:
+                by_shard.setdefault(self.ring.shard_for(doc_id), []).append(doc_id)
+            return sum(self._clients[shard].call("delete_documents", doc_ids=ids) for shard, ids in by_shard.items())
+
+    def compact(self) -> Dict:
+        """Compact every shard in parallel and sum the results."""
+        self._refresh_layout()
+        futures = [self._executor.submit(client.call, "compact") for client in list(self._clients.values())]
+        results = [f.result() for f in futures]
+        return {
+            'removed_vectors': sum(r['removed_vectors'] for r in results),
+            'reclaimed_bytes': sum(r['reclaimed_bytes'] for r in results),
+            'reclaimed_disk_bytes': sum(r['reclaimed_disk_bytes'] for r in results),
+            'duration_seconds': max((r['duration_seconds'] for r in results), default=0.0)
+        }
+
+    def restore_snapshot(self, path: str) -> Dict:
+        """
+        Replace the contents of every shard with its documents from a snapshot.
+
+        The snapshot is verified once here; each shard then loads only its own documents'
+        rows and swaps atomically. Shards switch one after another, so an unscoped query
+        can briefly span both versions.
+        """
+        manifest = verify_snapshot(path, self.dim)
+        with self._locked():
+            by_shard: Dict[int, List[str]] = {shard: [] for shard in self._clients}
+            for document in manifest['documents']:
+                by_shard[self.ring.shard_for(document['document_id'])].append(document['document_id'])
+            for shard, doc_ids in by_shard.items():
+                self._clients[shard].call("restore_snapshot", path=manifest['path'], doc_ids=doc_ids)
+        logger.info(f"Restored FAISS index snapshot {manifest['version']} across {len(by_shard)} shards")
+        return manifest
+
+    def get_stats(self) -> Dict:
+        """Get aggregate and per-shard statistics."""
+        self._refresh_layout()
+        shards = {shard: client.call("stats") for shard, client in self._clients.items()}
+        return {
+            'total_vectors': sum(s['total_vectors'] for s in shards.values()),
+            'dimension': self.dim,
+            'metadata_count': sum(s['metadata_count'] for s in shards.values()),
+            'metadata_bytes': sum(s['metadata_bytes'] for s in shards.values()),
+            'tombstoned_vectors': sum(s['tombstoned_vectors'] for s in shards.values()),
+            'num_shards': self.ring.num_shards,
+            'shards': shards
+        }
+
+    def clear(self):
+        with self._locked():
+            for client in self._clients.values():
+                client.call("clear")
+
+    def close(self):
+        """Disconnect from the shards and stop any spawned shard processes."""
+        for shard in list(self._clients):
+            self._stop_shard(shard)
+        self._executor.shutdown(wait=False)
+        if self._spawn_lock is not None:
+            self._spawn_lock.close()
+            self._spawn_lock = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS shard server")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="Serve a single shard")
+    serve.add_argument("--shard", type=int, required=True)
+    serve.add_argument("--socket", default=None)
+    serve.add_argument("--dim", type=int, default=None)
+    serve.add_argument("--index-path", default=None)
+    serve_all = sub.add_parser("serve-all", help="Serve FAISS_SHARDS shards until interrupted")
+    serve_all.add_argument("--shards", type=int, default=FAISS_SHARDS)
+    rebalance = sub.add_parser("rebalance", help="Rebalance running shard servers to a new shard count")
+    rebalance.add_argument("--shards", type=int, required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == "serve":
+        serve_shard(args.shard, args.socket or shard_socket_path(args.shard), args.dim, args.index_path)
+    elif args.command == "serve-all":
+        index = ShardedFaissIndex(num_shards=args.shards, spawn=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            index.close()
+    elif args.command == "rebalance":
+        # Shard servers for the new count must already be running
+        index = ShardedFaissIndex(spawn=False)
+        index.rebalance(args.shards)
+
+
+if __name__ == "__main__":
+    main()
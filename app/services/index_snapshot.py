@@ -0,0 +1,196 @@
+# Versioned, checksummed FAISS index snapshots for bulk builds and hot-swapping
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+import logging
+import faiss
+import numpy as np
+from app.core.config import EMBEDDING_PROVIDER, EMBEDDING_MODEL
+from app.services.chunk_store import ChunkStore
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+
+# Vectors are a plain .npy array so shards can memory-map it and copy out only their own rows
+VECTORS_FILE = "vectors.npy"
+CHUNKS_FILE = "chunks.npz"
+MANIFEST_FILE = "manifest.json"
+# Names the newest complete snapshot in a snapshot directory
+LATEST_FILE = "LATEST"
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot is missing, incomplete, corrupt or incompatible with this instance."""
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, text: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(vectors: np.ndarray, chunks: ChunkStore, output_dir: str, documents: List[Dict],
+                   extra: Optional[Dict] = None) -> Dict:
+    """
+    Write index vectors and their chunk metadata as a new snapshot version under output_dir.
+
+    The files are written to a hidden staging directory that is renamed into place once
+    complete, and LATEST is only updated after that, so readers never see a partial snapshot.
+
+    Args:
+        vectors: float32 array with one normalized vector per chunk row
+        chunks: Chunk metadata, row-aligned with the index
+        output_dir: Directory holding snapshot versions
+        documents: One {'document_id', 'name', 'source', 'chunks'} entry per indexed document
+        extra: Additional manifest fields (e.g. build statistics)
+
+    Returns:
+        The snapshot manifest, including its 'path'
+    """
+    if len(vectors) != len(chunks):
+        raise SnapshotError(f"Index has {len(vectors)} vectors but metadata has {len(chunks)} rows")
+    version = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+    os.makedirs(output_dir, exist_ok=True)
+    staging = os.path.join(output_dir, f".{version}.tmp")
+    final = os.path.join(output_dir, version)
+    os.makedirs(staging)
+    try:
+        np.save(os.path.join(staging, VECTORS_FILE), np.ascontiguousarray(vectors, dtype=np.float32))
+        chunks.save(os.path.join(staging, CHUNKS_FILE))
+        manifest = {
+            'format': SNAPSHOT_FORMAT,
+            'version': version,
+            'created_at': time.time(),
+            'dimension': vectors.shape[1],
+            'vectors': len(vectors),
+            'embedding_provider': EMBEDDING_PROVIDER,
+            'embedding_model': EMBEDDING_MODEL,
+            'files': {
+                name: {'sha256': _sha256(os.path.join(staging, name)),
+                       'bytes': os.path.getsize(os.path.join(staging, name))}
+                for name in (VECTORS_FILE, CHUNKS_FILE)
+            },
+            **(extra or {}),
+            'documents': documents
+        }
+        _write_atomic(os.path.join(staging, MANIFEST_FILE), json.dumps(manifest, indent=2))
+        os.rename(staging, final)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    _write_atomic(os.path.join(output_dir, LATEST_FILE), version + "\n")
+    logger.info(f"Wrote index snapshot {version} with {manifest['vectors']} vectors to {final}")
+    return {**manifest, 'path': final}
+
+
+def resolve_snapshot(path: str) -> str:
+    """Return the snapshot version directory for a version directory or a directory with LATEST."""
+    if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        return path
+    latest = os.path.join(path, LATEST_FILE)
+    if os.path.exists(latest):
+        with open(latest) as f:
+            version = f.read().strip()
+        resolved = os.path.join(path, version)
+        if os.path.exists(os.path.join(resolved, MANIFEST_FILE)):
+            return resolved
+        raise SnapshotError(f"{latest} names snapshot {version}, which does not exist")
+    raise SnapshotError(f"No index snapshot at {path}")
+
+
+def read_manifest(path: str) -> Dict:
+    """Read the manifest of a snapshot (see resolve_snapshot for accepted paths)."""
+    path = resolve_snapshot(path)
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise SnapshotError(f"Unreadable snapshot manifest in {path}: {e}")
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Snapshot {path} has format {manifest.get('format')}, expected {SNAPSHOT_FORMAT}")
+    missing = sorted({VECTORS_FILE, CHUNKS_FILE} - set(manifest.get('files', {})))
+    if missing:
+        raise SnapshotError(f"Snapshot {path} manifest does not list {', '.join(missing)}")
+    return {**manifest, 'path': path}
+
+
+def verify_snapshot(path: str, dim: int) -> Dict:
+    """
+    Check a snapshot against its checksums and this instance's configuration.
+
+    Checks file checksums, the vector dimension and the embedding provider/model the
+    snapshot was built with.
+
+    Returns:
+        The snapshot manifest
+
+    Raises:
+        SnapshotError: If the snapshot is corrupt or incompatible
+    """
+    manifest = read_manifest(path)
+    path = manifest['path']
+    if manifest['dimension'] != dim:
+        raise SnapshotError(f"Snapshot {manifest['version']} has dimension {manifest['dimension']}, "
+                            f"index expects {dim}")
+    built_with = (manifest.get('embedding_provider'), manifest.get('embedding_model'))
+    if built_with != (EMBEDDING_PROVIDER, EMBEDDING_MODEL):
+        raise SnapshotError(f"Snapshot {manifest['version']} was built with embeddings {built_with}, "
+                            f"this instance uses {(EMBEDDING_PROVIDER, EMBEDDING_MODEL)}")
+    for name, expected in manifest['files'].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or _sha256(file_path) != expected['sha256']:
+            raise SnapshotError(f"Snapshot {manifest['version']} file {name} is missing or fails its checksum")
+    return manifest
+
+
+def load_snapshot(path: str, dim: int, doc_ids: Optional[List[str]] = None,
+                  verify: bool = True) -> Tuple[object, ChunkStore, Dict]:
+    """
+    Load a snapshot, or only some of its documents, into a new FAISS index.
+
+    With doc_ids, the vectors file is memory-mapped and only those documents' rows are
+    copied, so loading a part of a snapshot costs memory for that part alone.
+
+    Args:
+        path: Snapshot version directory, or a snapshot directory with a LATEST file
+        dim: Vector dimension of this instance
+        doc_ids: Only load these documents
+        verify: Run verify_snapshot() first; callers that already did can skip it
+
+    Returns:
+        Tuple of (FAISS index, ChunkStore, manifest)
+
+    Raises:
+        SnapshotError: If the snapshot is corrupt or incompatible
+    """
+    manifest = verify_snapshot(path, dim) if verify else read_manifest(path)
+    path = manifest['path']
+    chunks = ChunkStore.load(os.path.join(path, CHUNKS_FILE))
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode='r')
+    if len(vectors) != len(chunks) or len(vectors) != manifest['vectors']:
+        raise SnapshotError(f"Snapshot {manifest['version']} has {len(vectors)} vectors and {len(chunks)} "
+                            f"metadata rows, manifest says {manifest['vectors']}")
+
+    if doc_ids is not None:
+        rows = chunks.rows_for_docs(doc_ids)
+        vectors, chunks = vectors[rows], chunks.take(rows)
+    index = faiss.IndexFlatIP(dim)
+    if len(vectors):
+        index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    return index, chunks, manifest
@@ -0,0 +1,165 @@
+# Background document ingestion queue
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+import logging
+from app.core.config import INGESTION_WORKERS, INGESTION_QUEUE_SIZE, INGESTION_JOB_HISTORY
+from app.db.database import SessionLocal
+from app.services.pipeline import index_document
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+class IngestionQueueFull(RuntimeError):
+    """Raised when the ingestion queue cannot accept more jobs."""
+
+
+@dataclass
+class IngestionJob:
+    job_id: str
+    document_id: str
+    source: str
+    status: str = JOB_QUEUED
+    chunk_count: Optional[int] = None
+    error: Optional[str] = None
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+class IngestionQueue:
+    """Bounded queue of document ingestion jobs served by a fixed pool of asyncio workers."""
+
+    def __init__(self, workers: int = None, max_size: int = None, history: int = None):
+        self.workers = workers or INGESTION_WORKERS
+        self.max_size = max_size or INGESTION_QUEUE_SIZE
+        self.history = history or INGESTION_JOB_HISTORY
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._busy = 0
+        self._completed = 0
+        self._failed = 0
+
+    async def start(self):
+        """Start the worker pool. Must be called from a running event loop."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info(f"Started ingestion queue with {self.workers} workers (capacity {self.max_size})")
+
+    async def stop(self):
+        """Cancel the worker pool. Queued jobs that have not started are marked failed."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job in self._jobs.values():
+            if job.status == JOB_QUEUED:
+                self._finish(job, error="Ingestion queue shut down")
+        logger.info("Stopped ingestion queue")
+
+    def submit(self, source: str) -> IngestionJob:
+        """
+        Enqueue a document for ingestion.
+
+        Args:
+            source: URL or file path of the document
+
+        Returns:
+            The queued IngestionJob
+        """
+        if self._queue is None:
+            raise RuntimeError("Ingestion queue is not running")
+
+        job = IngestionJob(
+            job_id=str(uuid.uuid4()),
+            document_id=str(uuid.uuid4()),
+            source=source,
+            created_at=time.time()
+        )
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise IngestionQueueFull(f"Ingestion queue is full ({self.max_size} jobs pending)")
+
+        self._jobs[job.job_id] = job
+        self._trim_history()
+        logger.info(f"Queued ingestion job {job.job_id} for document {job.document_id}")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, status: Optional[str] = None) -> List[IngestionJob]:
+        return [job for job in self._jobs.values() if status is None or job.status == status]
+
+    def get_stats(self) -> Dict:
+        """Get queue depth and worker utilisation."""
+        return {
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'queue_capacity': self.max_size,
+            'workers': self.workers,
+            'busy_workers': self._busy,
+            'utilisation': self._busy / self.workers if self.workers else 0.0,
+            'jobs_completed': self._completed,
+            'jobs_failed': self._failed
+        }
+
+    async def _worker(self, worker_num: int):
+        while True:
+            job = await self._queue.get()
+            self._busy += 1
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            db = SessionLocal()
+            try:
+                _, job.chunk_count = await index_document(job.source, job.document_id, db)
+                self._finish(job)
+                logger.info(f"Worker {worker_num} completed ingestion job {job.job_id} "
+                            f"in {job.finished_at - job.started_at:.2f}s")
+            except asyncio.CancelledError:
+                self._finish(job, error="Ingestion cancelled")
+                raise
+            except Exception as e:
+                logger.error(f"Ingestion job {job.job_id} failed: {e}")
+                self._finish(job, error=str(e))
+            finally:
+                db.close()
+                self._busy -= 1
+                self._queue.task_done()
+
+    def _finish(self, job: IngestionJob, error: Optional[str] = None):
+        job.finished_at = time.time()
+        if error is None:
+            job.status = JOB_COMPLETED
+            self._completed += 1
+        else:
+            job.status = JOB_FAILED
+            job.error = error
+            self._failed += 1
+
+    def _trim_history(self):
+        """Drop the oldest finished jobs once the history limit is exceeded."""
+        excess = len(self._jobs) - self.history
+        if excess <= 0:
+            return
+        for job_id in [j.job_id for j in self._jobs.values() if j.status in (JOB_COMPLETED, JOB_FAILED)][:excess]:
+            del self._jobs[job_id]
+
+
+# Global ingestion queue instance
+ingestion_queue = IngestionQueue()
@@ -1,81 +1,253 @@
 # LLM (OpenAI GPT-4) client
-import openai
-import requests
-from app.core.config import OPENAI_API_KEY, LLM_MODEL
+import asyncio
+import threading
+import time
+from collections import deque
+import numpy as np
+from typing import Mapping, Optional, Tuple
+from app.core.config import (
+    LLM_MODEL, LLM_HEDGE_ENABLED, LLM_HEDGE_PERCENTILE, LLM_HEDGE_DEFAULT_DELAY, require_openai_api_key
+)
+from app.services.deadline import current_deadline, timeout_for, DeadlineExceeded
+from app.services.profiling import profile_stage
+from app.services.rate_limiter import (
+    chat_limiter, estimate_tokens, retry_after_from_headers, RateLimitExceeded
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+MAX_TOKENS = 512  # Reduced max tokens for faster responses
+
+EMPTY_RESPONSE = "No response generated from LLM."
+
+class LLMError(RuntimeError):
+    """Raised when the LLM call fails after rate-limit retries (other than by the request deadline)."""
+
+def _chat_completion(prompt: str, model: str) -> Tuple[str, Optional[Mapping], Optional[int]]:
+    """
+    Make one chat completion call.
+
+    Returns:
+        Tuple of (content, response headers, total tokens used)
+
+    Raises:
+        RateLimitExceeded: If the API answered 429
+    """
+    # Imported on first call: the SDK takes longer to import than the rest of the app
+    import openai
+    import requests
+
+    api_key = require_openai_api_key()
+
+    # Try OpenAI client first
+    try:
+        # Retries are handled by the shared rate limiter, not the SDK
+        client = openai.OpenAI(api_key=api_key, max_retries=0)
+
+        raw = client.chat.completions.with_raw_response.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.1,  # Lower temperature for more deterministic responses
+            max_tokens=MAX_TOKENS,
+            timeout=timeout_for(15)  # Set timeout to avoid long waits, capped by the request deadline
+        )
+        response = raw.parse()
+        used = response.usage.total_tokens if response.usage else None
+
+        if response.choices and response.choices[0].message and response.choices[0].message.content:
+            logger.info(f"Successfully generated LLM response using {model}")
+            return response.choices[0].message.content.strip(), raw.headers, used
+        logger.warning("LLM response was empty")
+        return EMPTY_RESPONSE, raw.headers, used
+
+    except openai.RateLimitError as e:
+        headers = e.response.headers if e.response is not None else None
+        raise RateLimitExceeded(str(e), retry_after_from_headers(headers), headers)
+    except Exception as client_error:
+        logger.warning(f"OpenAI client failed, trying direct HTTP: {client_error}")
+
+    # Fallback to direct HTTP request
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+    data = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.1,  # Lower temperature for more deterministic responses
+        "max_tokens": MAX_TOKENS
+    }
+
+    response = requests.post(
+        "https://api.openai.com/v1/chat/completions",
+        headers=headers,
+        json=data,
+        timeout=timeout_for(30)
+    )
+
+    if response.status_code == 429:
+        raise RateLimitExceeded(f"HTTP 429 - {response.text}", retry_after_from_headers(response.headers), response.headers)
+    if response.status_code != 200:
+        logger.error(f"HTTP request failed: {response.status_code} - {response.text}")
+        raise RuntimeError(f"HTTP {response.status_code} - {response.text}")
+
+    result = response.json()
+    used = result.get('usage', {}).get('total_tokens')
+    if result.get('choices') and result['choices'][0].get('message'):
+        content = result['choices'][0]['message']['content']
+        logger.info(f"Successfully generated LLM response using direct HTTP")
+        return content.strip(), response.headers, used
+    logger.warning("LLM response was empty")
+    return EMPTY_RESPONSE, response.headers, used
+
+class LatencyTracker:
+    """Rolling window of successful LLM call latencies used to pick the hedging delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=window)
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self._min_samples:
+                return None
+            return float(np.percentile(self._samples, pct))
+
+
+llm_latency = LatencyTracker()
+hedge_stats = {'calls': 0, 'hedged': 0, 'hedge_wins': 0}
+
+# How often a hedged call checks whether the rate limiter has admitted its primary request
+_ADMISSION_POLL_SECONDS = 0.1
+
+class _InFlight:
+    """When the current attempt of a call was admitted by the rate limiter (None while queued)."""
+
+    def __init__(self):
+        self.started: Optional[float] = None
+
+@profile_stage("llm")
+def _ask_llm(prompt: str, model: str = None, in_flight: Optional[_InFlight] = None) -> str:
+    """
+    Rate-limited LLM call that raises on failure.
+
+    Only the API call itself is timed for the hedging latency window: time spent queued at
+    the rate limiter or backing off from a 429 says nothing about how slow the API is.
+    """
+    model = model or LLM_MODEL
+    estimated = estimate_tokens(prompt) + MAX_TOKENS
+
+    def attempt():
+        start = time.monotonic()
+        if in_flight is not None:
+            in_flight.started = start
+        try:
+            result = _chat_completion(prompt, model)
+        except Exception:
+            if in_flight is not None:
+                in_flight.started = None
+            raise
+        llm_latency.record(time.monotonic() - start)
+        return result
+
+    return chat_limiter.call(estimated, attempt)
+
 def ask_llm(prompt: str, model: str = None) -> str:
     """
     Send a prompt to the LLM and get a response.
-    
+
+    Calls go through the shared chat rate limiter, which queues callers to stay
+    under the RPM/TPM budget and retries 429s with backoff.
+
     Args:
         prompt: The prompt to send to the LLM
         model: The model to use (defaults to LLM_MODEL from config)
-        
+
     Returns:
         The LLM response as a string
+
+    Raises:
+        LLMError: If the call failed
+        DeadlineExceeded: If the request deadline ran out first
     """
     try:
-        model = model or LLM_MODEL
-        
-        # Try OpenAI client first
-        try:
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            
-            response = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1,  # Lower temperature for more deterministic responses
-                max_tokens=512,   # Reduced max tokens for faster responses
-                request_timeout=15  # Set timeout to avoid long waits
-            )
-            
-            if response.choices and response.choices[0].message and response.choices[0].message.content:
-                content = response.choices[0].message.content
-                logger.info(f"Successfully generated LLM response using {model}")
-                return content.strip()
-            else:
-                logger.warning("LLM response was empty")
-                return "No response generated from LLM."
-                
-        except Exception as client_error:
-            logger.warning(f"OpenAI client failed, trying direct HTTP: {client_error}")
-            
-            # Fallback to direct HTTP request
-            headers = {
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": model,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.1,  # Lower temperature for more deterministic responses
-                "max_tokens": 512    # Reduced max tokens for faster responses
-            }
-            
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('choices') and result['choices'][0].get('message'):
-                    content = result['choices'][0]['message']['content']
-                    logger.info(f"Successfully generated LLM response using direct HTTP")
-                    return content.strip()
-                else:
-                    logger.warning("LLM response was empty")
-                    return "No response generated from LLM."
-            else:
-                logger.error(f"HTTP request failed: {response.status_code} - {response.text}")
-                return f"Error: HTTP {response.status_code} - {response.text}"
-            
+        return _ask_llm(prompt, model)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"LLM request failed: {e}")
+        raise LLMError(f"Error generating response: {e}") from e
+
+@profile_stage("llm")
+async def ask_llm_hedged(prompt: str, model: str = None) -> str:
+    """
+    Async variant of ask_llm that hedges slow calls.
+
+    If the first call has not finished within the observed p95 latency (LLM_HEDGE_PERCENTILE)
+    of being admitted by the rate limiter, an identical second call is sent and whichever
+    succeeds first is returned. A call still queued at the limiter is never hedged, so being
+    rate limited does not double the load. The losing call is left to finish in its worker
+    thread; its result is discarded.
+
+    Args:
+        prompt: The prompt to send to the LLM
+        model: The model to use (defaults to LLM_MODEL from config)
+
+    Returns:
+        The LLM response as a string
+
+    Raises:
+        LLMError: If every call failed
+        DeadlineExceeded: If the request deadline ran out first
+    """
+    hedge_stats['calls'] += 1
+    in_flight = _InFlight()
+    primary = asyncio.ensure_future(chat_limiter.run_async(_ask_llm, prompt, model, in_flight))
+    calls = [primary]
+    try:
+        if LLM_HEDGE_ENABLED:
+            delay = llm_latency.percentile(LLM_HEDGE_PERCENTILE) or LLM_HEDGE_DEFAULT_DELAY
+            deadline = current_deadline()
+            while not primary.done():
+                started = in_flight.started
+                if started is None:
+                    # Queued at the rate limiter or backing off from a 429
+                    await asyncio.wait(calls, timeout=_ADMISSION_POLL_SECONDS)
+                    continue
+                remaining = started + delay - time.monotonic()
+                if deadline is not None and deadline.remaining() <= remaining:
+                    break
+                if remaining > 0:
+                    await asyncio.wait(calls, timeout=remaining)
+                    continue
+                logger.info(f"LLM call exceeded {delay:.2f}s, sending hedged request")
+                hedge_stats['hedged'] += 1
+                calls.append(asyncio.ensure_future(chat_limiter.run_async(_ask_llm, prompt, model)))
+                break
+
+        error = None
+        for next_done in asyncio.as_completed(calls):
+            try:
+                result = await next_done
+            except Exception as e:
+                error = e
+                continue
+            if len(calls) > 1 and not primary.done():
+                hedge_stats['hedge_wins'] += 1
+            return result
+        raise error
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"LLM request failed: {e}")
-        return f"Error generating response: {str(e)}"
+        raise LLMError(f"Error generating response: {e}") from e
+    finally:
+        for call in calls:
+            call.cancel()
@@ -1,5 +1,4 @@
 # PDF parsing utility
-import pdfplumber
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,6 +13,8 @@ def extract_text_from_pdf(file_path: str) -> str:
     Returns:
         Extracted text as a single string
     """
+    import pdfplumber  # Deferred so importing the app does not load pdfminer
+
     try:
         text_parts = []
         with pdfplumber.open(file_path) as pdf:
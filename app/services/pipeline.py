@@ -1,12 +1,21 @@
 from app.models.request import HackrxRequest
 from app.models.response import HackrxResponse, AnswerItem
-from app.services.document_ingestion import ingest_document
-from app.services.embedding_pipeline import upsert_chunks_to_faiss, query_faiss
-from app.services.llm_client import ask_llm
-from app.services.scoring import calculate_score
+from app.services.document_ingestion import ingest_document_parts
+from app.services.embedding_pipeline import upsert_chunks_to_faiss, query_faiss, query_faiss_batch, get_faiss_index
+from app.services.llm_client import ask_llm_hedged, LLMError
+from app.services.deadline import Deadline, DeadlineExceeded, deadline_scope
+from app.core.config import (
+    REQUEST_DEADLINE_SECONDS, DEADLINE_INGESTION_FRACTION, DEADLINE_RESPONSE_MARGIN,
+    RETRIEVAL_TOP_K, RETRIEVAL_CONTEXT_CHUNKS, RETRIEVAL_CONFIDENCE_THRESHOLD
+)
+from app.services.scoring import retrieval_confidence
+from app.services.document_lifecycle import document_lifecycle
+from app.services.profiling import profile_stage, request_profiler
 
 from app.db.database import SessionLocal, Document, Question, Answer
 
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 import uuid
 import os
 import logging
@@ -16,86 +25,163 @@ logging.basicConfig(level=logging.INFO)
 
 import asyncio
 
-async def process_query_pipeline(request: HackrxRequest) -> HackrxResponse:
+DEADLINE_ANSWER = "Unable to answer within the request deadline."
+LLM_ERROR_ANSWER = "Unable to answer: the language model request failed."
+NOT_FOUND_ANSWER = "The answer was not found in the document."
+
+class DocumentNotIndexedError(LookupError):
+    """Raised when a request references a document id that has not been indexed."""
+
+
+@profile_stage("ingest")
+async def index_document(source: str, doc_id: str, db) -> Tuple[Document, int]:
     """
-    Main pipeline for processing document upload and answering questions.
-    Optimized with parallel processing for faster response times.
+    Download, parse and index a document, then record it in the database.
     
     Args:
-        request: HackrxRequest containing documents and questions
+        source: URL or file path of the document
+        doc_id: Identifier the chunks are indexed under
+        db: Database session
         
     Returns:
-        HackrxResponse with answers for all questions
+        Tuple of (Document row, number of indexed chunks)
     """
+    # 1. Ingest document (download/parse) off the event loop
     try:
-        # 1. Ingest document (download/parse)
-        doc_id = str(uuid.uuid4())
-        try:
-            chunks, file_path = ingest_document(request.documents, is_url=request.documents.startswith("http"))
-            logger.info(f"Successfully ingested document with {len(chunks)} chunks")
-        except Exception as e:
-            logger.error(f"Document ingestion failed: {e}")
-            raise RuntimeError(f"Document ingestion failed: {e}")
-
-        # 2. Upsert chunks to FAISS
-        try:
-            await upsert_chunks_to_faiss(chunks, doc_id)
-            logger.info(f"Successfully upserted chunks to FAISS for document {doc_id}")
-        except Exception as e:
-            logger.error(f"FAISS upsert failed: {e}")
-            raise RuntimeError(f"FAISS upsert failed: {e}")
+        chunks, chunk_types, file_path = await asyncio.to_thread(
+            ingest_document_parts, source, source.startswith("http")
+        )
+        logger.info(f"Successfully ingested document with {len(chunks)} chunks")
+    except Exception as e:
+        logger.error(f"Document ingestion failed: {e}")
+        raise RuntimeError(f"Document ingestion failed: {e}")
 
-        # 3. Save document to DB
-        db = SessionLocal()
+    # Held through the upsert and the row insert so a snapshot restore can't drop one but not the other
+    async with document_lifecycle.indexing():
         try:
-            doc_obj = Document(name=file_path.split(os.sep)[-1], source_url=request.documents)
-            db.add(doc_obj)
-            db.commit()
-            db.refresh(doc_obj)
-            logger.info(f"Saved document to database with ID: {doc_obj.id}")
-        except Exception as e:
-            logger.error(f"DB save document failed: {e}")
-            db.rollback()
-            raise RuntimeError(f"DB save document failed: {e}")
+            # 2. Upsert chunks to FAISS
+            try:
+                await upsert_chunks_to_faiss(chunks, doc_id, chunk_types)
+                logger.info(f"Successfully upserted chunks to FAISS for document {doc_id}")
+            except Exception as e:
+                logger.error(f"FAISS upsert failed: {e}")
+                raise RuntimeError(f"FAISS upsert failed: {e}")
 
-        # Define async function to process a single question
-        async def process_question(i, question):
+            # 3. Save document to DB
             try:
-                # 4. Save question to DB
-                q_obj = Question(document_id=doc_obj.id, question_text=question)
-                db.add(q_obj)
+                doc_obj = Document(doc_uid=doc_id, name=file_path.split(os.sep)[-1], source_url=source)
+                db.add(doc_obj)
                 db.commit()
-                db.refresh(q_obj)
-                logger.info(f"Saved question {i+1}/{len(request.questions)} to database")
+                db.refresh(doc_obj)
+                logger.info(f"Saved document to database with ID: {doc_obj.id}")
             except Exception as e:
-                logger.error(f"DB save question failed: {e}")
+                logger.error(f"DB save document failed: {e}")
                 db.rollback()
-                return {
-                    "answer": f"Database error: {str(e)}",
-                    "question": question,
-                    "score": 0.0
-                }
+                raise RuntimeError(f"DB save document failed: {e}")
+        except BaseException:
+            # Without a DB row nothing would ever reference (or delete) vectors already written
+            get_faiss_index().delete_documents([doc_id])
+            raise
 
-            # 5. Query FAISS for relevant chunks (reduced to 2 for faster processing)
-            try:
-                matches = await query_faiss(question, top_k=2)
-                if matches:
-                    # Only use the most relevant chunks to reduce context size
-                    context = "\n".join([m.get("metadata", {}).get("text", "") for m in matches])
-                    clause_ref = matches[0].get("id") if matches else None
-                    logger.info(f"Found {len(matches)} relevant chunks for question {i+1}")
-                else:
-                    context = ""
-                    clause_ref = None
-                    logger.warning(f"No relevant chunks found for question {i+1}")
-            except Exception as e:
-                logger.error(f"FAISS query failed: {e}")
-                context = ""
-                clause_ref = None
+    return doc_obj, len(chunks)
+
+
+def get_indexed_document(db, doc_id: str) -> Optional[Document]:
+    """Look up a previously indexed document by its FAISS doc_id."""
+    return db.query(Document).filter(Document.doc_uid == doc_id).first()
 
-            # 6. Use LLM to answer with rationale
-            try:
-                prompt = f"""Answer this question concisely based on the context provided.
+
+async def retrieve_for_questions(questions: List[str], doc_id: str) -> Tuple[List[Optional[List[Dict]]], List[Optional[float]]]:
+    """
+    Retrieve matches for all questions of a request and score how confident retrieval is for each.
+    
+    Args:
+        questions: Question texts
+        doc_id: FAISS doc_id of the document's chunks
+        
+    Returns:
+        Tuple of (matches per question, confidence per question); both are None per question
+        if retrieval failed, so each question falls back to querying on its own
+    """
+    try:
+        matches = await query_faiss_batch(questions, top_k=RETRIEVAL_TOP_K, doc_id=doc_id)
+    except Exception as e:
+        logger.error(f"Batch FAISS query failed: {e}")
+        return [None] * len(questions), [None] * len(questions)
+    confidences = retrieval_confidence([[m["score"] for m in found] for found in matches])
+    return matches, [float(c) for c in confidences]
+
+
+@profile_stage("answer")
+async def answer_question(question: str, doc_obj: Document, doc_id: str, db, label: str = "",
+                          matches: Optional[List[Dict]] = None, confidence: Optional[float] = None) -> Dict:
+    """
+    Answer one question against an indexed document and record the question and answer in the database.
+    
+    Questions whose retrieval confidence is below RETRIEVAL_CONFIDENCE_THRESHOLD are answered
+    NOT_FOUND_ANSWER without calling the LLM. The confidence is returned and stored as the score.
+    
+    Args:
+        question: Question text
+        doc_obj: Document row the question belongs to
+        doc_id: FAISS doc_id of the document's chunks
+        db: Database session
+        label: Identifies the question in log messages
+        matches: Matches already retrieved for the question (queried here if None)
+        confidence: Retrieval confidence of `matches`
+        
+    Returns:
+        Dict with 'answer', 'question' and 'score' keys, plus 'error' if the question could
+        not be saved (the answer then only describes the failure)
+
+    Raises:
+        LLMError: If the LLM call failed; no answer is recorded
+    """
+    try:
+        # 4. Save question to DB
+        q_obj = Question(document_id=doc_obj.id, question_text=question)
+        db.add(q_obj)
+        db.commit()
+        db.refresh(q_obj)
+        logger.info(f"Saved question {label} to database")
+    except Exception as e:
+        logger.error(f"DB save question failed: {e}")
+        db.rollback()
+        return {
+            "answer": f"Database error: {str(e)}",
+            "question": question,
+            "score": 0.0,
+            "error": str(e)
+        }
+
+    # 5. Query FAISS for relevant chunks, unless they were retrieved for the whole request
+    try:
+        if matches is None:
+            matches = await query_faiss(question, top_k=RETRIEVAL_TOP_K, doc_id=doc_id)
+            confidence = float(retrieval_confidence([[m["score"] for m in matches]])[0])
+        if matches:
+            # Only use the most relevant chunks to reduce context size
+            context = "\n".join([m.get("metadata", {}).get("text", "") for m in matches[:RETRIEVAL_CONTEXT_CHUNKS]])
+            clause_ref = matches[0].get("id") if matches else None
+            logger.info(f"Found {len(matches)} relevant chunks for question {label} (confidence {confidence:.3f})")
+        else:
+            context = ""
+            clause_ref = None
+            logger.warning(f"No relevant chunks found for question {label}")
+    except Exception as e:
+        logger.error(f"FAISS query failed: {e}")
+        context = ""
+        clause_ref = None
+        confidence = None
+
+    # 6. Use LLM to answer with rationale, unless retrieval found nothing worth asking about
+    if confidence is not None and confidence < RETRIEVAL_CONFIDENCE_THRESHOLD:
+        answer = NOT_FOUND_ANSWER
+        rationale = f"Retrieval confidence {confidence:.3f} is below the threshold {RETRIEVAL_CONFIDENCE_THRESHOLD}"
+        logger.info(f"Skipped LLM for question {label}: retrieval confidence {confidence:.3f}")
+    else:
+        try:
+            prompt = f"""Answer this question concisely based on the context provided.
 
 Context: {context}
 
@@ -104,63 +190,143 @@ Question: {question}
 Provide a direct answer followed by brief reasoning. Be concise.
 
 Answer:"""
-                
-                llm_response = ask_llm(prompt)
-                
-                # Extract answer and rationale from LLM response
-                if "Answer:" in llm_response:
-                    parts = llm_response.split("Answer:", 1)
-                    rationale = parts[0].strip() if len(parts) > 1 else ""
-                    answer = parts[1].strip() if len(parts) > 1 else llm_response.strip()
-                else:
-                    answer = llm_response.strip()
-                    rationale = ""
-                
-                logger.info(f"Generated answer for question {i+1}")
-                
-            except Exception as e:
-                logger.error(f"LLM call failed: {e}")
-                answer = f"Unable to generate answer due to error: {str(e)}"
+        
+            llm_response = await ask_llm_hedged(prompt)
+        
+            # Extract answer and rationale from LLM response
+            if "Answer:" in llm_response:
+                parts = llm_response.split("Answer:", 1)
+                rationale = parts[0].strip() if len(parts) > 1 else ""
+                answer = parts[1].strip() if len(parts) > 1 else llm_response.strip()
+            else:
+                answer = llm_response.strip()
                 rationale = ""
+        
+            logger.info(f"Generated answer for question {label}")
+        
+        except DeadlineExceeded as e:
+            logger.warning(f"LLM call for question {label} ran out of time: {e}")
+            answer = DEADLINE_ANSWER
+            rationale = ""
+
+    # 7. Score is the retrieval confidence
+    score = confidence if confidence is not None else 0.0
+
+    # 8. Save answer to DB
+    try:
+        a_obj = Answer(
+            question_id=q_obj.id, 
+            answer_text=answer, 
+            rationale=rationale, 
+            clause_reference=clause_ref, 
+            score=score
+        )
+        db.add(a_obj)
+        db.commit()
+        logger.info(f"Saved answer for question {label} to database")
+    except Exception as e:
+        logger.error(f"DB save answer failed: {e}")
+        db.rollback()
+
+    # Return structured answer
+    return {
+        "answer": answer,
+        "question": question,
+        "score": str(score)  # Convert score to string to ensure compatibility
+    }
+
+
+async def process_query_pipeline(request: HackrxRequest, deadline: Optional[Deadline] = None) -> HackrxResponse:
+    """
+    Main pipeline for processing document upload and answering questions.
+    Optimized with parallel processing for faster response times.
+    
+    The request deadline is split between ingestion and answering and is visible to every
+    download, embedding and LLM call made on its behalf. Questions still unanswered when
+    it runs out get a placeholder answer instead of holding up the response. Questions whose
+    LLM call failed get LLM_ERROR_ANSWER; only if every question failed is LLMError raised.
+    
+    Args:
+        request: HackrxRequest containing documents or a pre-indexed document_id, and questions
+        deadline: Request deadline (defaults to REQUEST_DEADLINE_SECONDS from now)
+        
+    Returns:
+        HackrxResponse with answers for all questions
+    """
+    deadline = deadline or Deadline(REQUEST_DEADLINE_SECONDS)
+    doc_id = request.document_id or str(uuid.uuid4())
+    # Pinned so a retention sweep cannot evict the document while it is being answered
+    with deadline_scope(deadline), document_lifecycle.pin(doc_id), request_profiler.profile_request():
+        return await _run_pipeline(request, deadline, doc_id)
 
-            # 7. Calculate score (placeholder: 1.0 for now)
-            try:
-                score = calculate_score(True, 1.0, 1.0)
-            except Exception as e:
-                logger.error(f"Scoring failed: {e}")
-                score = 0.0
 
-            # 8. Save answer to DB
+@profile_stage("pipeline")
+async def _run_pipeline(request: HackrxRequest, deadline: Deadline, doc_id: str) -> HackrxResponse:
+    db = SessionLocal()
+    try:
+        if request.document_id:
+            # Document was pre-ingested through /api/v1/documents; skip straight to answering
+            doc_obj = get_indexed_document(db, doc_id)
+            if doc_obj is None:
+                raise DocumentNotIndexedError(f"Document {doc_id} is not indexed")
+            logger.info(f"Using pre-indexed document {doc_id}")
+        else:
+            doc_obj = None
             try:
-                a_obj = Answer(
-                    question_id=q_obj.id, 
-                    answer_text=answer, 
-                    rationale=rationale, 
-                    clause_reference=clause_ref, 
-                    score=score
-                )
-                db.add(a_obj)
-                db.commit()
-                logger.info(f"Saved answer for question {i+1} to database")
-            except Exception as e:
-                logger.error(f"DB save answer failed: {e}")
-                db.rollback()
+                with deadline_scope(deadline.sub(DEADLINE_INGESTION_FRACTION)) as stage:
+                    doc_obj, _ = await asyncio.wait_for(index_document(request.documents, doc_id, db), stage.remaining())
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("Document ingestion exceeded its deadline budget")
 
-            # Return structured answer
-            return {
-                "answer": answer,
-                "question": question,
-                "score": str(score)  # Convert score to string to ensure compatibility
-            }
+        # One embedding request and one confidence calibration for all questions
+        retrieval = asyncio.ensure_future(retrieve_for_questions(request.questions, doc_id))
+
+        async def process_question(i, question):
+            # Shielded so one question hitting the deadline does not cancel retrieval for the others
+            matches, confidences = await asyncio.shield(retrieval)
+            return await answer_question(question, doc_obj, doc_id, db, f"{i+1}/{len(request.questions)}",
+                                         matches[i], confidences[i])
         
-        # Process all questions in parallel
-        tasks = [process_question(i, question) for i, question in enumerate(request.questions)]
-        answer_strings = await asyncio.gather(*tasks)
+        # Process all questions in parallel, stopping at the request deadline
+        tasks = [asyncio.ensure_future(process_question(i, question)) for i, question in enumerate(request.questions)]
+        done, pending = await asyncio.wait(tasks, timeout=max(0.0, deadline.remaining() - DEADLINE_RESPONSE_MARGIN))
+        for task in pending:
+            task.cancel()
+        retrieval.cancel()
+        if pending:
+            logger.warning(f"Request deadline reached with {len(pending)}/{len(tasks)} questions unanswered")
 
-        db.close()
+        answer_strings = []
+        llm_errors = []
+        for task, question in zip(tasks, request.questions):
+            if task in done and not isinstance(task.exception(), LLMError):
+                answer_strings.append(task.result())
+                continue
+            if task in done:
+                llm_errors.append(task.exception())
+            answer_strings.append({
+                "answer": DEADLINE_ANSWER if task not in done else LLM_ERROR_ANSWER,
+                "question": question,
+                "score": "0.0"
+            })
+        if llm_errors:
+            logger.warning(f"LLM failed for {len(llm_errors)}/{len(tasks)} questions: {llm_errors[0]}")
+
+        # Record the query for LRU retention
+        try:
+            doc_obj.last_queried_at = datetime.utcnow()
+            db.commit()
+        except Exception as e:
+            logger.warning(f"Failed to update last query time for document {doc_id}: {e}")
+            db.rollback()
+
+        if llm_errors and len(llm_errors) == len(tasks):
+            raise llm_errors[0]
         logger.info(f"Pipeline completed successfully. Generated {len(answer_strings)} answers.")
         return HackrxResponse(answers=answer_strings)
         
+    except (DocumentNotIndexedError, LLMError):
+        raise
     except Exception as e:
         logger.error(f"Pipeline failed: {e}")
         # Return error response with structured format
@@ -169,3 +335,5 @@ Answer:"""
             "question": "Error",
             "score": "0.0"  # Use string format for score
         }])
+    finally:
+        db.close()
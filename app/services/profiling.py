@@ -0,0 +1,330 @@
+# On-demand request profiling: stack sampling by pipeline stage and tracemalloc allocations
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import logging
+from app.core.config import (
+    PROFILING_OUTPUT_DIR, PROFILING_SAMPLE_INTERVAL_MS, PROFILING_MAX_SECONDS, PROFILING_TRACEMALLOC_FRAMES
+)
+
+logger = logging.getLogger(__name__)
+
+STAGE_OTHER = "other"
+
+SESSION_RUNNING = "running"
+SESSION_COMPLETED = "completed"
+SESSION_FAILED = "failed"
+
+# Code objects of stage entry points -> stage name. The innermost one on a stack names its stage.
+_stage_codes: Dict[object, str] = {}
+# filename -> [(first line, last line, stage)], for attributing tracemalloc frames
+_stage_lines: Dict[str, List[Tuple[int, int, str]]] = {}
+
+# Leaf frames of threads that are waiting for work rather than doing it
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def profile_stage(stage: str):
+    """
+    Mark a function as the entry point of a pipeline stage for profiling.
+
+    The function is returned unchanged; only its code object is registered, so marking
+    costs nothing at call time. Profiles attribute each sample or allocation to the
+    innermost marked function on its stack, on the event loop and in worker threads alike.
+    """
+    def register(func):
+        code = func.__code__
+        _stage_codes[code] = stage
+        last = max((line for _, _, line in code.co_lines() if line is not None), default=code.co_firstlineno)
+        _stage_lines.setdefault(code.co_filename, []).append((code.co_firstlineno, last, stage))
+        return func
+    return register
+
+
+def _frame_label(code) -> str:
+    # Collapsed-stack format separates frames with ';'
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _stage_for_line(filename: str, lineno: int) -> Optional[str]:
+    best = None
+    for first, last, stage in _stage_lines.get(filename, ()):
+        if first <= lineno <= last and (best is None or last - first < best[1] - best[0]):
+            best = (first, last, stage)
+    return best[2] if best else None
+
+
+class _StackSampler(threading.Thread):
+    """Samples the stacks of all threads while profiled requests are in flight."""
+
+    def __init__(self, session: "ProfilingSession"):
+        super().__init__(name="request-profiler", daemon=True)
+        self.session = session
+        self.samples: Counter = Counter()
+        self.stopping = threading.Event()
+
+    def run(self):
+        interval = self.session.interval
+        me = threading.get_ident()
+        while not self.stopping.wait(interval):
+            if not self.session.in_flight:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                leaf = codes[0]
+                if (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_FRAMES:
+                    continue
+                stage = next((_stage_codes[c] for c in codes if c in _stage_codes), STAGE_OTHER)
+                self.samples[(stage, tuple(reversed(codes)))] += 1
+
+
+class ProfilingSession:
+    """One profiling window: the next `requests` sampled requests and/or the next `seconds`."""
+
+    def __init__(self, requests: Optional[int], seconds: Optional[float], sample_rate: float,
+                 memory: bool, interval_ms: float, output_dir: str):
+        self.session_id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        self.requests = requests
+        self.seconds = min(seconds or PROFILING_MAX_SECONDS, PROFILING_MAX_SECONDS)
+        self.sample_rate = sample_rate
+        self.memory = memory
+        self.interval = interval_ms / 1000
+        self.output_dir = os.path.join(output_dir, self.session_id)
+
+        self.status = SESSION_RUNNING
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.requests_seen = 0
+        self.requests_profiled = 0
+        self.requests_completed = 0
+        self.in_flight = 0
+        self.files: List[str] = []
+        self.summary: Dict = {}
+
+        self.done = asyncio.Event()
+        self._sampler = _StackSampler(self)
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def accepting(self) -> bool:
+        return self.status == SESSION_RUNNING and (self.requests is None or self.requests_profiled < self.requests)
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start(PROFILING_TRACEMALLOC_FRAMES)
+            self._baseline = tracemalloc.take_snapshot()
+        self._sampler.start()
+
+    def finish(self):
+        """Stop sampling and write the profile files. Blocking; run off the event loop."""
+        self._sampler.stopping.set()
+        self._sampler.join()
+        memory = None
+        if self.memory:
+            # Leave out the profiler's own bookkeeping and module imports
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>", all_frames=True),
+            ])
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            memory = (snapshot, peak)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._write_samples()
+            if memory:
+                self._write_memory(*memory)
+            self._write_summary()
+            self.status = SESSION_COMPLETED
+        except Exception as e:
+            logger.error(f"Failed to write profile {self.session_id}: {e}")
+            self.status = SESSION_FAILED
+            self.error = str(e)
+        self.finished_at = time.time()
+        logger.info(f"Profiling session {self.session_id} {self.status}: {self.requests_profiled} requests, "
+                    f"output in {self.output_dir}")
+
+    def _write_file(self, name: str, lines: List[str]):
+        with open(os.path.join(self.output_dir, name), "w") as f:
+            f.write("\n".join(lines) + ("\n" if lines else ""))
+        self.files.append(name)
+
+    def _write_samples(self):
+        by_stage: Dict[str, List[str]] = {}
+        combined = []
+        stage_samples: Counter = Counter()
+        for (stage, codes), count in self._sampler.samples.most_common():
+            stack = ";".join(_frame_label(code) for code in codes)
+            by_stage.setdefault(stage, []).append(f"{stack} {count}")
+            combined.append(f"{stage};{stack} {count}")
+            stage_samples[stage] += count
+        # One flame graph per stage, plus one for everything with the stage as the root frame
+        for stage, lines in by_stage.items():
+            self._write_file(f"wall.{stage}.collapsed", lines)
+        self._write_file("wall.collapsed", combined)
+        self.summary['wall_samples'] = dict(stage_samples)
+        # Summed over threads, so stages running in parallel can add up to more than the elapsed time
+        self.summary['thread_seconds_by_stage'] = {stage: count * self.interval for stage, count in stage_samples.items()}
+
+    def _write_memory(self, snapshot: tracemalloc.Snapshot, peak: int):
+        lines = []
+        stage_bytes: Counter = Counter()
+        top = []
+        for diff in snapshot.compare_to(self._baseline, "traceback"):
+            if diff.size_diff <= 0:
+                continue
+            frames = list(diff.traceback)  # oldest first
+            stage = next((s for s in (_stage_for_line(f.filename, f.lineno) for f in reversed(frames)) if s),
+                         STAGE_OTHER)
+            stack = ";".join(f"{os.path.basename(f.filename)}:{f.lineno}".replace(";", ",") for f in frames)
+            lines.append(f"{stage};{stack} {diff.size_diff}")
+            stage_bytes[stage] += diff.size_diff
+            if len(top) < 20:
+                top.append({'stage': stage, 'bytes': diff.size_diff, 'count': diff.count_diff,
+                            'location': f"{frames[-1].filename}:{frames[-1].lineno}" if frames else None})
+        self._write_file("memory.collapsed", lines)
+        self.summary['memory_peak_bytes'] = peak
+        self.summary['memory_retained_bytes_by_stage'] = dict(stage_bytes)
+        self.summary['memory_top_allocations'] = top
+
+    def _write_summary(self):
+        self.summary.update({
+            'session_id': self.session_id,
+            'requests_profiled': self.requests_profiled,
+            'sample_interval_ms': self.interval * 1000,
+            'started_at': self.started_at,
+            'finished_at': time.time()
+        })
+        with open(os.path.join(self.output_dir, "summary.json"), "w") as f:
+            json.dump(self.summary, f, indent=2)
+        self.files.append("summary.json")
+
+    def to_dict(self) -> Dict:
+        return {
+            'session_id': self.session_id,
+            'status': self.status,
+            'error': self.error,
+            'requests': self.requests,
+            'seconds': self.seconds,
+            'sample_rate': self.sample_rate,
+            'memory': self.memory,
+            'interval_ms': self.interval * 1000,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'requests_seen': self.requests_seen,
+            'requests_profiled': self.requests_profiled,
+            'requests_completed': self.requests_completed,
+            'output_dir': self.output_dir,
+            'files': list(self.files),
+            'summary': self.summary
+        }
+
+
+class ProfilingSessionActive(RuntimeError):
+    """Raised when profiling is requested while a session is already running."""
+
+
+class RequestProfiler:
+    """
+    Turns profiling on for the next N requests or a time window, on demand.
+
+    While a session runs, a sampler thread records the stacks of all threads every
+    PROFILING_SAMPLE_INTERVAL_MS (wall time, so waits on downloads and the LLM show up)
+    whenever a profiled request is in flight, attributing each sample to the pipeline
+    stage marked with profile_stage(). tracemalloc optionally records the memory retained
+    per stage. Output is collapsed-stack files, usable with flamegraph.pl, speedscope or
+    inferno. With no session running, profile_request() is a single attribute check.
+    """
+
+    def __init__(self, output_dir: str = None, history: int = 20):
+        self.output_dir = output_dir or PROFILING_OUTPUT_DIR
+        self._session: Optional[ProfilingSession] = None
+        self._sessions = deque(maxlen=history)
+        self._watcher: Optional[asyncio.Task] = None
+
+    def start(self, requests: Optional[int] = None, seconds: Optional[float] = None, sample_rate: float = 1.0,
+              memory: bool = False, interval_ms: float = None) -> ProfilingSession:
+        """Start a session. Must be called from the event loop that serves requests."""
+        if self._session is not None:
+            raise ProfilingSessionActive(f"Profiling session {self._session.session_id} is already running")
+        session = ProfilingSession(requests, seconds, sample_rate, memory,
+                                   interval_ms or PROFILING_SAMPLE_INTERVAL_MS, self.output_dir)
+        session.start()
+        self._session = session
+        self._sessions.append(session)
+        self._watcher = asyncio.create_task(self._watch(session))
+        logger.info(f"Started profiling session {session.session_id} "
+                    f"(requests={requests}, seconds={session.seconds}, memory={memory})")
+        return session
+
+    async def _watch(self, session: ProfilingSession):
+        try:
+            await asyncio.wait_for(session.done.wait(), session.seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # Requests still in flight finish unprofiled
+            self._session = None
+            await asyncio.to_thread(session.finish)
+
+    async def stop(self) -> Optional[ProfilingSession]:
+        """End the running session now and write its output."""
+        session, watcher = self._session, self._watcher
+        if session is None:
+            return None
+        session.done.set()
+        await watcher
+        return session
+
+    def get_session(self, session_id: str) -> Optional[ProfilingSession]:
+        return next((s for s in self._sessions if s.session_id == session_id), None)
+
+    def list_sessions(self) -> List[ProfilingSession]:
+        return list(self._sessions)
+
+    @contextmanager
+    def profile_request(self):
+        """Count the enclosed request towards the running session, if any, and sample while it runs."""
+        session = self._session
+        if session is None or not session.accepting:
+            yield
+            return
+        session.requests_seen += 1
+        if random.random() >= session.sample_rate:
+            yield
+            return
+        session.requests_profiled += 1
+        session.in_flight += 1
+        try:
+            yield
+        finally:
+            session.in_flight -= 1
+            session.requests_completed += 1
+            if session.requests is not None and session.requests_completed >= session.requests:
+                session.done.set()
+
+
+# Global request profiler
+request_profiler = RequestProfiler()
@@ -0,0 +1,278 @@
+# Client-side request/token rate limiting for OpenAI API calls
+import asyncio
+import contextvars
+import functools
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Mapping, Optional, Tuple, TypeVar
+import logging
+from app.core.config import (
+    LLM_RPM_LIMIT, LLM_TPM_LIMIT, EMBEDDING_RPM_LIMIT, EMBEDDING_TPM_LIMIT,
+    RATE_LIMIT_HEADROOM, RATE_LIMIT_MAX_RETRIES, RATE_LIMIT_BACKOFF_BASE, RATE_LIMIT_BACKOFF_MAX,
+    RATE_LIMIT_THREADS
+)
+from app.services.deadline import current_deadline, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class RateLimitExceeded(RuntimeError):
+    """Raised by a rate-limited call when the API answers 429."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None, headers: Optional[Mapping] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.headers = headers or {}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset durations such as '1s', '6m0s' or '250ms' into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) used before the real usage is known."""
+    return max(1, len(text) // 4)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with full jitter, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF_BASE * (2 ** attempt)))
+    return max(delay, retry_after or 0.0)
+
+
+class _Bucket:
+    """Token bucket refilled continuously up to a per-minute budget. A budget of 0 is unlimited."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float):
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if self.unlimited:
+            return 0.0
+        amount = min(amount, self.capacity)  # Oversized requests wait for a full bucket
+        return 0.0 if self.level >= amount else (amount - self.level) * 60.0 / self.capacity
+
+
+class RateLimiter:
+    """
+    Shared limiter for one API (chat or embeddings) tracking requests and tokens per minute.
+
+    Callers are admitted strictly in arrival order, so a large request cannot be starved by
+    a stream of small ones. Budgets adapt to the x-ratelimit-* headers the API returns, and
+    a 429 pauses every caller until the server's reset time has passed.
+
+    Async callers use run_async(), which blocks in the limiter's own bounded thread pool
+    rather than the event loop's default executor, so a saturated limiter cannot take every
+    default worker thread away from parsing and FAISS work.
+    """
+
+    def __init__(self, name: str, rpm: int, tpm: int, headroom: float = None, threads: int = None):
+        self.name = name
+        self.headroom = RATE_LIMIT_HEADROOM if headroom is None else headroom
+        self._requests = _Bucket(rpm * self.headroom)
+        self._tokens = _Bucket(tpm * self.headroom)
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._paused_until = 0.0
+        self._abandoned = set()
+        self._executor = ThreadPoolExecutor(max_workers=threads or RATE_LIMIT_THREADS,
+                                            thread_name_prefix=f"{name}-limiter")
+
+        self._admitted = 0
+        self._throttled = 0
+        self._waiting = 0
+        self._wait_seconds = 0.0
+
+    def acquire(self, tokens: int):
+        """
+        Block until one request using `tokens` tokens fits within both budgets.
+
+        Raises:
+            DeadlineExceeded: If the current request deadline passes while queued
+        """
+        start = time.monotonic()
+        deadline = current_deadline()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if deadline is not None and deadline.expired:
+                        # Give up our place in line without holding up the callers behind us
+                        if ticket == self._serving:
+                            self._advance()
+                        else:
+                            self._abandoned.add(ticket)
+                        self._cond.notify_all()
+                        raise DeadlineExceeded(f"Request deadline exceeded while waiting for {self.name} rate limit")
+                    limit = deadline.remaining() if deadline is not None else None
+                    if ticket != self._serving:
+                        self._cond.wait(timeout=limit)
+                        continue
+                    self._requests.refill(now)
+                    self._tokens.refill(now)
+                    wait = max(self._paused_until - now, self._requests.wait_time(1), self._tokens.wait_time(tokens))
+                    if wait <= 0:
+                        self._requests.level -= 1
+                        self._tokens.level -= tokens
+                        self._advance()
+                        self._admitted += 1
+                        self._wait_seconds += now - start
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(timeout=wait if limit is None else min(wait, limit))
+            finally:
+                self._waiting -= 1
+
+    def _advance(self):
+        self._serving += 1
+        while self._serving in self._abandoned:
+            self._abandoned.remove(self._serving)
+            self._serving += 1
+
+    def record_usage(self, estimated: int, actual: Optional[int]):
+        """Correct the token bucket once the real token usage of a request is known."""
+        if actual is None:
+            return
+        with self._cond:
+            self._tokens.level += estimated - actual
+            self._cond.notify_all()
+
+    def update_from_headers(self, headers: Optional[Mapping]):
+        """Adapt budgets and current levels to the server's x-ratelimit-* headers."""
+        if not headers:
+            return
+        with self._cond:
+            for bucket, kind in ((self._requests, "requests"), (self._tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                try:
+                    if limit is not None:
+                        if bucket.unlimited:
+                            bucket.level = float(limit) * self.headroom
+                        bucket.capacity = float(limit) * self.headroom
+                    if remaining is not None:
+                        # Leave the same headroom on what the server says is left
+                        allowed = float(remaining) - (1 - self.headroom) * (float(limit) if limit else 0.0)
+                        bucket.level = min(bucket.level, max(allowed, 0.0))
+                except ValueError:
+                    continue
+            self._cond.notify_all()
+
+    def on_rate_limited(self, retry_after: Optional[float], headers: Optional[Mapping] = None):
+        """Pause all callers after a 429 until the server's reset time has passed."""
+        if retry_after is None and headers:
+            retry_after = max(
+                parse_duration(headers.get("x-ratelimit-reset-requests")) or 0.0,
+                parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0.0
+            ) or None
+        with self._cond:
+            self._throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + (retry_after or 1.0))
+            self.update_from_headers(headers)
+
+    def call(self, tokens: int, fn: Callable[[], Tuple[T, Optional[Mapping], Optional[int]]]) -> T:
+        """
+        Run `fn` under the limiter, retrying 429s with jittered exponential backoff.
+
+        Args:
+            tokens: Estimated tokens the call will consume
+            fn: Callable returning (result, response headers, actual tokens used) or
+                raising RateLimitExceeded
+
+        Returns:
+            The result of `fn`
+        """
+        for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+            self.acquire(tokens)
+            try:
+                result, headers, used = fn()
+            except RateLimitExceeded as e:
+                self.on_rate_limited(e.retry_after, e.headers)
+                if attempt == RATE_LIMIT_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt, e.retry_after)
+                deadline = current_deadline()
+                if deadline is not None and deadline.remaining() < delay:
+                    raise DeadlineExceeded(f"Request deadline exceeded while backing off from {self.name} rate limit")
+                logger.warning(f"{self.name} rate limited, retrying in {delay:.2f}s (attempt {attempt + 1})")
+                time.sleep(delay)
+                continue
+            self.update_from_headers(headers)
+            self.record_usage(tokens, used)
+            return result
+
+    async def run_async(self, fn: Callable[..., T], *args) -> T:
+        """Run fn(*args) on the limiter's thread pool, in the caller's context (deadline, profiling)."""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(context.run, fn, *args)
+        )
+
+    async def call_async(self, tokens: int, fn: Callable[[], Tuple[T, Optional[Mapping], Optional[int]]]) -> T:
+        """Async call(): queues and retries on the limiter's thread pool."""
+        return await self.run_async(self.call, tokens, fn)
+
+    def get_stats(self) -> Dict:
+        with self._cond:
+            return {
+                'name': self.name,
+                'rpm_budget': self._requests.capacity,
+                'tpm_budget': self._tokens.capacity,
+                'requests_available': self._requests.level,
+                'tokens_available': self._tokens.level,
+                'waiting': self._waiting,
+                'paused_seconds': max(0.0, self._paused_until - time.monotonic()),
+                'admitted': self._admitted,
+                'throttled': self._throttled,
+                'avg_wait_seconds': self._wait_seconds / self._admitted if self._admitted else 0.0
+            }
+
+
+def retry_after_from_headers(headers: Optional[Mapping]) -> Optional[float]:
+    """Read Retry-After (seconds) or retry-after-ms from a 429 response."""
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000.0
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+# Shared limiters for the chat and embeddings endpoints
+chat_limiter = RateLimiter("chat", LLM_RPM_LIMIT, LLM_TPM_LIMIT)
+embedding_limiter = RateLimiter("embeddings", EMBEDDING_RPM_LIMIT, EMBEDDING_TPM_LIMIT)
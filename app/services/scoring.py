@@ -1,7 +1,53 @@
 # Scoring logic for hackathon
 # TODO: Implement document/question weight logic as per rules
+from typing import Sequence
+import numpy as np
+from app.core.config import (
+    RETRIEVAL_CONFIDENCE_CENTER, RETRIEVAL_CONFIDENCE_SCALE, RETRIEVAL_CONFIDENCE_MARGIN_WEIGHT
+)
 
 def calculate_score(is_correct: bool, doc_weight: float, q_weight: float) -> float:
     if not is_correct:
         return 0.0
     return doc_weight * q_weight
+
+def retrieval_confidence(scores: Sequence[Sequence[float]], center: float = None, scale: float = None,
+                         margin_weight: float = None) -> np.ndarray:
+    """
+    Confidence that retrieval found an answer, for each question of a request at once.
+
+    A logistic model of each question's FAISS cosine scores (best first): the best score
+    relative to `center`, plus a bonus for how far it stands above the question's other
+    matches. A question with no matches gets 0.
+
+    Args:
+        scores: Per question, the cosine scores of its matches in descending order
+        center: Best score at which confidence is 0.5 (RETRIEVAL_CONFIDENCE_CENTER)
+        scale: Score difference that multiplies the odds by e (RETRIEVAL_CONFIDENCE_SCALE)
+        margin_weight: Weight of the best-minus-mean-of-rest margin (RETRIEVAL_CONFIDENCE_MARGIN_WEIGHT)
+
+    Returns:
+        Array of confidences in [0, 1], one per question
+    """
+    center = RETRIEVAL_CONFIDENCE_CENTER if center is None else center
+    scale = RETRIEVAL_CONFIDENCE_SCALE if scale is None else scale
+    margin_weight = RETRIEVAL_CONFIDENCE_MARGIN_WEIGHT if margin_weight is None else margin_weight
+
+    lengths = np.array([len(s) for s in scores], dtype=np.int64)
+    width = int(lengths.max()) if len(lengths) else 0
+    if width == 0:
+        return np.zeros(len(lengths))
+
+    # Ragged score lists -> one zero-padded (questions x matches) matrix
+    present = np.arange(width) < lengths[:, None]
+    matrix = np.zeros((len(lengths), width))
+    matrix[present] = np.concatenate([np.asarray(s, dtype=np.float64) for s in scores if len(s)])
+
+    best = matrix[:, 0]
+    rest = np.maximum(lengths - 1, 0)
+    rest_mean = matrix[:, 1:].sum(axis=1) / np.maximum(rest, 1)
+    margin = np.where(rest > 0, best - rest_mean, 0.0)
+
+    z = (best - center + margin_weight * margin) / scale
+    confidence = 1.0 / (1.0 + np.exp(-np.clip(z, -50.0, 50.0)))
+    return np.where(lengths > 0, confidence, 0.0)
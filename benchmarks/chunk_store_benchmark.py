@@ -0,0 +1,89 @@
+"""
+Compare the legacy per-chunk metadata dicts with the columnar ChunkStore.
+
+Measures Python heap usage after building/loading and on-disk load time.
+
+Usage:
+    python -m benchmarks.chunk_store_benchmark --chunks 1000000 --docs 2000
+"""
+import argparse
+import gc
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from app.services.chunk_store import ChunkStore
+
+
+def measure(label, fn):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {elapsed:8.3f}s {current / 1e6:10.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200_000)
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--chunk-size", type=int, default=800, help="Characters per chunk")
+    args = parser.parse_args()
+
+    doc_ids = [str(uuid.uuid4()) for _ in range(args.docs)]
+    per_doc = max(1, args.chunks // args.docs)
+    text = ("The insured shall be covered for in-patient hospitalisation expenses. " * 20)[:args.chunk_size]
+
+    def build_dicts():
+        metadata, vector_ids = [], []
+        for doc_id in doc_ids:
+            for i in range(per_doc):
+                metadata.append({'text': text + str(i), 'doc_id': doc_id, 'chunk_index': i, 'chunk_type': 'document_segment'})
+                vector_ids.append(f"{doc_id}_chunk_{i}")
+        return {'metadata': metadata, 'vector_ids': vector_ids}
+
+    def build_store():
+        store = ChunkStore()
+        texts = [text + str(i) for i in range(per_doc)]
+        for doc_id in doc_ids:
+            store.append(texts, doc_id)
+        return store
+
+    print(f"{args.docs} documents x {per_doc} chunks = {args.docs * per_doc} chunks")
+    print(f"{'':<28} {'time':>9} {'heap':>13}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pkl_path = os.path.join(tmp, "metadata.pkl")
+        npz_path = os.path.join(tmp, "chunks.npz")
+
+        legacy = measure("build dict list", build_dicts)
+        with open(pkl_path, 'wb') as f:
+            pickle.dump(legacy, f)
+        del legacy
+
+        store = measure("build ChunkStore", build_store)
+        store.save(npz_path)
+        del store
+
+        def load_pickle():
+            with open(pkl_path, 'rb') as f:
+                return pickle.load(f)
+
+        legacy = measure("load pickle", load_pickle)
+        del legacy
+        store = measure("load ChunkStore", lambda: ChunkStore.load(npz_path))
+        del store
+
+        print(f"{'file size pickle':<28} {os.path.getsize(pkl_path) / 1e6:10.1f} MB")
+        print(f"{'file size npz':<28} {os.path.getsize(npz_path) / 1e6:10.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Compare streaming DOCX extraction with the python-docx object-tree path.
+
+Generates a large synthetic policy document (paragraphs plus schedule tables) and runs
+each extractor in a fresh subprocess to report wall time, throughput and peak RSS.
+
+Usage:
+    python -m benchmarks.docx_extraction_benchmark --paragraphs 50000 --tables 500
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def build_document(path: str, paragraphs: int, tables: int):
+    from docx import Document
+
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = "National Parivar Mediclaim Plus Policy"
+    sentence = "The insured shall be indemnified for in-patient hospitalisation expenses subject to the sum insured. "
+    every = max(1, paragraphs // max(tables, 1))
+    for i in range(paragraphs):
+        doc.add_paragraph(f"{i}. " + sentence * 3)
+        if tables and i % every == 0:
+            table = doc.add_table(rows=5, cols=3)
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    cell.text = f"Plan {r}-{c}: limit {r * 10000 + c}"
+    doc.save(path)
+
+
+def run_python_docx(path: str) -> int:
+    from docx import Document
+
+    doc = Document(path)
+    text = "\n\n".join(p.text.strip() for p in doc.paragraphs if p.text.strip())
+    return len(text)
+
+
+def run_streaming(path: str) -> int:
+    from app.services.docx_parser import iter_docx_text
+
+    return sum(len(block) for block in iter_docx_text(path))
+
+
+def measure(mode: str, path: str):
+    """Run one extractor in this process and print chars, seconds and peak RSS."""
+    start = time.perf_counter()
+    chars = run_streaming(path) if mode == "streaming" else run_python_docx(path)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{chars} {elapsed} {peak_kb}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=20000)
+    parser.add_argument("--tables", type=int, default=200)
+    parser.add_argument("--file", help="Benchmark an existing DOCX file instead of generating one")
+    parser.add_argument("--measure", choices=["streaming", "python-docx"], help=argparse.SUPPRESS)
+    parser.add_argument("--build", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.file)
+        return
+    if args.build:
+        build_document(args.file, args.paragraphs, args.tables)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.file
+        if not path:
+            path = os.path.join(tmp, "policy.docx")
+            # Built in a child process so this process stays small: peak RSS carries over fork+exec
+            subprocess.run([
+                sys.executable, "-m", "benchmarks.docx_extraction_benchmark", "--build", "--file", path,
+                "--paragraphs", str(args.paragraphs), "--tables", str(args.tables)
+            ], check=True)
+        print(f"{path}: {os.path.getsize(path) / 1e6:.1f} MB compressed")
+        print(f"{'extractor':<12} {'chars':>12} {'time':>9} {'Mchar/s':>8} {'peak RSS':>10}")
+        for mode in ("python-docx", "streaming"):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.docx_extraction_benchmark", "--measure", mode, "--file", path],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            chars, elapsed, peak_kb = int(out[0]), float(out[1]), int(out[2])
+            print(f"{mode:<12} {chars:>12} {elapsed:8.2f}s {chars / elapsed / 1e6:8.1f} {peak_kb / 1024:8.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
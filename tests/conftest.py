@@ -0,0 +1,10 @@
+"""
+Test settings, applied before the app's config module is imported.
+
+Tests use the offline hashing embeddings and never reach OpenAI or a real database.
+"""
+import os
+
+os.environ.setdefault("EMBEDDING_PROVIDER", "hashing")
+os.environ.setdefault("POSTGRES_URL", "sqlite://")
+os.environ.setdefault("FAISS_SHARD_AUTHKEY", "test-shard-authkey")
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from app.services.admission import AdmissionController, AdmissionRejected
+
+
+def controller(**kwargs):
+    options = dict(max_questions=5, max_ingest_bytes=100, document_bytes=100, max_upstream_waiting=100,
+                   queue_size=10, queue_timeout=5.0, enabled=True)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+async def queued(admission, count):
+    while admission.get_stats()['queue_depth'] < count:
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_admitted_in_priority_order():
+    async def scenario():
+        admission = controller()
+        order = []
+        release = asyncio.Event()
+
+        async def request(name, questions, inline_document):
+            async with admission.admit(questions, inline_document):
+                order.append(name)
+
+        async def holder():
+            async with admission.admit(5, False):
+                await release.wait()
+
+        held = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        # Arrival order is the reverse of the expected admission order
+        tasks = []
+        for i, args in enumerate([("inline", 1, True), ("large", 4, False), ("small", 2, False)]):
+            tasks.append(asyncio.create_task(request(*args)))
+            await queued(admission, i + 1)
+        release.set()
+        await asyncio.gather(held, *tasks)
+        return order
+
+    # Pre-ingested documents go first, smaller question sets before larger ones
+    assert asyncio.run(scenario()) == ["small", "large", "inline"]
+
+
+def test_full_queue_is_rejected_with_429():
+    async def scenario():
+        admission = controller(queue_size=1)
+        release = asyncio.Event()
+
+        async def hold(questions):
+            async with admission.admit(questions, False):
+                await release.wait()
+
+        held = asyncio.create_task(hold(5))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(hold(1))
+        await queued(admission, 1)
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with admission.admit(1, False):
+                pass
+        release.set()
+        await asyncio.gather(held, waiting)
+        return rejected.value
+
+    assert asyncio.run(scenario()).status_code == 429
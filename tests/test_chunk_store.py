@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from app.services.chunk_store import MAX_CHUNK_TYPES, ChunkStore
+
+
+def records(store):
+    return [store.record(r).to_dict() for r in range(len(store))]
+
+
+def test_save_load_round_trip(tmp_path):
+    store = ChunkStore()
+    store.append(["alpha", "beta"], "doc-a", chunk_type=["text", "table"])
+    store.append(["gamma ünïcode"], "doc-b", vector_ids=["custom-id"])
+    path = str(tmp_path / "chunks.npz")
+    store.save(path)
+
+    loaded = ChunkStore.load(path)
+    assert len(loaded) == 3
+    assert records(loaded) == records(store)
+    assert [loaded.vector_id(r) for r in range(3)] == ["doc-a_chunk_0", "doc-a_chunk_1", "custom-id"]
+    assert sorted(loaded.doc_ids()) == ["doc-a", "doc-b"]
+
+
+def test_round_trip_keeps_tombstoned_and_reingested_rows_apart(tmp_path):
+    store = ChunkStore()
+    store.append(["old 0", "old 1"], "doc-a")
+    store.append(["other"], "doc-b")
+    assert store.tombstone(["doc-a"]) == 2
+    store.append(["new 0"], "doc-a")
+    path = str(tmp_path / "chunks.npz")
+    store.save(path)
+
+    loaded = ChunkStore.load(path)
+    # The first copy of doc-a stays dead; the re-ingested copy is live under the same id
+    np.testing.assert_array_equal(loaded.dead_mask(), [True, True, False, False])
+    assert sorted(loaded.doc_ids()) == ["doc-a", "doc-b"]
+    assert loaded.doc_ordinal("doc-a") == loaded.doc_ordinals[3]
+
+    loaded.tombstone(["doc-b"])
+    np.testing.assert_array_equal(loaded.dead_mask(), [True, True, True, False])
+    assert loaded.doc_ids() == ["doc-a"]
+
+
+def test_take_and_extend_keep_retired_rows_dead():
+    store = ChunkStore()
+    store.append(["old"], "doc-a")
+    store.tombstone(["doc-a"])
+    store.append(["new"], "doc-a")
+
+    taken = store.take([0, 1])
+    np.testing.assert_array_equal(taken.dead_mask(), [True, False])
+    assert taken.doc_ids() == ["doc-a"]
+
+    merged = ChunkStore()
+    merged.extend(taken)
+    np.testing.assert_array_equal(merged.dead_mask(), [True, False])
+    assert [merged.text(r) for r in range(2)] == ["old", "new"]
+
+
+def test_chunk_type_limit():
+    store = ChunkStore()
+    store.append([f"chunk {i}" for i in range(MAX_CHUNK_TYPES)], "doc-a",
+                 chunk_type=[f"type-{i}" for i in range(MAX_CHUNK_TYPES)])
+    assert store.record(MAX_CHUNK_TYPES - 1)['chunk_type'] == f"type-{MAX_CHUNK_TYPES - 1}"
+
+    with pytest.raises(ValueError):
+        store.append(["one too many"], "doc-b", chunk_type="overflow")
+    # A rejected append leaves the store untouched
+    assert len(store) == MAX_CHUNK_TYPES
+    assert store.doc_ordinal("doc-b") is None
+    store.append(["known type"], "doc-b", chunk_type="type-0")
+    assert len(store) == MAX_CHUNK_TYPES + 1
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.services.faiss_shards import HashRing, ShardedFaissIndex
+
+DOC_IDS = [f"doc-{i}" for i in range(2000)]
+
+
+def test_ring_placement_is_deterministic():
+    assert [HashRing(4).shard_for(d) for d in DOC_IDS] == [HashRing(4).shard_for(d) for d in DOC_IDS]
+    assert set(HashRing(4).shard_for(d) for d in DOC_IDS) == {0, 1, 2, 3}
+
+
+def test_growing_the_ring_only_moves_documents_to_the_new_shard():
+    old, new = HashRing(4), HashRing(5)
+    moved = [d for d in DOC_IDS if old.shard_for(d) != new.shard_for(d)]
+
+    assert all(new.shard_for(d) == 4 for d in moved)
+    # Consistent hashing moves roughly 1/N of the documents
+    assert 0.1 < len(moved) / len(DOC_IDS) < 0.3
+
+
+def test_shrinking_the_ring_only_moves_documents_off_the_removed_shard():
+    old, new = HashRing(5), HashRing(4)
+    moved = [d for d in DOC_IDS if old.shard_for(d) != new.shard_for(d)]
+
+    assert moved
+    assert all(old.shard_for(d) == 4 for d in moved)
+
+
+@pytest.fixture
+def shard_paths(tmp_path):
+    # Short socket directory: Unix socket paths are limited to ~100 bytes
+    return dict(dim=8, index_path=str(tmp_path / "index"), socket_dir=str(tmp_path / "s"))
+
+
+def test_rebalance_is_followed_by_other_processes(shard_paths):
+    rng = np.random.default_rng(0)
+    vectors = {f"doc-{i}": rng.standard_normal((2, 8)).astype(np.float32) for i in range(20)}
+    owner = ShardedFaissIndex(num_shards=2, spawn=True, **shard_paths)
+    # A second instance finds the shards owned and connects to them, like a further uvicorn worker
+    worker = ShardedFaissIndex(spawn=True, **shard_paths)
+    try:
+        assert not worker.spawn
+        for doc_id, doc_vectors in vectors.items():
+            worker.upsert_document(doc_vectors.tolist(), [f"{doc_id} a", f"{doc_id} b"], doc_id)
+
+        moved = owner.rebalance(3)
+
+        assert moved > 0
+        for doc_id, doc_vectors in vectors.items():
+            results = worker.query(doc_vectors[0].tolist(), top_k=2, doc_id=doc_id)
+            assert {r['metadata']['doc_id'] for r in results} == {doc_id}
+        assert worker.ring.num_shards == 3
+        placement = {shard: set(client.call("doc_ids")) for shard, client in owner._clients.items()}
+        assert all(doc_id in placement[owner.ring.shard_for(doc_id)] for doc_id in vectors)
+        assert sum(len(docs) for docs in placement.values()) == len(vectors)
+    finally:
+        worker.close()
+        owner.close()
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.services.chunk_store import ChunkStore
+from app.services.faiss_client import FaissIndex
+from app.services.index_snapshot import (
+    CHUNKS_FILE, MANIFEST_FILE, SnapshotError, load_snapshot, read_manifest, verify_snapshot, write_snapshot
+)
+
+DIM = 8
+DOCS = {"doc-a": 3, "doc-b": 2, "doc-c": 4}
+
+
+@pytest.fixture
+def library():
+    """Normalized vectors and row-aligned chunk metadata for a few documents."""
+    rng = np.random.default_rng(0)
+    chunks = ChunkStore()
+    blocks = []
+    for doc_id, count in DOCS.items():
+        chunks.append([f"{doc_id} chunk {i}" for i in range(count)], doc_id)
+        block = rng.standard_normal((count, DIM)).astype(np.float32)
+        blocks.append(block / np.linalg.norm(block, axis=1, keepdims=True))
+    documents = [{'document_id': d, 'name': d, 'source': d, 'chunks': n} for d, n in DOCS.items()]
+    return np.concatenate(blocks), chunks, documents
+
+
+@pytest.fixture
+def snapshot(tmp_path, library):
+    vectors, chunks, documents = library
+    return write_snapshot(vectors, chunks, str(tmp_path / "snapshots"), documents)
+
+
+def test_round_trip(tmp_path, library, snapshot):
+    vectors, chunks, _ = library
+    # The snapshot directory resolves to its LATEST version
+    index, loaded, manifest = load_snapshot(str(tmp_path / "snapshots"), DIM)
+
+    assert manifest['version'] == snapshot['version']
+    assert manifest['vectors'] == len(vectors)
+    np.testing.assert_allclose(index.reconstruct_n(0, index.ntotal), vectors)
+    assert [loaded.record(r).to_dict() for r in range(len(loaded))] == \
+           [chunks.record(r).to_dict() for r in range(len(chunks))]
+    assert sorted(loaded.doc_ids()) == sorted(DOCS)
+
+
+def test_partial_load_copies_only_the_requested_documents(library, snapshot):
+    vectors, chunks, _ = library
+    index, loaded, _ = load_snapshot(snapshot['path'], DIM, doc_ids=["doc-c", "doc-a"], verify=False)
+
+    rows = chunks.rows_for_docs(["doc-a", "doc-c"])
+    assert index.ntotal == len(rows) == DOCS["doc-a"] + DOCS["doc-c"]
+    np.testing.assert_allclose(index.reconstruct_n(0, index.ntotal), vectors[rows])
+    assert sorted(loaded.doc_ids()) == ["doc-a", "doc-c"]
+
+
+def test_corrupt_file_fails_verification(snapshot):
+    path = os.path.join(snapshot['path'], CHUNKS_FILE)
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+    with pytest.raises(SnapshotError, match="checksum"):
+        verify_snapshot(snapshot['path'], DIM)
+
+
+def test_dimension_mismatch_is_rejected(snapshot):
+    with pytest.raises(SnapshotError, match="dimension"):
+        load_snapshot(snapshot['path'], DIM * 2)
+
+
+def test_manifest_must_list_the_vectors(snapshot):
+    manifest_path = os.path.join(snapshot['path'], MANIFEST_FILE)
+    with open(manifest_path) as f:
+        text = f.read()
+    with open(manifest_path, "w") as f:
+        f.write(text.replace("vectors.npy", "index.faiss"))
+    with pytest.raises(SnapshotError, match="vectors.npy"):
+        read_manifest(snapshot['path'])
+
+
+def test_restore_replaces_the_index(tmp_path, library, snapshot):
+    vectors, _, _ = library
+    index = FaissIndex(dim=DIM, index_path=str(tmp_path / "index"))
+    index.upsert_document(vectors[:1].tolist(), ["stale"], "doc-stale")
+
+    index.restore_snapshot(snapshot['path'])
+
+    assert sorted(index.doc_ids()) == sorted(DOCS)
+    results = index.query(vectors[0].tolist(), top_k=10, doc_id="doc-a")
+    assert [r['metadata']['text'] for r in results][0] == "doc-a chunk 0"
+    assert len(results) == DOCS["doc-a"]
+    assert index.query(vectors[0].tolist(), top_k=10, doc_id="doc-stale") == []
+    # The restored contents are what a restart loads
+    reloaded = FaissIndex(dim=DIM, index_path=str(tmp_path / "index"))
+    assert reloaded.index.ntotal == len(vectors)
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from app.services.deadline import Deadline, DeadlineExceeded, deadline_scope
+from app.services.rate_limiter import RateLimiter
+
+# 600 tokens per minute refills 10 tokens a second
+TPM = 600
+
+
+@pytest.fixture
+def limiter():
+    limiter = RateLimiter("test", rpm=0, tpm=TPM, headroom=1.0, threads=1)
+    yield limiter
+    limiter._executor.shutdown(wait=False)
+
+
+def start_waiters(limiter, requests):
+    """Start one thread per (name, tokens, deadline) in order, each queued before the next starts."""
+    order, errors, threads = [], [], []
+
+    def run(name, tokens, deadline):
+        try:
+            with deadline_scope(deadline):
+                limiter.acquire(tokens)
+            order.append(name)
+        except DeadlineExceeded:
+            errors.append(name)
+
+    for i, (name, tokens, deadline) in enumerate(requests):
+        thread = threading.Thread(target=run, args=(name, tokens, deadline))
+        thread.start()
+        threads.append(thread)
+        while limiter.get_stats()['waiting'] < i + 1:
+            time.sleep(0.001)
+    return order, errors, threads
+
+
+def test_large_request_is_not_overtaken(limiter):
+    limiter._tokens.level = 0
+    order, errors, threads = start_waiters(limiter, [("large", 5, None), ("small-1", 1, None), ("small-2", 1, None)])
+    for thread in threads:
+        thread.join(timeout=5)
+
+    # The small requests would fit sooner, but wait their turn behind the large one
+    assert order == ["large", "small-1", "small-2"]
+    assert not errors
+
+
+def test_expired_waiter_gives_up_its_place(limiter):
+    limiter._tokens.level = 0
+    order, errors, threads = start_waiters(limiter, [
+        ("first", 2, None), ("expires", 2, Deadline(0.05)), ("last", 1, None)
+    ])
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert errors == ["expires"]
+    assert order == ["first", "last"]
+    assert limiter.get_stats()['waiting'] == 0